@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import re
+import resource
+import sys
+import time
+
+from eip4762 import AccessEventTracker
+from estimation import estimate_verkle_gas_cost_difference
+from trace_generator import generate_trace, parse_count
+from trace_parser import parse_trace_results
+from trace_tokenizer import tokenize
+
+DEFAULT_SIZES = "10k,1m,10m"
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "benchmark-baseline.json")
+DEFAULT_TOLERANCE = 0.2
+
+
+def usage():
+    print(f"usage: {sys.argv[0]} [options]")
+    print("measure the trace parsing and the estimation on synthetic traces (see trace_generator.py),")
+    print("and compare with a stored baseline. Exits with status 2 if a measure regressed.")
+    print("Options:")
+    print(f"  -sizes {{N,N..}} number of steps of the traces (default: {DEFAULT_SIZES})")
+    print("  -baseline {file} baseline to compare with (default: benchmark-baseline.json)")
+    print("  -save store the results as the new baseline")
+    print(f"  -tolerance {{ratio}} allowed slowdown (or memory growth) before reporting a regression "
+          f"(default: {DEFAULT_TOLERANCE})")
+    print("  -dir {dir} where the generated traces are kept (default: $VERKLE_CACHE_DIR/benchmark)")
+    print("  -tokenizer {trace-file} compare the tokenizer throughput (lines/sec) with the previous regex-per-line parsing")
+    sys.exit(1)
+
+
+def legacy_tokenize(lines):
+    """
+    the line parsing done by the previous parser: backtracking regexes, and every step line parsed twice
+    (once as the current line, and again as the "next" line of the previous step)
+    """
+    for line_number in range(len(lines)):
+        line = lines[line_number]
+        if "Traces:" in line:
+            break
+        if "CREATE CALL:" in line:
+            re.search(r"caller:(\w+).*salt: (\w+)_U256.* init_code:\"(\w+)\"", line).groups()
+            continue
+        if "SM CALL" in line:
+            re.search(r"address: (\w+).*code_address: (\w+).*scheme: (\w+).* value: (\w+)_U256", line).groups()
+            continue
+        if "depth:" in line:
+            re.search(
+                r"depth:(\d+).*PC:(\d+).*gas:\w+\((\w+)\).*OPCODE: \"(\w+)\".*refund:\w+\((\w+)\).*Stack:\[(.*)\]",
+                line).groups()
+            if "depth:" in lines[line_number + 1]:
+                re.search(r"gas:\w+\((\w+)\).*refund:\w+\((\w+)\).*Stack:\[(.*)\]", lines[line_number + 1]).groups()
+
+
+def measure(name, func, lines):
+    start = time.perf_counter()
+    func(lines)
+    elapsed = time.perf_counter() - start
+    print(f"{name:>10}: {elapsed:8.3f} sec {len(lines) / elapsed:12,.0f} lines/sec")
+    return elapsed
+
+
+def compare_tokenizers(path):
+    with open(path) as f:
+        lines = f.readlines()
+    print(f"{len(lines)} lines")
+    legacy = measure("legacy", legacy_tokenize, lines)
+    tokenizer = measure("tokenizer", lambda trace_lines: sum(1 for _ in tokenize(trace_lines)), lines)
+    print(f"speedup: {legacy / tokenizer:.2f}x")
+
+
+def trace_path(trace_dir, steps):
+    """
+    :return: the synthetic trace of the given number of steps, generated on first use
+    """
+    path = os.path.join(trace_dir, f"trace-{steps}.txt")
+    if not os.path.exists(path):
+        os.makedirs(trace_dir, exist_ok=True)
+        print(f"generating {path}")
+        with open(path + ".tmp", "w") as out:
+            generate_trace(out, steps=steps)
+        os.replace(path + ".tmp", path)
+    return path
+
+
+def run_phases(path):
+    """
+    tokenize, parse and estimate a trace, streamed from its file.
+    runs in a fresh process, so that its peak RSS is the one of this trace only.
+    :return: the measures, by name
+    """
+    with open(path) as f:
+        start = time.perf_counter()
+        line_count = sum(1 for _ in tokenize(f))
+        tokenize_time = time.perf_counter() - start
+
+    with open(path) as f, contextlib.redirect_stdout(open(os.devnull, "w")):
+        start = time.perf_counter()
+        trace_results = parse_trace_results(dict(txHash=path), f, AccessEventTracker())
+        parse_time = time.perf_counter() - start
+        # synthetic contracts: the code ends at the last accessed chunk
+        trace_results['code_sizes'] = {address: (code_chunks.max_chunk() + 1) * 31
+                                       for (address, code_chunks) in trace_results['chunks'].items()}
+        start = time.perf_counter()
+        estimate_verkle_gas_cost_difference(trace_results, {})
+        estimate_time = time.perf_counter() - start
+
+    return dict(
+        lines=line_count,
+        tokenize_sec=round(tokenize_time, 3),
+        parse_sec=round(parse_time, 3),
+        estimate_sec=round(estimate_time, 4),
+        lines_per_sec=round(line_count / parse_time),
+        # KiB on Linux
+        peak_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    )
+
+
+# for each measure: True if higher is better
+MEASURES = dict(tokenize_sec=False, parse_sec=False, estimate_sec=False, lines_per_sec=True, peak_rss_kb=False)
+
+
+def regressions(results, baseline, tolerance):
+    """
+    :return: a description of each measure worse than its baseline by more than the tolerance
+    """
+    found = []
+    for (size, measures) in results.items():
+        if size not in baseline:
+            continue
+        for (name, higher_is_better) in MEASURES.items():
+            (value, base) = (measures[name], baseline[size][name])
+            if base == 0 or value == 0:
+                continue
+            ratio = base / value if higher_is_better else value / base
+            if ratio > 1 + tolerance:
+                found.append(f"{size} steps: {name} {value} vs baseline {base} ({(ratio - 1) * 100:.0f}% worse)")
+    return found
+
+
+def main():
+    args = sys.argv[1:]
+    sizes = DEFAULT_SIZES
+    baseline_path = DEFAULT_BASELINE
+    save = False
+    tolerance = DEFAULT_TOLERANCE
+    trace_dir = os.path.join(
+        os.environ.get("VERKLE_CACHE_DIR", os.path.expanduser("~/.cache/verkle-gas-estimator")), "benchmark")
+    while len(args) > 0:
+        opt = args.pop(0)
+        if opt == "-sizes":
+            sizes = args.pop(0)
+        elif opt == "-baseline":
+            baseline_path = args.pop(0)
+        elif opt == "-save":
+            save = True
+        elif opt == "-tolerance":
+            tolerance = float(args.pop(0))
+        elif opt == "-dir":
+            trace_dir = args.pop(0)
+        elif opt == "-tokenizer":
+            compare_tokenizers(args.pop(0))
+            return
+        else:
+            usage()
+
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            stored = json.load(f)
+        baseline = stored['results']
+        if stored.get('machine') != platform.platform() or stored.get('python') != platform.python_version():
+            print(f"NOTE: baseline measured on {stored.get('machine')} with python {stored.get('python')}")
+
+    results = {}
+    print(f"{'steps':>10} {'lines/sec':>10} {'tokenize':>9} {'parse':>9} {'estimate':>9} {'peak RSS':>10}")
+    for size in sizes.split(","):
+        steps = parse_count(size)
+        path = trace_path(trace_dir, steps)
+        with multiprocessing.get_context("fork").Pool(1, maxtasksperchild=1) as pool:
+            measures = pool.apply(run_phases, (path,))
+        results[str(steps)] = measures
+        print(f"{steps:>10} {measures['lines_per_sec']:>10,} {measures['tokenize_sec']:>8.3f}s "
+              f"{measures['parse_sec']:>8.3f}s {measures['estimate_sec']:>8.3f}s {measures['peak_rss_kb'] // 1024:>7} MiB")
+
+    if save:
+        with open(baseline_path, "w") as f:
+            json.dump(dict(machine=platform.platform(), python=platform.python_version(), results=results), f, indent=2)
+            f.write("\n")
+        print(f"baseline saved to {baseline_path}")
+        return
+
+    found = regressions(results, baseline, tolerance)
+    for regression in found:
+        print(f"REGRESSION: {regression}")
+    if found:
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
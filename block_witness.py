@@ -0,0 +1,116 @@
+from chunk_bitmap import merge_chunks
+from eip4762 import (CALL_HEADER_LEAVES, VALUE_TRANSFER_HEADER_LEAVES, CREATE_HEADER_LEAVES,
+                     TOUCHING_OPCODE_HEADER_LEAVES)
+from estimation import CODE_OFFSET, VERKLE_NODE_WIDTH, get_storage_slot_tree_keys
+from storage_accesses import SSTORE
+
+# rough witness size: each branch (stem) carries its 31-byte stem and its C1, C2 commitments,
+# each leaf its 1-byte suffix and 32-byte value. Internal nodes and the multiproof itself are not counted.
+WITNESS_STEM_BYTES = 31 + 2 * 32
+WITNESS_LEAF_BYTES = 1 + 32
+
+
+class BlockWitness:
+    """
+    The distinct verkle tree keys accessed by the transactions of a block.
+    Transactions are merged one at a time, right after their trace is parsed: accesses already seen
+    by an earlier transaction of the block are not part of the witness again.
+    """
+
+    def __init__(self):
+        self.transactions = 0
+        # {address: ChunkBitmap} union of the accessed code chunks
+        self.code_chunks = {}
+        # {address: set of header leaf keys}
+        self.header_leaves = {}
+        # {address: {slot: (branch_id, sub_id)}}
+        self.storage_leaves = {}
+        # {address: set of written slots}
+        self.written_slots = {}
+        # {address: number of code chunks} of the contracts created in the block (all their chunks are written)
+        self.created_code_chunks = {}
+
+    def _add_header_leaves(self, address, leaf_keys):
+        if address not in self.header_leaves:
+            self.header_leaves[address] = set()
+        self.header_leaves[address].update(leaf_keys)
+
+    def add_transaction(self, trace_data):
+        """
+        merge the accesses of a transaction (as returned by parse_trace_results, with its 'code_sizes')
+        """
+        self.transactions += 1
+        merge_chunks(self.code_chunks, trace_data['chunks'])
+        for address in trace_data['chunks']:
+            self._add_header_leaves(address, CALL_HEADER_LEAVES)
+        for address in trace_data['count_call_with_value']:
+            self._add_header_leaves(address, VALUE_TRANSFER_HEADER_LEAVES)
+        for (address, opcodes) in trace_data['touched'].items():
+            for opcode in opcodes:
+                self._add_header_leaves(address, TOUCHING_OPCODE_HEADER_LEAVES[opcode])
+        for contracts in trace_data['created_contracts'].values():
+            for contract in contracts:
+                self._add_header_leaves(contract, CREATE_HEADER_LEAVES)
+                code_size = trace_data['code_sizes'].get(contract, -1)
+                if code_size > 0:
+                    self.created_code_chunks[contract] = (code_size + 30) // 31
+
+        for (address, accesses) in trace_data['slots'].items():
+            if address not in self.storage_leaves:
+                self.storage_leaves[address] = {}
+                self.written_slots[address] = set()
+            leaves = self.storage_leaves[address]
+            # only the slots not seen before in the block need their tree keys
+            for slot in accesses.slots:
+                if slot not in leaves:
+                    leaves[slot] = tuple(get_storage_slot_tree_keys(slot))
+            written = self.written_slots[address]
+            for (slot_id, opcode) in zip(accesses.slot, accesses.opcode):
+                if opcode == SSTORE:
+                    written.add(accesses.slots[slot_id])
+        return self
+
+    def address_branches(self, address):
+        """
+        :return: the distinct branches (stems) of an account accessed in the block.
+            Branch 0 holds the account header, the first 64 storage slots and the first 128 code chunks.
+        """
+        branches = set()
+        if address in self.header_leaves:
+            branches.add(0)
+        if address in self.code_chunks:
+            branches.update(self.code_chunks[address].branch_ids(CODE_OFFSET))
+        if address in self.created_code_chunks:
+            branches.update(range((CODE_OFFSET + self.created_code_chunks[address] - 1) // VERKLE_NODE_WIDTH + 1))
+        for (branch_id, _) in self.storage_leaves.get(address, {}).values():
+            branches.add(branch_id)
+        return branches
+
+    def addresses(self):
+        return (set(self.code_chunks) | set(self.header_leaves) | set(self.storage_leaves)
+                | set(self.created_code_chunks))
+
+    def summary(self):
+        """
+        :return: block-level counts of the distinct accessed branches and leaves, and the estimated witness size
+        """
+        code_chunks = {address: len(chunks) for (address, chunks) in self.code_chunks.items()}
+        for (address, count) in self.created_code_chunks.items():
+            code_chunks[address] = max(code_chunks.get(address, 0), count)
+        branches = sum(len(self.address_branches(address)) for address in self.addresses())
+        header_leaves = sum(len(leaves) for leaves in self.header_leaves.values())
+        storage_leaves = sum(len(leaves) for leaves in self.storage_leaves.values())
+        written_slots = sum(len(slots) for slots in self.written_slots.values())
+        chunk_count = sum(code_chunks.values())
+        leaves = header_leaves + storage_leaves + chunk_count
+        return dict(
+            transactions=self.transactions,
+            addresses=len(self.addresses()),
+            branches=branches,
+            leaves=leaves,
+            header_leaves=header_leaves,
+            code_chunks=chunk_count,
+            storage_slots=storage_leaves,
+            written_storage_slots=written_slots,
+            witness_bytes=branches * WITNESS_STEM_BYTES + leaves * WITNESS_LEAF_BYTES,
+        )
@@ -0,0 +1,242 @@
+"""
+Attribution of the verkle gas costs of a transaction to its call frames, in the parsing pass.
+
+The parser reports the frames it enters and leaves to its AccessEventTracker (see enter_frame()): a CallTreeTracker
+builds the call tree from them, and charges each event to the frame it happens in, with the costs of the estimation
+(see estimation.py): code chunks, storage accesses, value transfers (to the called frame), contract creations and
+touched addresses. The costs of the creations and touched addresses are only known with the code sizes:
+they are added by call_tree_results(), after the parsing.
+
+The tree is written as JSON lines (a transaction per line), or as folded stacks ("a;b;c gas" lines,
+for flamegraph tools) of the verkle witness gas of each call path.
+"""
+import json
+
+from eip4762 import STORAGE_COUNTS, AccessEventTracker
+from estimation import (G_CALLVALUE, WITNESS_BRANCH_COST, WITNESS_CHUNK_COST, CHUNK_FILL_COST, SUBTREE_EDIT_COST,
+                        created_contract_counts, get_name, storage_verkle_cost, touching_opcode_costs)
+
+# the kinds of costs of a frame
+COSTS = ('code', 'storage', 'call_value', 'create', 'touch')
+(CODE, STORAGE, CALL_VALUE, CREATE, TOUCH) = range(len(COSTS))
+CHUNKS_PER_BRANCH = 256
+
+
+class CallFrame:
+    """
+    A call frame, with the costs of the events that happened in it (not in the frames it called):
+    for each of COSTS, the verkle gas cost difference, and the verkle witness gas (new costs only).
+    Addresses are address ids while parsing, resolved by CallTreeTracker.call_tree()
+    """
+    __slots__ = ('code_address', 'context_address', 'depth', 'scheme', 'first_step', 'last_step', 'difference',
+                 'witness_gas', 'created', 'touched', 'calls')
+
+    def __init__(self, code_address, context_address, depth, scheme, first_step):
+        self.code_address = code_address
+        self.context_address = context_address
+        self.depth = depth
+        self.scheme = scheme
+        self.first_step = first_step
+        self.last_step = None
+        self.difference = [0] * len(COSTS)
+        self.witness_gas = [0] * len(COSTS)
+        # (creator, created address) of the contracts created, and the addresses first touched
+        self.created = []
+        self.touched = []
+        self.calls = []
+
+
+class CallTreeTracker(AccessEventTracker):
+    """
+    An AccessEventTracker which also builds the call tree of the transaction, and attributes the costs of its events
+    to the frames
+    """
+    __slots__ = ('roots', 'stack', 'code_branches', 'touched_ids', 'value_call')
+
+    def reset(self):
+        super().reset()
+        self.roots = []
+        self.stack = []
+        # (code address id, branch) of the accessed code chunks
+        self.code_branches = set()
+        self.touched_ids = set()
+        # whether the latest call transfers value: charged to the frame it enters
+        self.value_call = False
+
+    def enter_frame(self, code_id, context_id, scheme, step):
+        frame = CallFrame(code_id, context_id, len(self.stack) + 1, scheme, step)
+        (self.stack[-1].calls if self.stack else self.roots).append(frame)
+        self.stack.append(frame)
+        if self.value_call:
+            frame.difference[CALL_VALUE] -= G_CALLVALUE
+            self.value_call = False
+
+    def exit_frame(self, step):
+        self.stack.pop().last_step = step - 1
+
+    def code_chunk(self, address_id, chunk):
+        super().code_chunk(address_id, chunk)
+        cost = WITNESS_CHUNK_COST
+        branch = (address_id, chunk // CHUNKS_PER_BRANCH)
+        if branch not in self.code_branches:
+            self.code_branches.add(branch)
+            cost += WITNESS_BRANCH_COST
+        frame = self.stack[-1]
+        frame.difference[CODE] += cost
+        frame.witness_gas[CODE] += cost
+
+    def storage(self, address_id, slot_hex, write, old_gas, refund):
+        before = dict(zip(STORAGE_COUNTS, self._account(address_id)))
+        super().storage(address_id, slot_hex, write, old_gas, refund)
+        after = dict(zip(STORAGE_COUNTS, self.accounts[address_id]))
+        # the storage costs of an account are linear in its counts: each access adds its own
+        witness_gas = storage_verkle_cost(after) - storage_verkle_cost(before)
+        frame = self.stack[-1]
+        frame.witness_gas[STORAGE] += witness_gas
+        frame.difference[STORAGE] += witness_gas - old_gas + refund
+
+    def call(self, caller_id, code_id, target_id, value_transfer):
+        super().call(caller_id, code_id, target_id, value_transfer)
+        self.value_call = value_transfer
+
+    def touch(self, address_id, opcode):
+        super().touch(address_id, opcode)
+        if address_id not in self.touched_ids:
+            self.touched_ids.add(address_id)
+            self.stack[-1].touched.append(address_id)
+
+    def create(self, address_id):
+        super().create(address_id)
+        # the creation of the transaction itself is not charged (its creator, the sender, runs no code)
+        if self.stack:
+            frame = self.stack[-1]
+            frame.created.append((frame.context_address, address_id))
+
+    def call_tree(self, steps):
+        """
+        :param steps: the steps of the transaction, to close the frames still open at its end
+        :return: the frames of depth 1 of the transaction (one, normally), with the frames they called
+        """
+        for frame in self.stack:
+            frame.last_step = steps
+        addresses = self.addresses
+
+        def resolve(frame):
+            frame.code_address = addresses[frame.code_address]
+            frame.context_address = addresses[frame.context_address]
+            frame.created = [(addresses[creator], addresses[created]) for (creator, created) in frame.created]
+            frame.touched = [addresses[touched] for touched in frame.touched]
+            for called in frame.calls:
+                resolve(called)
+
+        for root in self.roots:
+            resolve(root)
+        return self.roots
+
+
+def _frame_dict(frame, trace_data, names):
+    difference = list(frame.difference)
+    witness_gas = list(frame.witness_gas)
+    # the costs known with the code sizes
+    (touch_old_cost, touch_new_cost) = touching_opcode_costs()
+    for address in frame.touched:
+        # as the estimation: an address that runs code is charged by its code chunks instead
+        if address not in trace_data['chunks']:
+            witness_gas[TOUCH] += touch_new_cost
+            difference[TOUCH] += touch_new_cost - touch_old_cost
+    for (creator, created) in frame.created:
+        if creator not in trace_data['chunks']:
+            continue
+        (old_cost, filled_chunks, edited_subtrees) = created_contract_counts(trace_data, created)
+        new_cost = CHUNK_FILL_COST * filled_chunks + SUBTREE_EDIT_COST * edited_subtrees
+        witness_gas[CREATE] += new_cost
+        difference[CREATE] += new_cost - old_cost
+    calls = [_frame_dict(called, trace_data, names) for called in frame.calls]
+    result = dict(
+        address=frame.code_address,
+        contract_name=get_name(frame.code_address, names),
+        depth=frame.depth,
+        scheme=frame.scheme,
+        steps=frame.last_step - frame.first_step + 1,
+        costs=dict(zip(COSTS, difference)),
+        gas_cost_difference=sum(difference),
+        witness_gas=sum(witness_gas),
+        total_gas_cost_difference=sum(difference) + sum(call['total_gas_cost_difference'] for call in calls),
+        total_witness_gas=sum(witness_gas) + sum(call['total_witness_gas'] for call in calls),
+    )
+    if frame.context_address != frame.code_address:
+        # e.g. a DELEGATECALL: runs the code of address, on the storage of context_address
+        result['context_address'] = frame.context_address
+    result['calls'] = calls
+    return result
+
+
+def call_tree_results(case, trace_data, verkle_results, names):
+    """
+    :param trace_data: the parsed trace, with its 'call_tree' (CallTreeTracker.call_tree()) and code sizes
+    :param verkle_results: the results of estimate_verkle_gas_cost_difference() of the trace
+    :return: the call tree of a transaction, JSON-serializable. 'unattributed' is the part of the cost difference
+        of the transaction that no frame accounts for (e.g. value transfers to addresses that run no code)
+    """
+    calls = [_frame_dict(root, trace_data, names) for root in trace_data['call_tree']]
+    attributed = sum(call['total_gas_cost_difference'] for call in calls)
+    return dict(name=case['name'], tx=case['txHash'], gas_used=trace_data['gas_used'],
+                total_gas_cost_difference=verkle_results['total_gas_cost_difference'],
+                unattributed=verkle_results['total_gas_cost_difference'] - attributed, calls=calls)
+
+
+def folded_stacks(tree, stacks=None):
+    """
+    :param tree: call_tree_results() of a transaction
+    :param stacks: {call path: witness gas} to add to, e.g. of the other transactions of a run
+    :return: {call path: witness gas} of the frames of the tree, a call path being the frames from depth 1
+        separated by ';'
+    """
+    stacks = {} if stacks is None else stacks
+
+    def add(frame, path):
+        label = frame['contract_name'].replace(";", ",")
+        if frame['depth'] > 1:
+            label += f" [{frame['scheme']}]"
+        path = f"{path};{label}" if path else label
+        if frame['witness_gas'] > 0:
+            stacks[path] = stacks.get(path, 0) + frame['witness_gas']
+        for called in frame['calls']:
+            add(called, path)
+
+    for root in tree['calls']:
+        add(root, "")
+    return stacks
+
+
+class CallTreeWriter:
+    """
+    writes the call trees of the transactions of a run: as folded stacks if the path ends with .folded
+    (all the transactions aggregated, written on close), otherwise as JSON lines, a transaction per line
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.folded = path.endswith(".folded")
+        self.stacks = {}
+        self.trees = 0
+        self._out = None
+
+    def write(self, tree):
+        self.trees += 1
+        if self.folded:
+            folded_stacks(tree, self.stacks)
+            return
+        if self._out is None:
+            self._out = open(self.path, "w")
+        self._out.write(json.dumps(tree) + "\n")
+        self._out.flush()
+
+    def close(self):
+        if self.folded:
+            with open(self.path, "w") as out:
+                for (path, gas) in sorted(self.stacks.items()):
+                    out.write(f"{path} {gas}\n")
+        elif self._out is not None:
+            self._out.close()
+            self._out = None
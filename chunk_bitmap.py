@@ -0,0 +1,169 @@
+from array import array
+
+CHUNKS_PER_BRANCH = 256
+BYTES_PER_BRANCH = CHUNKS_PER_BRANCH // 8
+
+
+class ChunkBitmap:
+    """
+    The set of accessed code chunks of a contract: bit i is set if chunk i (pc // 31) was accessed.
+    Per-chunk hit counts are only kept when requested, in a separate array.
+    """
+    __slots__ = ('bits', 'hits')
+
+    def __init__(self, num_chunks=0, count_hits=False):
+        """
+        :param num_chunks: initial size, usually the code-size chunk count. The bitmap grows as needed.
+        :param count_hits: also count the number of accesses to each chunk
+        """
+        self.bits = bytearray((num_chunks + 7) // 8)
+        self.hits = array('L', [0]) * (len(self.bits) * 8) if count_hits else None
+
+    @staticmethod
+    def from_buffer(bits, hits=None):
+        """
+        :return: a read-only bitmap over existing memory (e.g. a memoryview of a mapped file). not copied
+        """
+        result = ChunkBitmap()
+        result.bits = bits
+        result.hits = hits
+        return result
+
+    def add(self, chunk):
+        byte = chunk >> 3
+        if byte >= len(self.bits):
+            self._grow(chunk + 1)
+        self.bits[byte] |= 1 << (chunk & 7)
+        if self.hits is not None:
+            self.hits[chunk] += 1
+
+    def _grow(self, num_chunks):
+        size = max((num_chunks + 7) // 8, 2 * len(self.bits))
+        self._set_size(size)
+
+    def _set_size(self, size):
+        if size > len(self.bits):
+            self.bits.extend(bytes(size - len(self.bits)))
+        else:
+            del self.bits[size:]
+        if self.hits is not None:
+            hits_size = size * 8
+            if hits_size > len(self.hits):
+                self.hits.extend(array('L', [0]) * (hits_size - len(self.hits)))
+            else:
+                del self.hits[hits_size:]
+
+    def resize(self, num_chunks):
+        """
+        size the bitmap to the code-size chunk count of the contract. accessed chunks are never dropped.
+        """
+        used = (self.max_chunk() + 1) if len(self) > 0 else 0
+        self._set_size((max(num_chunks, used) + 7) // 8)
+
+    def _as_int(self):
+        return int.from_bytes(self.bits, "little")
+
+    def __len__(self):
+        return self._as_int().bit_count()
+
+    def __contains__(self, chunk):
+        byte = chunk >> 3
+        return byte < len(self.bits) and (self.bits[byte] >> (chunk & 7)) & 1 == 1
+
+    def __iter__(self):
+        for (byte_index, byte) in enumerate(self.bits):
+            if byte:
+                for bit in range(8):
+                    if (byte >> bit) & 1:
+                        yield byte_index * 8 + bit
+
+    def max_chunk(self):
+        """
+        :return: the highest accessed chunk, -1 if none
+        """
+        return self._as_int().bit_length() - 1
+
+    def branch_count(self):
+        """
+        :return: the number of distinct branches (chunk // 256) with at least one accessed chunk
+        """
+        bits = self.bits
+        return sum(1 for offset in range(0, len(bits), BYTES_PER_BRANCH) if any(bits[offset:offset + BYTES_PER_BRANCH]))
+
+    def branch_ids(self, chunk_offset=0):
+        """
+        :param chunk_offset: tree index of chunk 0 (e.g. CODE_OFFSET, for the actual position of code in the account tree)
+        :return: the distinct branches ((chunk_offset + chunk) // 256) with at least one accessed chunk
+        """
+        bits = self.bits
+        if chunk_offset:
+            value = self._as_int() << chunk_offset
+            bits = value.to_bytes((value.bit_length() + 7) // 8, "little")
+        return [offset // BYTES_PER_BRANCH for offset in range(0, len(bits), BYTES_PER_BRANCH)
+                if any(bits[offset:offset + BYTES_PER_BRANCH])]
+
+    def chunk_hits(self, chunk):
+        return self.hits[chunk] if self.hits is not None and chunk < len(self.hits) else None
+
+    @staticmethod
+    def _from_int(value, size):
+        result = ChunkBitmap()
+        result.bits = bytearray(value.to_bytes(size, "little"))
+        return result
+
+    def copy(self):
+        result = ChunkBitmap()
+        result.bits = bytearray(self.bits)
+        if self.hits is not None:
+            result.hits = array('L', self.hits)
+        return result
+
+    def __or__(self, other):
+        return self._from_int(self._as_int() | other._as_int(), max(len(self.bits), len(other.bits)))
+
+    def __and__(self, other):
+        return self._from_int(self._as_int() & other._as_int(), min(len(self.bits), len(other.bits)))
+
+    def __ior__(self, other):
+        size = len(other.bits)
+        if size > len(self.bits):
+            self._set_size(size)
+        merged = int.from_bytes(self.bits[:size], "little") | other._as_int()
+        self.bits[:size] = merged.to_bytes(size, "little")
+        if self.hits is not None and other.hits is not None:
+            for (i, count) in enumerate(other.hits):
+                if count:
+                    self.hits[i] += count
+        return self
+
+    def __eq__(self, other):
+        return isinstance(other, ChunkBitmap) and self._as_int() == other._as_int()
+
+    def __repr__(self):
+        return f"ChunkBitmap({list(self)})"
+
+
+def merge_chunks(total, chunks):
+    """
+    union the per-contract chunk bitmaps of a transaction into a running per-contract total, in place.
+    :param total: {address: ChunkBitmap} accumulated so far (e.g. across a batch of transactions)
+    :param chunks: {address: ChunkBitmap} of a single transaction
+    """
+    for (address, bitmap) in chunks.items():
+        if address in total:
+            total[address] |= bitmap
+        else:
+            total[address] = bitmap.copy()
+    return total
+
+
+def common_chunks(chunk_maps, address):
+    """
+    :return: the chunks of a contract that were accessed in every one of the given {address: ChunkBitmap} maps
+    """
+    result = None
+    for chunks in chunk_maps:
+        if address not in chunks:
+            return ChunkBitmap()
+        result = chunks[address] if result is None else result & chunks[address]
+    return result if result is not None else ChunkBitmap()
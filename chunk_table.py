@@ -0,0 +1,91 @@
+"""
+Precomputed code chunk tables (EIP-4762 code chunking), built once per contract bytecode and shared, by code hash,
+by all the transactions running that code.
+
+Code is split in chunks of 31 bytes. In the tree, each chunk is stored as 32 bytes: the number of PUSH data bytes
+at the start of the chunk (the remainder of a PUSH that began in a previous chunk), then the 31 code bytes.
+Executing a PUSH{n} also accesses the chunks holding its n data bytes, which may be chunks no instruction
+is ever executed from.
+"""
+import struct
+from array import array
+
+from estimation import CODE_OFFSET, VERKLE_NODE_WIDTH
+from keccak import keccak256
+
+CHUNK_BYTES = 31
+PUSH1 = 0x60
+PUSH32 = 0x7f
+TABLE_HEADER = struct.Struct("<32sI1s")
+
+
+class ChunkTable:
+    """
+    The chunk layout of a contract's bytecode:
+    - pushdata: for each chunk, its number of leading PUSH data bytes
+    - last_chunk: for each pc, the last chunk accessed by executing the instruction at pc
+      (pc // 31, unless the data of a PUSH continues in the next chunks)
+    """
+    __slots__ = ('code_hash', 'code_size', 'pushdata', 'last_chunk')
+
+    def __init__(self, code_hash, code_size, pushdata, last_chunk):
+        self.code_hash = code_hash
+        self.code_size = code_size
+        self.pushdata = pushdata
+        self.last_chunk = last_chunk
+
+    @staticmethod
+    def from_code(code):
+        """
+        :param code: the bytecode
+        """
+        num_chunks = (len(code) + CHUNK_BYTES - 1) // CHUNK_BYTES
+        pushdata = bytearray(num_chunks)
+        last_chunk = array('H' if num_chunks <= 0xffff else 'I', [0]) * len(code)
+        pc = 0
+        while pc < len(code):
+            opcode = code[pc]
+            size = opcode - PUSH1 + 1 if PUSH1 <= opcode <= PUSH32 else 0
+            # the last chunk is padded with zeros: the data may go past the end of the code, but not of the chunks
+            data_end = min(pc + size, len(code) - 1)
+            last = data_end // CHUNK_BYTES
+            for chunk in range(pc // CHUNK_BYTES + 1, last + 1):
+                pushdata[chunk] = min(pc + size + 1 - chunk * CHUNK_BYTES, CHUNK_BYTES)
+            # the data bytes themselves are never executed: they map to their own chunk
+            for data_pc in range(pc, data_end + 1):
+                last_chunk[data_pc] = data_pc // CHUNK_BYTES
+            last_chunk[pc] = last
+            pc += 1 + size
+        return ChunkTable(keccak256(bytes(code)), len(code), bytes(pushdata), last_chunk)
+
+    def __len__(self):
+        return len(self.pushdata)
+
+    def chunkify(self, code):
+        """
+        :param code: the bytecode of this table
+        :return: the 32-byte tree values of the code chunks (leading PUSH data count, then 31 code bytes)
+        """
+        return [bytes([count]) + bytes(code[start:start + CHUNK_BYTES]).ljust(CHUNK_BYTES, b"\0")
+                for (count, start) in zip(self.pushdata, range(0, len(code), CHUNK_BYTES))]
+
+    def branch_ids(self):
+        """
+        :return: the branches (tree index // 256) holding the code chunks, in the account tree layout
+        """
+        if len(self) == 0:
+            return range(0)
+        return range(CODE_OFFSET // VERKLE_NODE_WIDTH, (CODE_OFFSET + len(self) - 1) // VERKLE_NODE_WIDTH + 1)
+
+    def to_bytes(self):
+        return (TABLE_HEADER.pack(self.code_hash, self.code_size, self.last_chunk.typecode.encode())
+                + self.pushdata + self.last_chunk.tobytes())
+
+    @staticmethod
+    def from_bytes(data):
+        (code_hash, code_size, typecode) = TABLE_HEADER.unpack_from(data)
+        num_chunks = (code_size + CHUNK_BYTES - 1) // CHUNK_BYTES
+        start = TABLE_HEADER.size + num_chunks
+        last_chunk = array(typecode.decode())
+        last_chunk.frombytes(data[start:])
+        return ChunkTable(code_hash, code_size, bytes(data[TABLE_HEADER.size:start]), last_chunk)
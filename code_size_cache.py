@@ -0,0 +1,291 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from chunk_table import ChunkTable
+
+# first block of the Cancun hard fork (EIP-6780) of each chain id
+CANCUN_BLOCKS = {
+    1: 19426587,
+    11155111: 5187023,
+}
+# size of an EIP-7702 delegation designator (0xef0100 || address), the code of a delegated EOA
+DELEGATION_DESIGNATOR_SIZE = 23
+# code sizes of an address which may change at a later block, without a redeployment: no code (the address may be
+# deployed since), and a delegation designator (its EOA may delegate to another address, or clear it, at any time)
+MUTABLE_CODE_SIZES = frozenset([0, DELEGATION_DESIGNATOR_SIZE])
+
+
+def _enable_wal(db, timeout):
+    """
+    switch a database to WAL. Switching a new database needs a lock that SQLite doesn't wait for (whatever the busy
+    timeout): retried while another connection holds it, e.g. that of a concurrent worker opening the new database too
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            return
+        except sqlite3.OperationalError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.01)
+
+
+class CodeSizeCache:
+    """
+    Contract code sizes, keyed by (chain id, block, address).
+    An in-memory LRU is kept in front of an on-disk SQLite table, so that popular contracts are fetched
+    only once across transactions and across runs.
+    Since Cancun, the code of a deployed contract doesn't change (EIP-6780: SELFDESTRUCT only removes the code of
+    a contract created in the same transaction): on disk, a contract found with code at an earlier block since Cancun
+    is not fetched again at a later one, and its code hash (so its chunk table) is reused the same way.
+    That doesn't hold for EOAs: since Prague, an EOA may set, change or clear its code, a delegation designator
+    (EIP-7702), at any block. Codes of the size of a designator are therefore only cached for their exact block,
+    as are addresses without code, which may be deployed (or delegated) since.
+    Before Cancun, a contract could self-destruct and be redeployed with another code at the same address
+    (CREATE2): lookups are only cached for their exact block, as are those of chains without a known Cancun block.
+    Lookups without a chain id or a block ("latest" state) are only cached in memory.
+    The chunk tables of the contracts' bytecode (see chunk_table.py) are kept along, by code hash:
+    a table is shared by all the contracts (and transactions) with the same code.
+    Lookups may be made from concurrent threads (each has its own SQLite connection); fetches are made
+    outside of the lock, so that a slow fetch doesn't hold up the lookups of other threads.
+    """
+
+    def __init__(self, path, fetch_code_size, memory_size=4096, parallel=8, fetch_code_sizes=None, fetch_code=None,
+                 cancun_blocks=None):
+        """
+        :param path: SQLite file. None to keep the cache in memory only
+        :param fetch_code_size: function(address, block) returning the code size. block is None for "latest"
+        :param fetch_code_sizes: function(addresses, block) returning the code sizes of all addresses at once
+            (e.g. as a JSON-RPC batch). Used for prefetching, instead of concurrent fetch_code_size calls
+        :param fetch_code: function(address, block) returning the bytecode (bytes, None if unknown), for chunk tables
+        :param memory_size: number of entries kept in the in-memory LRU
+        :param parallel: max number of concurrent fetches when prefetching
+        :param cancun_blocks: {chain id: first Cancun block}, CANCUN_BLOCKS by default
+        """
+        self.path = path
+        self.fetch_code_size = fetch_code_size
+        self.memory_size = memory_size
+        self.parallel = parallel
+        self.fetch_code_sizes = fetch_code_sizes
+        self.fetch_code = fetch_code
+        self.cancun_blocks = CANCUN_BLOCKS if cancun_blocks is None else cancun_blocks
+        self.memory = OrderedDict()
+        # {code hash: ChunkTable} and {(chain id, block, address): code hash}, LRUs
+        self.tables = OrderedDict()
+        self.code_hashes = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # guards the LRUs and the counters
+        self._lock = threading.RLock()
+        # the connection of each thread
+        self._local = threading.local()
+
+    def _connection(self):
+        # a connection must not be shared with forked worker processes, nor between threads
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=60)
+            self._local.db = db
+            self._local.pid = os.getpid()
+            _enable_wal(db, 60)
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS code_sizes ("
+                " chain_id INTEGER, block INTEGER, address TEXT, code_size INTEGER,"
+                " PRIMARY KEY (chain_id, block, address))")
+            # to find the nearest earlier block of an address
+            db.execute("CREATE INDEX IF NOT EXISTS code_sizes_by_address ON code_sizes (chain_id, address, block)")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS code_hashes ("
+                " chain_id INTEGER, block INTEGER, address TEXT, code_hash BLOB,"
+                " PRIMARY KEY (chain_id, block, address))")
+            db.execute("CREATE INDEX IF NOT EXISTS code_hashes_by_address ON code_hashes (chain_id, address, block)")
+            db.execute("CREATE TABLE IF NOT EXISTS chunk_tables (code_hash BLOB PRIMARY KEY, chunk_table BLOB)")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS tx_blocks (chain_id INTEGER, tx TEXT, block INTEGER,"
+                " PRIMARY KEY (chain_id, tx))")
+        return db
+
+    def _persistent(self, chain_id, block):
+        return self.path is not None and chain_id is not None and block is not None
+
+    @staticmethod
+    def _remember_lru(lru, key, value, size):
+        lru[key] = value
+        lru.move_to_end(key)
+        if len(lru) > size:
+            lru.popitem(last=False)
+
+    def _remember(self, key, code_size):
+        self._remember_lru(self.memory, key, code_size, self.memory_size)
+
+    def _nearest(self, table, column, chain_id, block, address):
+        """
+        :return: (block, value) of an address on disk, at the block or else at the nearest earlier one
+            since Cancun (if the block is). None if there is neither
+        """
+        cancun_block = self.cancun_blocks.get(chain_id)
+        since = cancun_block if cancun_block is not None and block >= cancun_block else block
+        return self._connection().execute(
+            f"SELECT block, {column} FROM {table} WHERE chain_id=? AND address=? AND block BETWEEN ? AND ? "
+            f"ORDER BY block DESC LIMIT 1", (chain_id, address, since, block)).fetchone()
+
+    def _lookup(self, chain_id, block, addresses):
+        """
+        :return: code sizes found in the memory or disk cache, and the list of addresses not found in either.
+        """
+        found = {}
+        on_disk = []
+        for address in addresses:
+            key = (chain_id, block, address)
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                found[address] = self.memory[key]
+            else:
+                on_disk.append(address)
+        missing = on_disk
+        if on_disk and self._persistent(chain_id, block):
+            missing = []
+            for address in on_disk:
+                row = self._nearest("code_sizes", "code_size", chain_id, block, address)
+                if row is None or row[0] != block and row[1] in MUTABLE_CODE_SIZES:
+                    missing.append(address)
+                else:
+                    code_size = row[1]
+                    self.disk_hits += 1
+                    found[address] = code_size
+                    self._remember((chain_id, block, address), code_size)
+        return found, missing
+
+    def _store(self, chain_id, block, code_sizes):
+        for (address, code_size) in code_sizes.items():
+            self._remember((chain_id, block, address), code_size)
+        if code_sizes and self._persistent(chain_id, block):
+            db = self._connection()
+            with db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO code_sizes (chain_id, block, address, code_size) VALUES (?, ?, ?, ?)",
+                    [(chain_id, block, address, code_size) for (address, code_size) in code_sizes.items()])
+
+    def get(self, chain_id, block, address):
+        return self.prefetch(chain_id, block, [address])[address]
+
+    def prefetch(self, chain_id, block, addresses):
+        """
+        :return: {address: code size} for all given addresses, fetching all cache misses concurrently
+        """
+        with self._lock:
+            (found, missing) = self._lookup(chain_id, block, addresses)
+            self.misses += len(missing)
+        if missing:
+            if self.fetch_code_sizes is not None:
+                fetched = dict(zip(missing, self.fetch_code_sizes(missing, block)))
+            else:
+                with ThreadPoolExecutor(max_workers=self.parallel) as executor:
+                    fetched = dict(zip(missing, executor.map(lambda address: self.fetch_code_size(address, block),
+                                                             missing)))
+            # failed lookups (negative size) are not cached
+            with self._lock:
+                self._store(chain_id, block, {address: size for (address, size) in fetched.items() if size >= 0})
+            found.update(fetched)
+        return {address: found[address] for address in addresses}
+
+    def _table(self, code_hash):
+        """
+        :return: the chunk table of a code hash, from memory or disk. None if unknown
+        """
+        if code_hash in self.tables:
+            self.tables.move_to_end(code_hash)
+            return self.tables[code_hash]
+        if self.path is None:
+            return None
+        row = self._connection().execute(
+            "SELECT chunk_table FROM chunk_tables WHERE code_hash=?", (code_hash,)).fetchone()
+        if row is None:
+            return None
+        table = ChunkTable.from_bytes(row[0])
+        self._remember_lru(self.tables, code_hash, table, self.memory_size // 4)
+        return table
+
+    def chunk_table(self, chain_id, block, address):
+        """
+        :return: the ChunkTable of the code of a contract, its bytecode being fetched (once) if unknown.
+            None if the code cannot be fetched
+        """
+        key = (chain_id, block, address)
+        with self._lock:
+            code_hash = self.code_hashes.get(key)
+            table = None
+            if code_hash is not None:
+                table = self._table(code_hash)
+            elif self._persistent(chain_id, block):
+                row = self._nearest("code_hashes", "code_hash", chain_id, block, address)
+                if row is not None:
+                    table = self._table(row[1])
+                    # as with code sizes: the code of an address may have changed since the earlier block
+                    if table is not None and row[0] != block and table.code_size in MUTABLE_CODE_SIZES:
+                        table = None
+                    code_hash = table.code_hash if table is not None else None
+        if table is None:
+            code = self.fetch_code(address, block) if self.fetch_code is not None else None
+            if code is None:
+                return None
+            table = ChunkTable.from_code(code)
+            code_hash = table.code_hash
+            with self._lock:
+                # the code size comes along
+                self._store(chain_id, block, {address: table.code_size})
+                if self._persistent(chain_id, block):
+                    db = self._connection()
+                    with db:
+                        db.execute("INSERT OR REPLACE INTO chunk_tables (code_hash, chunk_table) VALUES (?, ?)",
+                                   (code_hash, table.to_bytes()))
+                        db.execute("INSERT OR REPLACE INTO code_hashes (chain_id, block, address, code_hash) "
+                                   "VALUES (?, ?, ?, ?)", (chain_id, block, address, code_hash))
+                self._remember_lru(self.tables, code_hash, table, self.memory_size // 4)
+        with self._lock:
+            self._remember_lru(self.code_hashes, key, code_hash, self.memory_size)
+        return table
+
+    def transaction_block(self, chain_id, tx, fetch_block):
+        """
+        :param fetch_block: function(tx) returning the block number of the transaction
+        :return: the block of the transaction, cached on disk
+        """
+        if self.path is not None and chain_id is not None:
+            row = self._connection().execute(
+                "SELECT block FROM tx_blocks WHERE chain_id=? AND tx=?", (chain_id, tx)).fetchone()
+            if row is not None:
+                return row[0]
+        block = fetch_block(tx)
+        if self.path is not None and chain_id is not None and block is not None:
+            db = self._connection()
+            with db:
+                db.execute("INSERT OR REPLACE INTO tx_blocks (chain_id, tx, block) VALUES (?, ?, ?)",
+                           (chain_id, tx, block))
+        return block
+
+    def stats(self):
+        return [self.memory_hits, self.disk_hits, self.misses]
+
+    def add_stats(self, stats):
+        """
+        add the counters of another instance (e.g. a copy used by a worker process)
+        """
+        (memory_hits, disk_hits, misses) = stats
+        with self._lock:
+            self.memory_hits += memory_hits
+            self.disk_hits += disk_hits
+            self.misses += misses
+
+    def report(self):
+        total = self.memory_hits + self.disk_hits + self.misses
+        return (f"code size cache: {total} lookups, {self.memory_hits} memory hits, "
+                f"{self.disk_hits} disk hits, {self.misses} fetched")
@@ -0,0 +1,204 @@
+import csv
+import json
+import math
+
+from estimation import get_name
+
+# the per-contract results of estimate_verkle_gas_cost_difference() aggregated across transactions
+METRICS = ('per_contract_diff', 'num_chunks', 'addr_code_cost')
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class QuantileSketch:
+    """
+    Approximate quantiles of a stream of values, in constant memory (a DDSketch):
+    values are counted in logarithmic buckets, bucket i holding the magnitudes in (gamma^(i-1), gamma^i].
+    A quantile is then known within the given relative accuracy. Negative values are counted in mirrored buckets.
+    Sketches of the same accuracy are merged exactly, by adding their bucket counts.
+    """
+    __slots__ = ('relative_accuracy', 'log_gamma', 'max_buckets', 'positive', 'negative', 'zero', 'count')
+
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        """
+        :param max_buckets: bound of the buckets of each sign. Beyond it, the buckets of the smallest magnitudes
+            are collapsed (their accuracy is lost first: the tail quantiles are the ones of interest)
+        """
+        self.relative_accuracy = relative_accuracy
+        self.log_gamma = math.log((1 + relative_accuracy) / (1 - relative_accuracy))
+        self.max_buckets = max_buckets
+        self.positive = {}
+        self.negative = {}
+        self.zero = 0
+        self.count = 0
+
+    def _key(self, magnitude):
+        return math.ceil(math.log(magnitude) / self.log_gamma)
+
+    def _value(self, key):
+        # the middle of the bucket, within the relative accuracy of all its values
+        gamma = math.exp(self.log_gamma)
+        return 2 * gamma ** key / (gamma + 1)
+
+    def add(self, value, n=1):
+        self.count += n
+        if value == 0:
+            self.zero += n
+            return
+        buckets = self.positive if value > 0 else self.negative
+        key = self._key(abs(value))
+        buckets[key] = buckets.get(key, 0) + n
+        if len(buckets) > self.max_buckets:
+            self._collapse(buckets)
+
+    def _collapse(self, buckets):
+        keys = sorted(buckets)
+        collapsed = sum(buckets.pop(key) for key in keys[:len(keys) - self.max_buckets + 1])
+        lowest = keys[len(keys) - self.max_buckets]
+        buckets[lowest] = buckets.get(lowest, 0) + collapsed
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise Exception("Cannot merge quantile sketches of different accuracies")
+        for (buckets, other_buckets) in ((self.positive, other.positive), (self.negative, other.negative)):
+            for (key, n) in other_buckets.items():
+                buckets[key] = buckets.get(key, 0) + n
+            if len(buckets) > self.max_buckets:
+                self._collapse(buckets)
+        self.zero += other.zero
+        self.count += other.count
+        return self
+
+    def quantile(self, q):
+        """
+        :return: the approximate q-quantile (0 <= q <= 1) of the values added. None if there are none
+        """
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        # from the most negative value up
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._value(key)
+        seen += self.zero
+        if seen > rank:
+            return 0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._value(key)
+        return self._value(max(self.positive))
+
+
+class MetricStats:
+    """
+    count, sum, min, max and quantile sketch of a metric
+    """
+    __slots__ = ('count', 'sum', 'min', 'max', 'sketch')
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+        self.sketch = QuantileSketch()
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.sketch.add(value)
+
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        self.count += other.count
+        self.sum += other.sum
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self.sketch.merge(other.sketch)
+        return self
+
+    def quantile(self, q):
+        value = self.sketch.quantile(q)
+        # exact at the extremes, and never outside of them
+        return None if value is None else round(min(max(value, self.min), self.max))
+
+
+def contract_metrics(verkle_results):
+    """
+    :return: the aggregated metrics of each contract of a transaction's estimation, {address: [value of each METRICS]}
+        (small, and JSON-serializable, e.g. to be journaled)
+    """
+    return {address: [result[metric] for metric in METRICS]
+            for (address, result) in verkle_results['per_contract_result'].items()}
+
+
+class ContractStats:
+    """
+    Per-contract statistics of the estimation across many transactions: for each contract and each of METRICS,
+    count, sum, min/max and approximate quantiles. Memory is constant per contract, whatever the number
+    of transactions. Instances are mergeable, e.g. to aggregate the stats of parallel workers.
+    """
+
+    def __init__(self):
+        self.transactions = 0
+        # {address: [MetricStats of each METRICS]}
+        self.contracts = {}
+
+    def add(self, metrics):
+        """
+        :param metrics: contract_metrics() of a transaction
+        """
+        self.transactions += 1
+        for (address, values) in metrics.items():
+            if address not in self.contracts:
+                self.contracts[address] = [MetricStats() for _ in METRICS]
+            for (stats, value) in zip(self.contracts[address], values):
+                stats.add(value)
+
+    def merge(self, other):
+        self.transactions += other.transactions
+        for (address, other_stats) in other.contracts.items():
+            if address not in self.contracts:
+                self.contracts[address] = [MetricStats() for _ in METRICS]
+            for (stats, metric_stats) in zip(self.contracts[address], other_stats):
+                stats.merge(metric_stats)
+        return self
+
+    def rows(self, names):
+        """
+        :return: a report row (dict) per contract, the largest total verkle gas cost difference first
+        """
+        rows = []
+        for (address, metric_stats) in self.contracts.items():
+            row = dict(address=address, contract_name=get_name(address, names), transactions=metric_stats[0].count)
+            for (metric, stats) in zip(METRICS, metric_stats):
+                row[f"{metric}_sum"] = stats.sum
+                row[f"{metric}_min"] = stats.min
+                row[f"{metric}_max"] = stats.max
+                row[f"{metric}_mean"] = round(stats.sum / stats.count, 1)
+                for q in QUANTILES:
+                    row[f"{metric}_p{round(q * 100)}"] = stats.quantile(q)
+            rows.append(row)
+        rows.sort(key=lambda row: -row['per_contract_diff_sum'])
+        return rows
+
+    def write(self, path, names):
+        """
+        write the report, as CSV if the path ends with .csv, otherwise as JSON
+        """
+        rows = self.rows(names)
+        with open(path, "w", newline="") as out:
+            if path.endswith(".csv"):
+                fields = ["address", "contract_name", "transactions"] + [
+                    f"{metric}_{stat}" for metric in METRICS
+                    for stat in ["sum", "min", "max", "mean"] + [f"p{round(q * 100)}" for q in QUANTILES]]
+                writer = csv.DictWriter(out, fields)
+                writer.writeheader()
+                writer.writerows(rows)
+            else:
+                json.dump(dict(transactions=self.transactions, contracts=rows), out, indent=1)
+                out.write("\n")
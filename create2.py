@@ -0,0 +1,33 @@
+"""
+In-process CREATE2 address derivation (EIP-1014):
+    address = keccak256(0xff ++ caller ++ salt ++ keccak256(init_code))[12:]
+"""
+from functools import lru_cache
+
+from keccak import keccak256
+
+
+@lru_cache(maxsize=256)
+def init_code_hash(init_code_hex):
+    """
+    :param init_code_hex: init code, as hex (with or without "0x" prefix)
+    :return: keccak256 of the init code
+    """
+    return keccak256(bytes.fromhex(init_code_hex.removeprefix("0x")))
+
+
+@lru_cache(maxsize=65536)
+def _create2_address(caller, salt, code_hash):
+    preimage = b"\xff" + bytes.fromhex(caller[2:]) + salt.to_bytes(32, "big") + code_hash
+    # the hash is 32-byte. need to take last 20
+    return "0x" + keccak256(preimage)[12:].hex()
+
+
+def create2_address(caller, salt, init_code_hex):
+    """
+    :param caller: address of the deploying contract
+    :param salt: CREATE2 salt, as hex (need not be zero-padded)
+    :param init_code_hex: init code, as hex
+    :return: the (lowercase) address of the created contract
+    """
+    return _create2_address(caller.lower(), int(salt, 16), init_code_hash(init_code_hex))
@@ -1,12 +1,5 @@
-from typing import Set, Tuple
-
-address = str
-
-WITNESS_BRANCH_COST = 1900
-WITNESS_CHUNK_COST = 200
-SUBTREE_EDIT_COST = 3000
-CHUNK_EDIT_COST = 500
-CHUNK_FILL_COST = 6200
+#  Pre-verkle (EIP-2929, EIP-2200 etc.) constants
+SSTORE_SET_GAS = 20000
 
 VERSION_LEAF_KEY = 0
 BALANCE_LEAF_KEY = 1
@@ -18,101 +11,262 @@ CODE_OFFSET = 128
 VERKLE_NODE_WIDTH = 256
 MAIN_STORAGE_OFFSET = 256 ** 31
 
-accessed_subtrees: Set[Tuple[address, int]] = {}
-accessed_leaves: Set[Tuple[address, int, int]] = {}
-edited_subtrees: Set[Tuple[address, int]] = {}
-edited_leaves: Set[Tuple[address, int, int]] = {}
-
-total_cost: int = 0
-
-
-def handle_opcode(opcode: str, addr: address, stack: list[str], mpt_gas: int, mpt_refund: int):
-    """
-    :param addr: current storage address
-    :param opcode: opcode name
-    :param stack - current stack
-    :param mpt_gas:
-    :param mpt_refund:
-    :return:
-    """
-    if opcode == 'SLOAD':
-        slot = int(stack[-1])
-        (subkey, leafkey) = get_storage_slot_tree_keys(slot)
-        access_event(addr, subkey, leafkey)
-        #todo: compensate MPT cost
-    elif opcode == 'SSTORE':
-        slot = int(stack[-1])
-        (subkey, leafkey) = get_storage_slot_tree_keys(slot)
-        write_event(addr, subkey, leafkey)
-        #todo: compensate MPT cost
-    elif opcode == 'BALANCE':
-        access_event(address, 0, BALANCE_LEAF_KEY)
-    elif opcode == 'EXTCODEHASH':
-        access_event(address, 0, CODE_KECCAK_LEAF_KEY)
-    elif opcode in ['CALL', 'CALLCODE', 'DELEGATECALL', 'STATICCALL']:
-        calladdr = stack[-2]
-        access_event()
-    else:
-        "normal opcodes - no changes in gas cost from MPT"
-        pass
+# account header leaves of each kind of access
+CALL_HEADER_LEAVES = (VERSION_LEAF_KEY, CODE_SIZE_LEAF_KEY)
+VALUE_TRANSFER_HEADER_LEAVES = (BALANCE_LEAF_KEY,)
+CREATE_HEADER_LEAVES = (VERSION_LEAF_KEY, BALANCE_LEAF_KEY, NONCE_LEAF_KEY, CODE_KECCAK_LEAF_KEY, CODE_SIZE_LEAF_KEY)
+TOUCHING_OPCODE_HEADER_LEAVES = {
+    "BALANCE": (BALANCE_LEAF_KEY,),
+    "EXTCODESIZE": (VERSION_LEAF_KEY, CODE_SIZE_LEAF_KEY),
+    "EXTCODECOPY": (VERSION_LEAF_KEY, CODE_SIZE_LEAF_KEY),
+    "EXTCODEHASH": (CODE_KECCAK_LEAF_KEY,),
+    "SELFDESTRUCT": (BALANCE_LEAF_KEY,),
+}
 
-
-def reset_transaction():
-    """
-    reset all values before each transaction
-    :return:
-    """
-    global total_cost
-    total_cost = 0
-    accessed_subtrees.clear()
-    accessed_leaves.clear()
-    edited_subtrees.clear()
-    edited_leaves.clear()
+# per-account counters, in the order of AccessEventTracker.accounts lists
+STORAGE_COUNTS = ('accesses', 'accessed_leaves', 'accessed_branches', 'writes', 'edited_leaves', 'edited_branches',
+                  'filled_leaves', 'old_gas', 'refunds')
+(ACCESSES, ACCESSED_LEAVES, ACCESSED_BRANCHES, WRITES, EDITED_LEAVES, EDITED_BRANCHES,
+ FILLED_LEAVES, OLD_GAS, REFUNDS) = range(len(STORAGE_COUNTS))
 
 
-def get_storage_slot_tree_keys(storage_key: int) -> [int, int]:
+def get_storage_slot_tree_keys(storage_key: int) -> tuple[int, int]:
     if storage_key < (CODE_OFFSET - HEADER_STORAGE_OFFSET):
         pos = HEADER_STORAGE_OFFSET + storage_key
     else:
         pos = MAIN_STORAGE_OFFSET + storage_key
     return (
-        pos // 256,
-        pos % 256
+        pos // VERKLE_NODE_WIDTH,
+        pos % VERKLE_NODE_WIDTH
     )
 
 
-def access_event(addr: address, sub_key: int, leaf_key: int):
+class AccessEventTracker:
     """
-    If (address, sub_key) is not in accessed_subtrees, charge WITNESS_BRANCH_COST gas and add that tuple to accessed_subtrees.
-    If leaf_key is not None and (address, sub_key, leaf_key) is not in accessed_leaves, charge WITNESS_CHUNK_COST gas and add it to accessed_leaves
+    EIP-4762 access and write events of a transaction, tracked as they happen. The tracker prices nothing:
+    it only records which stems and leaves are accessed or edited for the first time.
+    Addresses and (address, branch) stems are interned to small ints, valid until reset():
+    a leaf key is stem_id * 256 + sub_key. reset() starts a new transaction by rebinding the tables and event sets,
+    so that a tracker reused across transactions does not grow.
+    Per account, the storage events are counted (see STORAGE_COUNTS), in the form used by the estimation:
+    the gas costs are computed from these counts there (see estimation.storage_verkle_cost()).
+    The code chunks and account headers are priced by the estimation from the chunk bitmaps and code sizes:
+    their events are tracked here for subclasses which attribute them (see call_tree.CallTreeTracker).
     """
-    global total_cost
-    if (addr, sub_key) not in accessed_subtrees:
-        new_costs = WITNESS_BRANCH_COST
-        accessed_subtrees.add((addr, sub_key))
-    if (addr, sub_key, leaf_key) not in accessed_leaves:
-        new_costs += WITNESS_CHUNK_COST
-        accessed_leaves.add((addr, sub_key, leaf_key))
-    total_cost += new_costs
+    __slots__ = ('address_ids', 'addresses', 'stem_ids', 'slot_keys',
+                 'accessed_stems', 'accessed_leaves', 'edited_stems', 'edited_leaves', 'storage_edited_stems',
+                 'accounts')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        forget all events and interned ids: start a new transaction
+        """
+        self.address_ids = {}
+        self.addresses = []
+        self.stem_ids = {}
+        # {slot hex: (branch, sub key)}
+        self.slot_keys = {}
+        self.accessed_stems = set()
+        self.accessed_leaves = set()
+        self.edited_stems = set()
+        self.edited_leaves = set()
+        # stems edited by SSTOREs: the storage counts don't depend on header writes (e.g. value transfers)
+        self.storage_edited_stems = set()
+        # {address id: [counters]}
+        self.accounts = {}
+
+    def intern(self, addr: str) -> int:
+        address_id = self.address_ids.get(addr)
+        if address_id is None:
+            address_id = self.address_ids[addr] = len(self.addresses)
+            self.addresses.append(addr)
+        return address_id
+
+    def _stem(self, address_id: int, branch: int) -> int:
+        key = (address_id, branch)
+        stem_id = self.stem_ids.get(key)
+        if stem_id is None:
+            stem_id = self.stem_ids[key] = len(self.stem_ids)
+        return stem_id
+
+    def _account(self, address_id: int) -> list:
+        counts = self.accounts.get(address_id)
+        if counts is None:
+            counts = self.accounts[address_id] = [0] * len(STORAGE_COUNTS)
+        return counts
+
+    def access_event(self, address_id: int, branch: int, sub_key: int) -> tuple[bool, bool]:
+        """
+        access a leaf
+        :return: whether the stem and the leaf were accessed for the first time
+        """
+        stem_id = self._stem(address_id, branch)
+        new_stem = stem_id not in self.accessed_stems
+        leaf = stem_id * VERKLE_NODE_WIDTH + sub_key
+        new_leaf = leaf not in self.accessed_leaves
+        if new_stem:
+            self.accessed_stems.add(stem_id)
+        if new_leaf:
+            self.accessed_leaves.add(leaf)
+        return new_stem, new_leaf
+
+    def write_event(self, address_id: int, branch: int, sub_key: int) -> tuple[bool, bool]:
+        """
+        edit a leaf
+        :return: whether the stem and the leaf were edited for the first time
+        """
+        stem_id = self._stem(address_id, branch)
+        new_stem = stem_id not in self.edited_stems
+        leaf = stem_id * VERKLE_NODE_WIDTH + sub_key
+        new_leaf = leaf not in self.edited_leaves
+        if new_stem:
+            self.edited_stems.add(stem_id)
+        if new_leaf:
+            self.edited_leaves.add(leaf)
+        return new_stem, new_leaf
+
+    def header_access(self, address_id: int, leaf_keys):
+        for leaf_key in leaf_keys:
+            self.access_event(address_id, 0, leaf_key)
+
+    def header_write(self, address_id: int, leaf_keys):
+        for leaf_key in leaf_keys:
+            self.access_event(address_id, 0, leaf_key)
+            self.write_event(address_id, 0, leaf_key)
 
+    def code_chunk(self, address_id: int, chunk: int):
+        """
+        first access to a code chunk of a contract in the transaction
+        """
+        (branch, sub_key) = divmod(CODE_OFFSET + chunk, VERKLE_NODE_WIDTH)
+        self.access_event(address_id, branch, sub_key)
 
-def write_event(addr: address, sub_key: int, leaf_key: int, storage_not_none=False) -> int:
+    def call(self, caller_id, code_id: int, target_id: int, value_transfer: bool):
+        """
+        CALL-family event: the code of code_id is loaded, and a value transfer edits the caller and target balances.
+        :param caller_id: None if unknown (the transaction sender)
+        """
+        self.header_access(code_id, CALL_HEADER_LEAVES)
+        if value_transfer:
+            self.header_write(target_id, VALUE_TRANSFER_HEADER_LEAVES)
+            if caller_id is not None:
+                self.header_write(caller_id, VALUE_TRANSFER_HEADER_LEAVES)
+
+    def touch(self, address_id: int, opcode: str):
+        """
+        BALANCE, EXTCODESIZE, EXTCODECOPY, EXTCODEHASH or SELFDESTRUCT of an account
+        """
+        self.header_access(address_id, TOUCHING_OPCODE_HEADER_LEAVES[opcode])
+
+    def create(self, address_id: int):
+        self.header_write(address_id, CREATE_HEADER_LEAVES)
+
+    def storage(self, address_id: int, slot_hex: str, write: bool, old_gas: int, refund: int):
+        """
+        SLOAD (access event) or SSTORE (access and write events) of a storage slot.
+        :param old_gas: pre-verkle gas used by the opcode. An SSTORE costing SSTORE_SET_GAS fills an empty leaf.
+        :param refund: pre-verkle refund of the opcode
+        """
+        keys = self.slot_keys.get(slot_hex)
+        if keys is None:
+            keys = self.slot_keys[slot_hex] = get_storage_slot_tree_keys(int(slot_hex, 16))
+        (branch, sub_key) = keys
+        counts = self._account(address_id)
+        counts[ACCESSES] += 1
+        counts[OLD_GAS] += old_gas
+        counts[REFUNDS] += refund
+        (new_stem, new_leaf) = self.access_event(address_id, branch, sub_key)
+        if new_leaf:
+            counts[ACCESSED_LEAVES] += 1
+        # NOTE: branch 0 is accounted for with the code chunks
+        if new_stem and branch != 0:
+            counts[ACCESSED_BRANCHES] += 1
+        if write:
+            counts[WRITES] += 1
+            fill = old_gas == SSTORE_SET_GAS
+            (_, new_leaf) = self.write_event(address_id, branch, sub_key)
+            if new_leaf:
+                counts[EDITED_LEAVES] += 1
+                if fill:
+                    counts[FILLED_LEAVES] += 1
+            stem_id = self._stem(address_id, branch)
+            if stem_id not in self.storage_edited_stems:
+                self.storage_edited_stems.add(stem_id)
+                counts[EDITED_BRANCHES] += 1
+
+    def enter_frame(self, code_id: int, context_id: int, scheme, step: int):
+        """
+        a call frame starts, at a step of the transaction (see call_tree.CallTreeTracker: not tracked here)
+        :param scheme: the call scheme (e.g. Call, DelegateCall), None if unknown
+        """
+
+    def exit_frame(self, step: int):
+        """
+        the current call frame returns, before a step of the transaction
+        """
+
+    def storage_counts(self):
+        """
+        :return: {address: counts} of the storage accesses of each account, keyed like STORAGE_COUNTS
+        """
+        return {self.addresses[address_id]: dict(zip(STORAGE_COUNTS, counts))
+                for (address_id, counts) in self.accounts.items() if counts[ACCESSES] > 0}
+
+
+# kinds of the events of an AccessEventLog
+(CODE_CHUNK_EVENT, STORAGE_EVENT, TOUCH_EVENT, CALL_EVENT, CREATE_EVENT) = range(5)
+
+
+class AccessEventLog(AccessEventTracker):
     """
-        When a write event of (address, sub_key, leaf_key) occurs, perform the following checks:
+    Records the events of a transaction instead of tracking them, to replay them later, in order, into an
+    AccessEventTracker: e.g. the events of a segment of a trace, parsed in another process.
+    Events refer to the address ids of the log, which are mapped by replay().
+    """
+    __slots__ = ('events',)
+
+    def reset(self):
+        super().reset()
+        self.events = []
+
+    def code_chunk(self, address_id: int, chunk: int):
+        self.events.append((CODE_CHUNK_EVENT, address_id, chunk))
+
+    def call(self, caller_id, code_id: int, target_id: int, value_transfer: bool):
+        self.events.append((CALL_EVENT, caller_id, code_id, target_id, value_transfer))
+
+    def touch(self, address_id: int, opcode: str):
+        self.events.append((TOUCH_EVENT, address_id, opcode))
 
-        If (address, sub_key) is not in edited_subtrees, charge SUBTREE_EDIT_COST gas and add that tuple to edited_subtrees.
-        If leaf_key is not None and (address, sub_key, leaf_key) is not in edited_leaves, charge CHUNK_EDIT_COST gas and add it to edited_leaves
-        Additionally, if there was no value stored at (address, sub_key, leaf_key) (ie. the state held None at that position), charge CHUNK_FILL_COST
+    def create(self, address_id: int):
+        self.events.append((CREATE_EVENT, address_id))
+
+    def storage(self, address_id: int, slot_hex: str, write: bool, old_gas: int, refund: int):
+        self.events.append((STORAGE_EVENT, address_id, slot_hex, write, old_gas, refund))
+
+
+def replay_events(tracker, addresses, events):
+    """
+    feed the events recorded by an AccessEventLog to a tracker
+    :param tracker: the AccessEventTracker to feed
+    :param addresses: AccessEventLog.addresses, the addresses of the ids of the events
+    :param events: AccessEventLog.events
     """
-    global total_cost
-    new_costs = 0
-    if (addr, sub_key) not in edited_subtrees:
-        new_costs += SUBTREE_EDIT_COST
-        edited_subtrees.add((addr, sub_key))
-    if (addr, sub_key, leaf_key) not in edited_leaves:
-        new_costs += CHUNK_EDIT_COST
-        edited_leaves.add((addr, sub_key, leaf_key))
-    # if leaf_key is None:
-    if storage_not_none:
-        new_costs += CHUNK_FILL_COST
-    total_cost += new_costs
+    ids = [tracker.intern(address) for address in addresses]
+    for event in events:
+        kind = event[0]
+        if kind == CODE_CHUNK_EVENT:
+            tracker.code_chunk(ids[event[1]], event[2])
+        elif kind == STORAGE_EVENT:
+            tracker.storage(ids[event[1]], *event[2:])
+        elif kind == TOUCH_EVENT:
+            tracker.touch(ids[event[1]], event[2])
+        elif kind == CALL_EVENT:
+            (_, caller_id, code_id, target_id, value_transfer) = event
+            tracker.call(ids[caller_id] if caller_id is not None else None, ids[code_id], ids[target_id],
+                         value_transfer)
+        else:
+            tracker.create(ids[event[1]])
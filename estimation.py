@@ -1,3 +1,14 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from storage_accesses import SSTORE
+
+# version of the estimation results (parsing and costs). Bump it with any change of the results,
+# so that results journaled by a previous version are evaluated again
+ESTIMATOR_VERSION = 1
+
 HEADER_STORAGE_OFFSET = 64
 CODE_OFFSET = 128
 VERKLE_NODE_WIDTH = 256
@@ -20,17 +31,14 @@ WARM_STORAGE_READ_COST = 100
 
 
 def calculate_chunks_read_verkle_gas_cost(contract_chunks):
+    """
+    :param contract_chunks: ChunkBitmap of the accessed code chunks of a contract
+    """
     # NOTE: subtree 0 initialization cost will be tracked here
-    branches_access_events = {}
-
-    code_cost = 0
-    for [contract_chunk, _] in contract_chunks.items():
-        code_cost += WITNESS_CHUNK_COST
-        branch_id = contract_chunk // 256
-        if branch_id not in branches_access_events:
-            branches_access_events[branch_id] = True
-            code_cost += WITNESS_BRANCH_COST
-    return code_cost
+    return (
+            len(contract_chunks) * WITNESS_CHUNK_COST +
+            contract_chunks.branch_count() * WITNESS_BRANCH_COST
+    )
 
 
 def get_storage_slot_tree_keys(storage_key_hex):
@@ -46,59 +54,94 @@ def get_storage_slot_tree_keys(storage_key_hex):
     return [branch_id, sub_id]
 
 
-#  subtract current costs and apply new costs
-def calculate_slots_verkle_difference(contract_slots):
+def storage_access_counts(contract_slots):
+    """
+    reduce the storage accesses of a contract to the counts its verkle costs depend on.
+    tree keys are only calculated once per unique slot.
+    :param contract_slots: StorageAccesses of a contract
+    """
     # NOTE: subtree 0 is already initialized in "calculate_chunks_read_verkle_gas_cost"
-    accessed_subtrees = {0: True}
-    accessed_leaves = {0: {}}
-    edited_subtrees = {}
-    edited_leaves = {}
+    slot_branches = [get_storage_slot_tree_keys(slot_hex)[0] for slot_hex in contract_slots.slots]
+    accessed_branches = len(set(slot_branches) - {0})
+
+    if np is not None:
+        slot = np.frombuffer(contract_slots.slot, dtype=np.int64)
+        gas = np.frombuffer(contract_slots.gas, dtype=np.int64)
+        writes = np.frombuffer(contract_slots.opcode, dtype=np.int8) == SSTORE
+        write_slots = slot[writes]
+        write_count = len(write_slots)
+        # index of the first write to each slot (write_count if never written)
+        first_write = np.full(len(contract_slots.slots), write_count, dtype=np.int64)
+        np.minimum.at(first_write, write_slots, np.arange(write_count))
+        edited_slots = np.flatnonzero(first_write < write_count)
+        filled_leaves = int(np.count_nonzero(gas[writes][first_write[edited_slots]] == SSTORE_SET_GAS))
+        edited_branches = len(set(slot_branches[slot_id] for slot_id in edited_slots.tolist()))
+        old_gas = int(gas.sum())
+        refunds = int(np.frombuffer(contract_slots.refund, dtype=np.int64).sum())
+    else:
+        first_write_gas = {}
+        write_count = 0
+        for (slot_id, opcode, gas) in zip(contract_slots.slot, contract_slots.opcode, contract_slots.gas):
+            if opcode == SSTORE:
+                write_count += 1
+                if slot_id not in first_write_gas:
+                    first_write_gas[slot_id] = gas
+        edited_slots = first_write_gas.keys()
+        filled_leaves = sum(1 for gas in first_write_gas.values() if gas == SSTORE_SET_GAS)
+        edited_branches = len(set(slot_branches[slot_id] for slot_id in edited_slots))
+        old_gas = sum(contract_slots.gas)
+        refunds = sum(contract_slots.refund)
+
+    return {
+        'accesses': len(contract_slots),
+        'accessed_leaves': len(contract_slots.slots),
+        'accessed_branches': accessed_branches,
+        'writes': write_count,
+        'edited_leaves': len(edited_slots),
+        'edited_branches': edited_branches,
+        # considering pre-verkle value 0 (first SSTORE costing 20000 gas) as equivalent to 'None'
+        'filled_leaves': filled_leaves,
+        'old_gas': old_gas,
+        'refunds': refunds
+    }
 
-    new_costs = 0
-    old_cost = 0
-    for slot_id in contract_slots:
-        slot = contract_slots[slot_id]
-        [branch_id, sub_id] = get_storage_slot_tree_keys(slot_id)
-        for opcode in slot:
-            old_cost += opcode['gas']
-            if opcode['opcode'] == 'SSTORE':
-                if branch_id in edited_subtrees and sub_id in edited_leaves[branch_id]:
-                    new_costs += WARM_STORAGE_READ_COST  # this is not explicitly specified by EIP-4762
-                if branch_id not in edited_subtrees:
-                    new_costs += SUBTREE_EDIT_COST
-                    edited_subtrees[branch_id] = True
-                    edited_leaves[branch_id] = {}
-                if sub_id not in edited_leaves[branch_id]:
-                    edited_leaves[branch_id][sub_id] = True
-                    if opcode['gas'] == SSTORE_SET_GAS:  # considering pre-verkle value 0 as equivalent to 'None'
-                        print(f"Note: detected a 20000 gas SSTORE which may disproportionately affect Verkle gas costs")
-                        new_costs += CHUNK_FILL_COST
-                    else:
-                        new_costs += CHUNK_EDIT_COST
-
-            # SLOAD and SSTORE opcodes with a given address and key process
-            # an access event of the form (address, tree_key, sub_key)
-            if opcode['opcode'] == 'SLOAD' or opcode['opcode'] == 'SSTORE':
-                if branch_id in accessed_subtrees and sub_id in accessed_leaves[branch_id]:
-                    new_costs += WARM_STORAGE_READ_COST  # this is not explicitly specified by EIP-4762
-                if branch_id not in accessed_subtrees:
-                    new_costs += WITNESS_BRANCH_COST
-                    accessed_subtrees[branch_id] = True
-                    accessed_leaves[branch_id] = {}
-                if sub_id not in accessed_leaves[branch_id]:
-                    accessed_leaves[branch_id][sub_id] = True
-                    new_costs += WITNESS_CHUNK_COST
-
-    return new_costs - old_cost
+
+#  subtract current costs and apply new costs
+def calculate_slots_verkle_difference(contract_slots, counts=None):
+    if counts is None:
+        counts = storage_access_counts(contract_slots)
+    return storage_verkle_cost(counts) - counts['old_gas']
+
+
+def storage_verkle_cost(counts):
+    """
+    :param counts: storage access counts, see storage_access_counts()
+    :return: the verkle gas cost of the storage accesses
+    """
+    # SLOAD and SSTORE opcodes with a given address and key process
+    # an access event of the form (address, tree_key, sub_key)
+    new_costs = (
+            counts['accessed_branches'] * WITNESS_BRANCH_COST +
+            counts['accessed_leaves'] * WITNESS_CHUNK_COST +
+            # this is not explicitly specified by EIP-4762
+            (counts['accesses'] - counts['accessed_leaves']) * WARM_STORAGE_READ_COST
+    )
+    # SSTORE also processes a write event
+    new_costs += (
+            counts['edited_branches'] * SUBTREE_EDIT_COST +
+            counts['filled_leaves'] * CHUNK_FILL_COST +
+            (counts['edited_leaves'] - counts['filled_leaves']) * CHUNK_EDIT_COST +
+            # this is not explicitly specified by EIP-4762
+            (counts['writes'] - counts['edited_leaves']) * WARM_STORAGE_READ_COST
+    )
+    return new_costs
 
 
 #  it appears that all the refund-based logic in EIP-2200 and EIP-2929 is removed in EIP-4762
-def calculate_slots_read_verkle_removed_refunds(contract_slots):
-    refunds = 0
-    for slot_id in contract_slots:
-        for opcode in contract_slots[slot_id]:
-            refunds += opcode['refund']
-    return refunds
+def calculate_slots_read_verkle_removed_refunds(contract_slots, counts=None):
+    if counts is None:
+        counts = storage_access_counts(contract_slots)
+    return counts['refunds']
 
 
 def calculate_call_opcode_verkle_savings(trace_data, address):
@@ -107,44 +150,67 @@ def calculate_call_opcode_verkle_savings(trace_data, address):
     return -1 * trace_data['count_call_with_value'][address] * G_CALLVALUE
 
 
+def touched_only_addresses(trace_data):
+    """
+    :return: the number of addresses only accessed by an 'ADDRESS TOUCHING' opcode (never called)
+    """
+    return sum(1 for address in trace_data['touched'] if address not in trace_data['chunks'])
+
+
+def touching_opcode_costs():
+    """
+    :return: (pre-verkle cost, verkle cost) of touching an address, which is never called
+    """
+    # NOTE: this is not exactly correct, some opcodes cause multiple chunk access events
+    return COLD_ACCOUNT_ACCESS_COST, WITNESS_BRANCH_COST + WITNESS_CHUNK_COST
+
+
 def calculate_touching_opcode_cost_difference(trace_data):
+    (old_cost, new_cost) = touching_opcode_costs()
+    return touched_only_addresses(trace_data) * (new_cost - old_cost)
+
+
+def create2_counts(trace_data, address):
+    """
+    :return: (pre-verkle code deposit cost, filled chunks, edited subtrees) of the contracts created by an address
+    """
     old_cost = 0
-    new_cost = 0
-    difference = 0
-    for address in trace_data['touched']:
-        if address not in trace_data['chunks']:
-            # this address was only accessed by an 'ADDRESS TOUCHING' opcode
-            old_cost += COLD_ACCOUNT_ACCESS_COST
-            # NOTE: this is not exactly correct, some opcodes cause multiple chunk access events
-            new_cost += WITNESS_BRANCH_COST + WITNESS_CHUNK_COST
-            difference += new_cost - old_cost
-    return difference
+    filled_chunks = 0
+    edited_subtrees = 0
+    for contract in trace_data['created_contracts'].get(address, ()):
+        (contract_old_cost, contract_filled_chunks, contract_edited_subtrees) = created_contract_counts(trace_data,
+                                                                                                       contract)
+        old_cost += contract_old_cost
+        filled_chunks += contract_filled_chunks
+        edited_subtrees += contract_edited_subtrees
+    return old_cost, filled_chunks, edited_subtrees
+
+
+def created_contract_counts(trace_data, contract):
+    """
+    :return: (pre-verkle code deposit cost, filled chunks, edited subtrees) of a created contract
+    """
+    size_bytes = trace_data['code_sizes'][contract]
+    if not size_bytes > 0:
+        raise Exception(f"Invalid contract size {contract} {size_bytes}")
+    old_cost = size_bytes * 200
+
+    code_chunks_count = (size_bytes + 30) // 31
+    main_code_chunks_in_main_branch = CODE_OFFSET - HEADER_STORAGE_OFFSET
+    extra_branches_count = (code_chunks_count - main_code_chunks_in_main_branch + 255) // 256
+
+    # 1 extra branch for counting the cost of editing the "main" branch
+    # 5 "chunks" for VERSION_LEAF_KEY, NONCE_LEAF_KEY, BALANCE_LEAF_KEY, CODE_KECCAK_LEAF_KEY, CODE_SIZE_LEAF_KEY
+    return old_cost, code_chunks_count + 5, extra_branches_count + 1
 
 
 def calculate_create2_opcode_cost_difference(trace_data, address):
     if address not in trace_data['created_contracts']:
         return 0
 
-    difference = 0
-    for contract in trace_data['created_contracts'][address]:
-        size_bytes = trace_data['code_sizes'][contract]
-        if not size_bytes > 0:
-            raise Exception(f"Invalid contract size {contract} {size_bytes}")
-        old_cost = size_bytes * 200
-
-        code_chunks_count = (size_bytes + 30) // 31
-        main_code_chunks_in_main_branch = CODE_OFFSET - HEADER_STORAGE_OFFSET
-        extra_branches_count = (code_chunks_count - main_code_chunks_in_main_branch + 255) // 256
-
-        # 1 extra branch for counting the cost of editing the "main" branch
-        # 5 "chunks" for VERSION_LEAF_KEY, NONCE_LEAF_KEY, BALANCE_LEAF_KEY, CODE_KECCAK_LEAF_KEY, CODE_SIZE_LEAF_KEY
-        new_cost = (
-                CHUNK_FILL_COST * (code_chunks_count + 5) +
-                SUBTREE_EDIT_COST * (extra_branches_count + 1)
-        )
-
-        difference += new_cost - old_cost
-    return difference
+    (old_cost, filled_chunks, edited_subtrees) = create2_counts(trace_data, address)
+    new_cost = CHUNK_FILL_COST * filled_chunks + SUBTREE_EDIT_COST * edited_subtrees
+    return new_cost - old_cost
 
 
 def get_name(address, names):
@@ -164,17 +230,24 @@ def estimate_verkle_gas_cost_difference(trace_data, names):
     # Dump number of unique slots used by each address
     chunks = trace_data['chunks']
     for addr in chunks:
-        max_chunk = max(chunks[addr].keys())
+        max_chunk = chunks[addr].max_chunk()
         num_chunks = len(chunks[addr])
 
         addr_code_cost = calculate_chunks_read_verkle_gas_cost(chunks[addr])
 
         addr_storage_difference = 0
         addr_storage_removed_refund = 0
+        filled_leaves = 0
         if addr in trace_data['slots']:
             addr_slots = trace_data['slots'][addr]
-            addr_storage_difference = calculate_slots_verkle_difference(addr_slots)
-            addr_storage_removed_refund = calculate_slots_read_verkle_removed_refunds(addr_slots)
+            # counted while parsing, by the AccessEventTracker, if available
+            if 'storage_counts' in trace_data:
+                slot_counts = trace_data['storage_counts'][addr]
+            else:
+                slot_counts = storage_access_counts(addr_slots)
+            addr_storage_difference = calculate_slots_verkle_difference(addr_slots, slot_counts)
+            addr_storage_removed_refund = calculate_slots_read_verkle_removed_refunds(addr_slots, slot_counts)
+            filled_leaves = slot_counts['filled_leaves']
 
         call_opcode_with_value_diff = calculate_call_opcode_verkle_savings(trace_data, addr)
 
@@ -196,11 +269,14 @@ def estimate_verkle_gas_cost_difference(trace_data, names):
             'contract_name': contract_name,
             'max_chunk': max_chunk,
             'num_chunks': num_chunks,
+            'chunks': chunks[addr],
             'create2_opcode_cost_difference': create2_opcode_cost_difference,
             'addr_code_cost': addr_code_cost,
             'addr_storage_difference': addr_storage_difference,
             # EIP-2200 heavily relies on refunds which is superseded by EIP-4762
             'addr_storage_removed_refund': addr_storage_removed_refund,
+            # SSTOREs costing 20000 gas: each fills a leaf, which may disproportionately affect verkle gas costs
+            'filled_leaves': filled_leaves,
             'call_opcode_with_value_diff': call_opcode_with_value_diff,
             'code_size': trace_data['code_sizes'][addr],
             'code_size_chunks': code_size_chunks,
@@ -216,3 +292,73 @@ def estimate_verkle_gas_cost_difference(trace_data, names):
     results['total_gas_cost_difference'] += address_touching_opcode_cost_difference
 
     return results
+
+
+# the costs a gas schedule can change. The verkle gas cost difference of a transaction is linear in them
+SCHEDULE_PARAMETERS = ('WITNESS_BRANCH_COST', 'WITNESS_CHUNK_COST', 'SUBTREE_EDIT_COST', 'CHUNK_EDIT_COST',
+                       'CHUNK_FILL_COST', 'WARM_STORAGE_READ_COST', 'G_CALLVALUE', 'COLD_ACCOUNT_ACCESS_COST')
+
+
+def default_schedule():
+    """
+    :return: {parameter: cost} of the constants of this module
+    """
+    return {name: globals()[name] for name in SCHEDULE_PARAMETERS}
+
+
+def schedule_counts(trace_data):
+    """
+    reduce a transaction to what its gas cost difference depends on, for any gas schedule:
+        difference = constant + sum(counts[i] * schedule[SCHEDULE_PARAMETERS[i]])
+    :param trace_data: parsed trace, with its 'code_sizes'
+    :return: (constant, counts), the counts in the order of SCHEDULE_PARAMETERS
+    """
+    counts = dict.fromkeys(SCHEDULE_PARAMETERS, 0)
+    constant = 0
+    for (addr, contract_chunks) in trace_data['chunks'].items():
+        counts['WITNESS_CHUNK_COST'] += len(contract_chunks)
+        counts['WITNESS_BRANCH_COST'] += contract_chunks.branch_count()
+        if addr in trace_data['slots']:
+            if 'storage_counts' in trace_data:
+                slot_counts = trace_data['storage_counts'][addr]
+            else:
+                slot_counts = storage_access_counts(trace_data['slots'][addr])
+            counts['WITNESS_BRANCH_COST'] += slot_counts['accessed_branches']
+            counts['WITNESS_CHUNK_COST'] += slot_counts['accessed_leaves']
+            counts['SUBTREE_EDIT_COST'] += slot_counts['edited_branches']
+            counts['CHUNK_FILL_COST'] += slot_counts['filled_leaves']
+            counts['CHUNK_EDIT_COST'] += slot_counts['edited_leaves'] - slot_counts['filled_leaves']
+            counts['WARM_STORAGE_READ_COST'] += (slot_counts['accesses'] - slot_counts['accessed_leaves'] +
+                                                 slot_counts['writes'] - slot_counts['edited_leaves'])
+            constant += slot_counts['refunds'] - slot_counts['old_gas']
+        counts['G_CALLVALUE'] -= trace_data['count_call_with_value'].get(addr, 0)
+        (old_cost, filled_chunks, edited_subtrees) = create2_counts(trace_data, addr)
+        counts['CHUNK_FILL_COST'] += filled_chunks
+        counts['SUBTREE_EDIT_COST'] += edited_subtrees
+        constant -= old_cost
+
+    touched_only = touched_only_addresses(trace_data)
+    counts['WITNESS_BRANCH_COST'] += touched_only
+    counts['WITNESS_CHUNK_COST'] += touched_only
+    counts['COLD_ACCOUNT_ACCESS_COST'] -= touched_only
+    return constant, [counts[name] for name in SCHEDULE_PARAMETERS]
+
+
+def sweep_gas_cost_differences(transaction_counts, schedules):
+    """
+    evaluate gas schedules over transactions, as a single matrix product
+    :param transaction_counts: schedule_counts() of each transaction
+    :param schedules: list of {parameter: cost}. Missing parameters keep the cost of this module
+    :return: the gas cost difference of each transaction (rows) with each schedule (columns)
+    """
+    defaults = default_schedule()
+    costs = [[schedule.get(name, defaults[name]) for name in SCHEDULE_PARAMETERS] for schedule in schedules]
+    constants = [constant for (constant, _) in transaction_counts]
+    counts = [tx_counts for (_, tx_counts) in transaction_counts]
+    if np is not None:
+        differences = np.array(counts, dtype=np.int64).reshape(len(counts), len(SCHEDULE_PARAMETERS)) @ \
+                      np.array(costs, dtype=np.int64).reshape(len(costs), len(SCHEDULE_PARAMETERS)).T
+        return (differences + np.array(constants, dtype=np.int64)[:, None]).tolist()
+    return [[constant + sum(count * cost for (count, cost) in zip(tx_counts, schedule_costs))
+             for schedule_costs in costs]
+            for (constant, tx_counts) in zip(constants, counts)]
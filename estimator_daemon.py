@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+A local estimation service. The estimator (verkle_gas_estimator.py, used as a library) stays loaded across
+requests, with its caches warm: code sizes and chunk tables, CREATE2 addresses, the stored traces and their
+parsed data, and the JSON-RPC connections. Requests are served concurrently, each in its own thread.
+
+    POST /estimate        {"tx": "0x..", "block": N}   estimate a transaction ("block" is optional)
+    POST /estimate/trace  estimate an uploaded trace: the output of `cast run -t --quick`, or the structLogs JSON
+                          of `debug_traceTransaction` (with ?to={address}). Optionally compressed
+                          (Content-Encoding: gzip or zstd). ?name= names it in the logs
+    GET  /status          requests served, and cache stats
+
+Results are JSON (see print_results.results_as_dict()). Errors are {"error": message}, with status 400 for
+a bad request, 500 for a failed estimation.
+"""
+import json
+import os
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import verkle_gas_estimator as estimator
+from print_results import results_as_dict
+
+DEFAULT_PORT = 8547
+UPLOAD_CHUNK_SIZE = 1 << 16
+# suffix of a spooled upload, by Content-Encoding: the trace file is opened by its suffix
+UPLOAD_SUFFIXES = {None: "", "identity": "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def usage():
+    print(f"usage: {sys.argv[0]} [options]")
+    print("serve estimations over HTTP on localhost (or a Unix socket), keeping the estimator caches warm")
+    print("Options:")
+    print(f"  -port {{N}} listen on 127.0.0.1:N (default: {DEFAULT_PORT})")
+    print("  -socket {path} listen on a Unix socket instead")
+    print("  -c {cast-path} use specified 'cast' implementation")
+    print("  -rpc {url} JSON-RPC node for the state lookups, also passed to 'cast run'")
+    print("  -cache {dir} directory of the persistent caches (default: $VERKLE_CACHE_DIR or ~/.cache/verkle-gas-estimator)")
+    print("  -contracts match contract addresses with names in given JSON file")
+    print("  -chunk-tables also count the code chunks of the data of the PUSH opcodes (see verkle_gas_estimator.py)")
+    print("  -calltree also return the call tree of each transaction, with its costs (see call_tree.py)")
+    print("  -offline only estimate transactions previously captured in the cache dir, and uploaded traces")
+    print("  -to {address} the default called contract of uploaded structLogs traces")
+    sys.exit(1)
+
+
+class RequestError(Exception):
+    pass
+
+
+class EstimatorService:
+    """
+    the estimations of the daemon, and their counters
+    """
+
+    def __init__(self, upload_dir):
+        """
+        :param upload_dir: where uploaded traces are spooled, while they are estimated
+        """
+        self.upload_dir = upload_dir
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+
+    def estimate(self, case):
+        """
+        :return: the results of a test case (see verkle_gas_estimator.case_trace()), as a dict
+        """
+        with self.lock:
+            self.requests += 1
+            self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            # a transaction estimated before is re-estimated from its parsed data
+            (gas_used, _, results) = estimator.estimate_test_case(case, reuse_parsed=True)
+            return dict(results_as_dict(gas_used, results), name=case['name'],
+                        elapsed=round(time.perf_counter() - start, 6))
+        except BaseException:
+            with self.lock:
+                self.errors += 1
+            raise
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def estimate_upload(self, stream, length, encoding, name, to):
+        """
+        estimate a trace uploaded in a request body. It is spooled to a file first: the parsers may peek at it,
+        and the body must be read as a whole before the response
+        :param stream: the request body
+        :param length: its length
+        """
+        if encoding not in UPLOAD_SUFFIXES:
+            raise RequestError(f"Unsupported Content-Encoding {encoding}")
+        (fd, path) = tempfile.mkstemp(dir=self.upload_dir, suffix=".trace" + UPLOAD_SUFFIXES[encoding])
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while length > 0:
+                    data = stream.read(min(length, UPLOAD_CHUNK_SIZE))
+                    if not data:
+                        raise RequestError("Truncated trace upload")
+                    out.write(data)
+                    length -= len(data)
+            case = dict(txHash=name, name=name, traceFile=path)
+            if to is not None:
+                case['to'] = to
+            return self.estimate(case)
+        finally:
+            os.remove(path)
+
+    def status(self):
+        with self.lock:
+            status = dict(requests=self.requests, errors=self.errors, in_flight=self.in_flight,
+                          uptime=round(time.time() - self.started, 3))
+        status['code_size_cache'] = dict(zip(("memory_hits", "disk_hits", "fetches"),
+                                             estimator.code_size_cache.stats()))
+        return status
+
+
+class EstimateHandler(BaseHTTPRequestHandler):
+    # keep-alive: a client making many requests doesn't connect for each
+    protocol_version = "HTTP/1.1"
+
+    def address_string(self):
+        # a Unix socket client has no address
+        return self.client_address[0] if self.client_address else self.server.server_address
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode() + b"\n"
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if urlsplit(self.path).path != "/status":
+            self.reply(404, dict(error=f"Unknown path {self.path}"))
+            return
+        self.reply(200, self.server.service.status())
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        query = {name: values[-1] for (name, values) in parse_qs(url.query).items()}
+        length = self.headers.get("Content-Length")
+        if length is None:
+            # the body could not be skipped: the connection can't be reused
+            self.close_connection = True
+            self.reply(411, dict(error="Content-Length is required"))
+            return
+        try:
+            length = int(length)
+            if length < 0:
+                raise RequestError(f"Invalid Content-Length {length}")
+            if url.path == "/estimate":
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if not isinstance(request, dict) or not isinstance(request.get('tx'), str):
+                    raise RequestError('Expected {"tx": "0x.."}')
+                case = dict(txHash=request['tx'], name=request.get('name', request['tx']))
+                if request.get('block') is not None:
+                    case['block'] = int(request['block'])
+                self.reply(200, self.server.service.estimate(case))
+            elif url.path == "/estimate/trace":
+                self.reply(200, self.server.service.estimate_upload(
+                    self.rfile, length, self.headers.get("Content-Encoding"), query.get('name', "upload"),
+                    query.get('to')))
+            else:
+                self.rfile.read(length)
+                self.reply(404, dict(error=f"Unknown path {url.path}"))
+        except (RequestError, ValueError) as e:
+            self.close_connection = True
+            self.reply(400, dict(error=str(e)))
+        except Exception as e:
+            self.reply(500, dict(error=f"{type(e).__name__}: {e}"))
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def main():
+    args = sys.argv[1:]
+    port = DEFAULT_PORT
+    socket_path = None
+    rpc_url = None
+    options = {}
+    while len(args) > 0:
+        opt = args.pop(0)
+        if opt == "-port":
+            port = int(args.pop(0))
+        elif opt == "-socket":
+            socket_path = args.pop(0)
+        elif opt == "-c":
+            options['cast_executable'] = args.pop(0)
+        elif opt == "-rpc":
+            rpc_url = args.pop(0)
+        elif opt == "-cache":
+            options['cache_dir'] = args.pop(0)
+        elif opt == "-contracts":
+            with open(args.pop(0)) as f:
+                options['names'] = json.load(f)["contracts"]
+        elif opt == "-chunk-tables":
+            options['use_chunk_tables'] = True
+        elif opt == "-calltree":
+            options['call_trees'] = True
+        elif opt == "-offline":
+            options['offline'] = True
+        elif opt == "-to":
+            options['to_address'] = args.pop(0)
+        else:
+            usage()
+
+    estimator.configure(rpc_url, **options)
+    if not estimator.offline:
+        # resolved once, rather than by the first requests
+        estimator.current_chain_id()
+        estimator.cast_version()
+
+    with tempfile.TemporaryDirectory(prefix="verkle-estimator-uploads-") as upload_dir:
+        if socket_path is not None:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            server = UnixHTTPServer(socket_path, EstimateHandler)
+        else:
+            server = ThreadingHTTPServer(("127.0.0.1", port), EstimateHandler)
+        server.service = EstimatorService(upload_dir)
+        print(f"serving estimations on {socket_path or f'http://127.0.0.1:{port}'}")
+        sys.stdout.flush()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if socket_path is not None:
+                os.remove(socket_path)
+            print(estimator.code_size_cache.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+DEFAULT_LEASE_SECONDS = 300
+# a test case failing (or whose worker died) that many times is given up
+MAX_ATTEMPTS = 3
+
+
+def _enable_wal(db, timeout):
+    """
+    switch a database to WAL. Switching a new queue needs a lock that SQLite doesn't wait for (whatever the busy
+    timeout): retried while another connection holds it, e.g. that of another worker opening the new queue too
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            return
+        except sqlite3.OperationalError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.01)
+
+
+class JobQueue:
+    """
+    A queue of test cases in an SQLite file, drained by any number of worker processes, on one or several hosts
+    sharing the file (it needs a filesystem with working locks).
+    A worker claims pending cases for a lease, which it renews while it evaluates them (see heartbeat()), then
+    writes their results back. The cases of a worker which died are claimed again once their lease expires.
+    A transaction is evaluated once, however many cases of the results file it has: the results are assembled
+    in the order of the cases, to write the CSV of the run.
+    A queue belongs to an estimator version: results of another version are never mixed in.
+    """
+
+    def __init__(self, path, version, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.version = str(version)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # the connection of each thread (the heartbeat has its own)
+        self._local = threading.local()
+
+    def _connection(self):
+        # a connection must not be shared with forked worker processes, nor between threads
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # transactions are explicit: a claim must read and update the jobs atomically
+            db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            self._local.db = db
+            self._local.pid = os.getpid()
+            _enable_wal(db, 60)
+            db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            db.execute("CREATE TABLE IF NOT EXISTS cases (position INTEGER PRIMARY KEY, tx TEXT, test_case TEXT)")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (tx TEXT PRIMARY KEY, test_case TEXT, state TEXT, worker TEXT,"
+                " lease_expires REAL, attempts INTEGER DEFAULT 0, result TEXT, error TEXT)")
+            db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', ?)", (self.version,))
+            (version,) = db.execute("SELECT value FROM meta WHERE key='version'").fetchone()
+            if version != self.version:
+                raise Exception(f"Job queue {self.path} is of estimator version {version}, not {self.version}: "
+                                f"use another queue file")
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        db = self._connection()
+        # taking the write lock at once: concurrent claims are serialized
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def add(self, cases, names=None):
+        """
+        add the test cases of a results file, in order. Transactions already in the queue are kept as they are,
+        except failed ones, which are tried again
+        :param names: the contract names of the cases, for the workers that don't have the results file
+        """
+        with self._transaction() as db:
+            db.executemany("INSERT OR REPLACE INTO cases (position, tx, test_case) VALUES (?, ?, ?)",
+                           [(position, case['txHash'], json.dumps(case)) for (position, case) in enumerate(cases)])
+            db.execute("DELETE FROM cases WHERE position>=?", (len(cases),))
+            db.executemany("INSERT OR IGNORE INTO jobs (tx, test_case, state) VALUES (?, ?, ?)",
+                           [(case['txHash'], json.dumps(case), PENDING) for case in cases])
+            db.execute("UPDATE jobs SET state=?, attempts=0, error=NULL WHERE state=?", (PENDING, FAILED))
+            if names is not None:
+                db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('names', ?)", (json.dumps(names),))
+
+    def names(self):
+        row = self._connection().execute("SELECT value FROM meta WHERE key='names'").fetchone()
+        return json.loads(row[0]) if row is not None else {}
+
+    def claim(self, worker, count=1):
+        """
+        lease up to `count` cases to a worker: pending cases, or cases whose lease expired
+        :return: the claimed test cases, in queue order
+        """
+        now = time.time()
+        with self._transaction() as db:
+            # cases that failed too many times (e.g. killing their worker every time) are given up
+            db.execute("UPDATE jobs SET state=?, error='lease expired' WHERE state=? AND lease_expires<? "
+                       "AND attempts>=?", (FAILED, LEASED, now, self.max_attempts))
+            rows = db.execute(
+                "SELECT tx, test_case FROM jobs WHERE state=? OR (state=? AND lease_expires<?) "
+                "ORDER BY rowid LIMIT ?", (PENDING, LEASED, now, count)).fetchall()
+            db.executemany("UPDATE jobs SET state=?, worker=?, lease_expires=?, attempts=attempts+1 WHERE tx=?",
+                           [(LEASED, worker, now + self.lease_seconds, tx) for (tx, _) in rows])
+        return [json.loads(test_case) for (_, test_case) in rows]
+
+    def renew(self, worker):
+        """
+        extend the leases of the cases of a worker
+        """
+        with self._transaction() as db:
+            db.execute("UPDATE jobs SET lease_expires=? WHERE state=? AND worker=?",
+                       (time.time() + self.lease_seconds, LEASED, worker))
+
+    def release(self, worker):
+        """
+        give the cases of a worker back, e.g. when it is interrupted: they don't wait for their lease to expire
+        """
+        with self._transaction() as db:
+            db.execute("UPDATE jobs SET state=?, attempts=attempts-1 WHERE state=? AND worker=?",
+                       (PENDING, LEASED, worker))
+
+    @contextmanager
+    def heartbeat(self, worker):
+        """
+        renew the leases of a worker in a background thread, while in the context
+        """
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(self.lease_seconds / 3):
+                self.renew(worker)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def complete(self, tx, worker, result):
+        """
+        write the result of a case back. The first result of a case is kept: the case may have been evaluated
+        again by another worker, after its lease expired
+        :param result: JSON-serializable
+        """
+        with self._transaction() as db:
+            db.execute("UPDATE jobs SET state=?, worker=?, result=?, error=NULL WHERE tx=? AND state!=?",
+                       (DONE, worker, json.dumps(result), tx, DONE))
+
+    def fail(self, tx, worker, error):
+        """
+        release a case whose evaluation failed: it is claimed again, up to max_attempts times
+        """
+        with self._transaction() as db:
+            db.execute("UPDATE jobs SET state=CASE WHEN attempts>=? THEN ? ELSE ? END, error=? "
+                       "WHERE tx=? AND state=? AND worker=?",
+                       (self.max_attempts, FAILED, PENDING, error, tx, LEASED, worker))
+
+    def counts(self):
+        """
+        :return: {state: number of cases}
+        """
+        return dict(self._connection().execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+    def failures(self):
+        """
+        :return: [(tx, error)] of the cases given up
+        """
+        return self._connection().execute(
+            "SELECT tx, error FROM jobs WHERE state=? ORDER BY rowid", (FAILED,)).fetchall()
+
+    def results(self):
+        """
+        :return: (test case, result, error) of each case of an evaluated or given up transaction, in the order
+            of the results file, as a generator. The result is None for a case given up, the error None otherwise
+        """
+        for (test_case, state, result, error) in self._connection().execute(
+                "SELECT cases.test_case, jobs.state, jobs.result, jobs.error FROM cases JOIN jobs ON cases.tx=jobs.tx "
+                "WHERE jobs.state IN (?, ?) ORDER BY cases.position", (DONE, FAILED)):
+            if state == DONE:
+                yield json.loads(test_case), json.loads(result), None
+            else:
+                yield json.loads(test_case), None, error
@@ -0,0 +1,56 @@
+import json
+import os
+
+
+class Journal:
+    """
+    An append-only log of the evaluated test cases of a run, as JSON lines, so that an interrupted run
+    can be resumed without evaluating them again.
+    Entries are keyed by transaction hash and results version (see verkle_gas_estimator.results_version(): it changes
+    with the sources of the estimator): entries of another version are ignored.
+    """
+
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version
+        self._out = None
+
+    def load(self):
+        """
+        :return: the journaled entries of this version, by transaction hash
+        """
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line may be cut by an interruption
+                    continue
+                if entry.get('version') == self.version:
+                    entries[entry['tx']] = entry
+        return entries
+
+    def append(self, tx, **fields):
+        """
+        record an evaluated transaction. The entry is flushed at once, to survive an interruption
+        """
+        if self._out is None:
+            torn = False
+            if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+                with open(self.path, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    # the previous run was interrupted in the middle of a line
+                    torn = f.read(1) != b"\n"
+            self._out = open(self.path, "a")
+            if torn:
+                self._out.write("\n")
+        self._out.write(json.dumps(dict(tx=tx, version=self.version, **fields)) + "\n")
+        self._out.flush()
+
+    def close(self):
+        if self._out is not None:
+            self._out.close()
+            self._out = None
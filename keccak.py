@@ -0,0 +1,95 @@
+"""
+Keccak-256, as used by Ethereum (the original Keccak padding, not the NIST SHA3-256 one).
+
+Uses pycryptodome when it is installed, otherwise falls back to a pure-python implementation.
+"""
+
+try:
+    from Crypto.Hash import keccak as _crypto_keccak
+except ImportError:
+    _crypto_keccak = None
+
+_MASK_64 = (1 << 64) - 1
+_RATE_BYTES = 136
+
+_ROUND_CONSTANTS = [
+    0x0000000000000001, 0x0000000000008082, 0x800000000000808A, 0x8000000080008000,
+    0x000000000000808B, 0x0000000080000001, 0x8000000080008081, 0x8000000000008009,
+    0x000000000000008A, 0x0000000000000088, 0x0000000080008009, 0x000000008000000A,
+    0x000000008000808B, 0x800000000000008B, 0x8000000000008089, 0x8000000000008003,
+    0x8000000000008002, 0x8000000000000080, 0x000000000000800A, 0x800000008000000A,
+    0x8000000080008081, 0x8000000000008080, 0x0000000080000001, 0x8000000080008008,
+]
+
+# rotation offsets, indexed by lane x + 5 * y
+_ROTATIONS = [
+    0, 1, 62, 28, 27,
+    36, 44, 6, 55, 20,
+    3, 10, 43, 25, 39,
+    41, 45, 15, 21, 8,
+    18, 2, 61, 56, 14,
+]
+
+
+# (source lane, rotation) of each lane after the rho and pi steps
+_RHO_PI = [None] * 25
+for _x in range(5):
+    for _y in range(5):
+        _RHO_PI[_y + 5 * ((2 * _x + 3 * _y) % 5)] = (_x + 5 * _y, _ROTATIONS[_x + 5 * _y])
+
+
+def _keccak_f1600(lanes):
+    mask = _MASK_64
+    rho_pi = _RHO_PI
+    for round_constant in _ROUND_CONSTANTS:
+        # theta
+        c0 = lanes[0] ^ lanes[5] ^ lanes[10] ^ lanes[15] ^ lanes[20]
+        c1 = lanes[1] ^ lanes[6] ^ lanes[11] ^ lanes[16] ^ lanes[21]
+        c2 = lanes[2] ^ lanes[7] ^ lanes[12] ^ lanes[17] ^ lanes[22]
+        c3 = lanes[3] ^ lanes[8] ^ lanes[13] ^ lanes[18] ^ lanes[23]
+        c4 = lanes[4] ^ lanes[9] ^ lanes[14] ^ lanes[19] ^ lanes[24]
+        d = (
+            c4 ^ (((c1 << 1) | (c1 >> 63)) & mask),
+            c0 ^ (((c2 << 1) | (c2 >> 63)) & mask),
+            c1 ^ (((c3 << 1) | (c3 >> 63)) & mask),
+            c2 ^ (((c4 << 1) | (c4 >> 63)) & mask),
+            c3 ^ (((c0 << 1) | (c0 >> 63)) & mask),
+        )
+        # rho and pi
+        b = []
+        for (source, shift) in rho_pi:
+            value = lanes[source] ^ d[source % 5]
+            b.append(((value << shift) | (value >> (64 - shift))) & mask if shift else value)
+        # chi
+        lanes = []
+        for row in (0, 5, 10, 15, 20):
+            b0, b1, b2, b3, b4 = b[row:row + 5]
+            lanes += (b0 ^ (~b1 & b2), b1 ^ (~b2 & b3), b2 ^ (~b3 & b4), b3 ^ (~b4 & b0), b4 ^ (~b0 & b1))
+        # iota
+        lanes[0] ^= round_constant
+    return lanes
+
+
+def _keccak256_python(data):
+    padded = bytearray(data)
+    padded.append(0x01)
+    padded.extend(b"\x00" * (-len(padded) % _RATE_BYTES))
+    padded[-1] |= 0x80
+
+    lanes = [0] * 25
+    for offset in range(0, len(padded), _RATE_BYTES):
+        block = padded[offset:offset + _RATE_BYTES]
+        for i in range(_RATE_BYTES // 8):
+            lanes[i] ^= int.from_bytes(block[i * 8:i * 8 + 8], "little")
+        lanes = _keccak_f1600(lanes)
+    return b"".join(lane.to_bytes(8, "little") for lane in lanes[:4])
+
+
+def keccak256(data):
+    """
+    :param data: bytes to hash
+    :return: 32-byte keccak256 digest
+    """
+    if _crypto_keccak is not None:
+        return _crypto_keccak.new(digest_bits=256, data=data).digest()
+    return _keccak256_python(data)
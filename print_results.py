@@ -1,4 +1,7 @@
 def print_results(case, total_gas_used, results, dumpall):
+    for result in results['per_contract_result'].values():
+        for _ in range(result['filled_leaves']):
+            print("Note: detected a 20000 gas SSTORE which may disproportionately affect Verkle gas costs")
     print(case)
     for address in results['per_contract_result']:
         result = results['per_contract_result'][address]
@@ -13,7 +16,8 @@ def print_results(case, total_gas_used, results, dumpall):
         print(f"CALL with value cost diff: {result['call_opcode_with_value_diff']}")
         print(f"CREATE2 cost diff: {result['create2_opcode_cost_difference']}")
         if dumpall:
-            print(f", all chunks={','.join(map(str, result['chunks'][result['addrress']].keys()))}")
+            chunks = result['chunks']
+            print(f"all chunks (chunk:hits)={','.join(f'{chunk}:{chunks.chunk_hits(chunk)}' for chunk in chunks)}")
         print("Contract Verkle gas cost difference = " + str(result['per_contract_diff']))
         print("")
 
@@ -26,3 +30,49 @@ def print_results(case, total_gas_used, results, dumpall):
     print("Post-Verkle gas cost difference: " + str(results['total_gas_cost_difference']))
     print("Post-Verkle estimation gas used: " + str(total_gas_used + results['total_gas_cost_difference']))
     print("")
+
+
+def print_block_results(block, rows, summary):
+    """
+    :param rows: [name, pre-verkle gas used, post-verkle gas used] of each transaction of the block
+    :param summary: BlockWitness.summary()
+    """
+    pre_verkle_gas_used = sum(row[1] for row in rows)
+    post_verkle_gas_used = sum(row[2] for row in rows)
+    print(f"Block {block}")
+    print(f"transactions: {summary['transactions']}")
+    print(f"accessed accounts: {summary['addresses']}")
+    print(f"unique branches: {summary['branches']}")
+    print(f"unique leaves: {summary['leaves']}")
+    print(f"  account header leaves: {summary['header_leaves']}")
+    print(f"  code chunks: {summary['code_chunks']}")
+    print(f"  storage slots: {summary['storage_slots']} ({summary['written_storage_slots']} written)")
+    print(f"estimated witness size bytes: {summary['witness_bytes']}")
+    print("")
+    print("Pre-Verkle block gas used: " + str(pre_verkle_gas_used))
+    print("Post-Verkle block gas cost difference: " + str(post_verkle_gas_used - pre_verkle_gas_used))
+    print("Post-Verkle estimation block gas used: " + str(post_verkle_gas_used))
+    print("")
+
+
+def results_as_dict(total_gas_used, results, dumpall=False):
+    """
+    the results of a transaction, as printed by print_results(), JSON-serializable
+    :param dumpall: also list the accessed chunks of each contract
+    """
+    contracts = {}
+    for (address, result) in results['per_contract_result'].items():
+        contract = {name: value for (name, value) in result.items() if name != 'chunks'}
+        if dumpall:
+            contract['chunks'] = list(result['chunks'])
+        contracts[address] = contract
+    results_dict = dict(
+        pre_verkle_gas_used=total_gas_used,
+        post_verkle_gas_used=total_gas_used + results['total_gas_cost_difference'],
+        total_gas_cost_difference=results['total_gas_cost_difference'],
+        address_touching_opcode_cost_difference=results['address_touching_opcode_cost_difference'],
+        contracts=contracts,
+    )
+    if 'call_tree' in results:
+        results_dict['call_tree'] = results['call_tree']['calls']
+    return results_dict
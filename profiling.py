@@ -0,0 +1,146 @@
+import cProfile
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# the Profile of the test case being evaluated. None when profiling is off: phase() and count() then cost nothing
+current = None
+_lock = threading.Lock()
+
+
+class Profile:
+    """
+    Wall and CPU time of the phases of a test case, and counters of what it did (lines, subprocesses, cache hits...).
+    CPU time is the time of the thread running the phase: not of helper threads working meanwhile
+    (e.g. compressing a captured trace), nor of worker processes.
+    """
+    __slots__ = ('phases', 'counters')
+
+    def __init__(self):
+        # {phase: [wall seconds, cpu seconds, calls]}
+        self.phases = {}
+        self.counters = {}
+
+    def add_time(self, name, wall, cpu, calls=1):
+        with _lock:
+            times = self.phases.setdefault(name, [0.0, 0.0, 0])
+            times[0] += wall
+            times[1] += cpu
+            times[2] += calls
+
+    @contextmanager
+    def phase(self, name):
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - wall, time.thread_time() - cpu)
+
+    def count(self, name, n=1):
+        # also called from the code size fetching threads
+        with _lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def timed_lines(self, lines, name, counter="lines"):
+        """
+        :return: a generator of the given lines, timing (as phase `name`) the wait for each line,
+            e.g. for `cast run` to produce its trace. The lines are counted as `counter`.
+            Only the wall time is measured: reading the CPU clock for each line would cost more than the line.
+        """
+        wall = 0.0
+        count = 0
+        iterator = iter(lines)
+        clock = time.perf_counter
+        try:
+            while True:
+                start = clock()
+                line = next(iterator, None)
+                wall += clock() - start
+                if line is None:
+                    break
+                count += 1
+                yield line
+        finally:
+            self.add_time(name, wall, 0.0)
+            self.count(counter, count)
+
+    def as_dict(self):
+        return dict(
+            phases={name: dict(wall=round(wall, 6), cpu=round(cpu, 6), calls=calls)
+                    for (name, (wall, cpu, calls)) in self.phases.items()},
+            counters=dict(self.counters),
+        )
+
+    def merge(self, profile_dict):
+        """
+        add the phases and counters of another profile, as returned by as_dict()
+        """
+        for (name, times) in profile_dict['phases'].items():
+            self.add_time(name, times['wall'], times['cpu'], times['calls'])
+        for (name, n) in profile_dict['counters'].items():
+            self.count(name, n)
+
+
+def phase(name):
+    """
+    :return: a context manager timing a phase of the current test case (if profiling)
+    """
+    return nullcontext() if current is None else current.phase(name)
+
+
+def count(name, n=1):
+    if current is not None:
+        current.count(name, n)
+
+
+def exclusive_time(name, inner):
+    """
+    remove the time of an inner phase from an enclosing one (e.g. the trace reading from the parsing)
+    """
+    if current is not None and name in current.phases and inner in current.phases:
+        with _lock:
+            current.phases[name][0] -= current.phases[inner][0]
+            current.phases[name][1] -= current.phases[inner][1]
+
+
+class ParseProfiler:
+    """
+    cProfile capture of the parse loop only, accumulated across test cases
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.profiler = cProfile.Profile()
+
+    @contextmanager
+    def capture(self):
+        self.profiler.enable()
+        try:
+            yield
+        finally:
+            self.profiler.disable()
+
+    def dump(self, path=None):
+        """
+        write the pstats file (e.g. for `python3 -m pstats` or snakeviz)
+        """
+        self.profiler.dump_stats(path or self.path)
+
+
+def write_case(out, case_name, profile_dict):
+    out.write(json.dumps(dict(case=case_name, **profile_dict)) + "\n")
+    out.flush()
+
+
+def report(profile, cases, wall):
+    """
+    :return: the rolled-up profile of a run, as text lines
+    """
+    lines = [f"profile: {cases} cases in {wall:.3f}s"]
+    for (name, (phase_wall, phase_cpu, calls)) in sorted(profile.phases.items(), key=lambda item: -item[1][0]):
+        lines.append(f"  {name:<16} wall {phase_wall:10.3f}s  cpu {phase_cpu:10.3f}s  calls {calls}")
+    for (name, n) in sorted(profile.counters.items()):
+        lines.append(f"  {name:<32} {n}")
+    return lines
@@ -0,0 +1,196 @@
+"""
+Minimal JSON-RPC client over keep-alive HTTP connections, for the state lookups of the estimation
+(code sizes, blocks, transactions), without a `cast` process per lookup.
+Many calls are sent as JSON-RPC batches, and batches run concurrently under an asyncio limit.
+"""
+import asyncio
+import base64
+import http.client
+import itertools
+import json
+import os
+import queue
+import random
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+# HTTP statuses worth retrying: rate limited, or a temporarily unavailable node
+RETRY_STATUSES = frozenset([429, 502, 503, 504])
+
+
+class RpcError(Exception):
+    """
+    a JSON-RPC error response
+    """
+
+    def __init__(self, method, error):
+        super().__init__(f"{method}: {error.get('message')} (code {error.get('code')})")
+        self.code = error.get('code')
+
+
+class RetryableError(Exception):
+    def __init__(self, message, delay=None):
+        super().__init__(message)
+        # server-provided delay (Retry-After), in seconds
+        self.delay = delay
+
+
+class RpcClient:
+    """
+    A pool of keep-alive HTTP connections to a JSON-RPC node. Thread-safe.
+    Failed requests (connection errors, HTTP 429 and 5xx) are retried with an exponential backoff.
+    """
+
+    def __init__(self, url, pool_size=8, max_batch=100, timeout=60, retries=4, backoff=0.25):
+        """
+        :param url: http(s) URL of the node, possibly with user:password
+        :param pool_size: max number of concurrent connections (and of concurrent batches)
+        :param max_batch: max number of calls per JSON-RPC batch request
+        :param retries: number of retries of a failed request
+        :param backoff: delay before the first retry, in seconds. Doubled at each retry
+        """
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise Exception(f"Unsupported RPC URL {url}: only http and https are supported")
+        self.url = url
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        self.headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+        if parts.username is not None:
+            credentials = f"{urllib.parse.unquote(parts.username)}:{urllib.parse.unquote(parts.password or '')}"
+            self.headers["Authorization"] = "Basic " + base64.b64encode(credentials.encode()).decode()
+        self.pool_size = pool_size
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.ids = itertools.count(1)
+        self.requests = 0
+        # guards the counter
+        self._lock = threading.Lock()
+        self._reset_pool()
+
+    def _reset_pool(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+
+    def _acquire(self):
+        # connections must not be shared with forked worker processes
+        if self._pid != os.getpid():
+            self._reset_pool()
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self.connection_class(self.host, self.port, timeout=self.timeout)
+
+    def _release(self, connection, reuse):
+        if reuse:
+            self._idle.put(connection)
+        else:
+            connection.close()
+        self._slots.release()
+
+    def _post(self, payload):
+        """
+        :return: the decoded JSON response to a request, retrying failures
+        """
+        body = json.dumps(payload).encode()
+        for attempt in range(self.retries + 1):
+            connection = self._acquire()
+            reuse = False
+            try:
+                with self._lock:
+                    self.requests += 1
+                connection.request("POST", self.path, body, self.headers)
+                response = connection.getresponse()
+                data = response.read()
+                reuse = not response.will_close
+                if response.status in RETRY_STATUSES:
+                    retry_after = response.getheader("Retry-After")
+                    raise RetryableError(f"HTTP {response.status}",
+                                         float(retry_after) if retry_after and retry_after.isdigit() else None)
+                if response.status != 200:
+                    raise Exception(f"RPC {self.url}: HTTP {response.status} {data[:200]!r}")
+                return json.loads(data)
+            except (OSError, http.client.HTTPException, RetryableError) as e:
+                reuse = False
+                if attempt == self.retries:
+                    raise Exception(f"RPC {self.url}: {e!r} after {self.retries} retries") from e
+                delay = getattr(e, "delay", None)
+                if delay is None:
+                    # exponential backoff, with jitter so that concurrent clients don't retry in lockstep
+                    delay = self.backoff * (2 ** attempt) * (0.5 + random.random())
+                time.sleep(delay)
+            finally:
+                self._release(connection, reuse)
+
+    def call(self, method, *params):
+        """
+        :return: the result of a single call
+        :raises RpcError: on a JSON-RPC error response
+        """
+        response = self._post(dict(jsonrpc="2.0", id=next(self.ids), method=method, params=list(params)))
+        if response.get('error') is not None:
+            raise RpcError(method, response['error'])
+        return response.get('result')
+
+    def _batch(self, calls):
+        requests = [dict(jsonrpc="2.0", id=next(self.ids), method=method, params=list(params))
+                    for (method, params) in calls]
+        responses = self._post(requests)
+        if isinstance(responses, dict):
+            # the whole batch was rejected
+            raise RpcError("batch", responses.get('error') or {})
+        by_id = {response.get('id'): response for response in responses}
+        results = []
+        for (request, (method, _)) in zip(requests, calls):
+            response = by_id.get(request['id'])
+            if response is None:
+                results.append(RpcError(method, dict(message="no response in batch")))
+            elif response.get('error') is not None:
+                results.append(RpcError(method, response['error']))
+            else:
+                results.append(response.get('result'))
+        return results
+
+    def _chunks(self, calls):
+        return [calls[start:start + self.max_batch] for start in range(0, len(calls), self.max_batch)]
+
+    async def batch_async(self, calls, concurrency=None):
+        """
+        :param calls: list of (method, params)
+        :param concurrency: max number of batch requests in flight (default: the pool size)
+        :return: the result of each call, in order. A failed call's result is its RpcError (not raised)
+        """
+        chunks = self._chunks(calls)
+        limit = asyncio.Semaphore(concurrency or self.pool_size)
+
+        async def run(chunk):
+            async with limit:
+                return await asyncio.to_thread(self._batch, chunk)
+
+        results = await asyncio.gather(*(run(chunk) for chunk in chunks))
+        return [result for chunk_results in results for result in chunk_results]
+
+    def batch(self, calls, concurrency=None):
+        """
+        blocking batch_async(): calls are sent in batches of max_batch, concurrently.
+        Called from a running event loop (e.g. by a library user), the batches run in a thread pool instead
+        """
+        if len(calls) == 0:
+            return []
+        if len(calls) <= self.max_batch:
+            return self._batch(calls)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.batch_async(calls, concurrency))
+        with ThreadPoolExecutor(max_workers=concurrency or self.pool_size) as executor:
+            results = list(executor.map(self._batch, self._chunks(calls)))
+        return [result for chunk_results in results for result in chunk_results]
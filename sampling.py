@@ -0,0 +1,170 @@
+"""
+Stratified random sampling of test cases: the verkle gas cost difference of a large set of transactions
+(a results file, a block) is estimated from a random subset of them, with bootstrap confidence intervals.
+
+The cases are grouped in strata (e.g. by name or by called contract), and each stratum is sampled
+in proportion to its size. The estimates of all the cases weigh each stratum by its size.
+Intervals come from a stratified bootstrap: the sampled values are resampled, with replacement, within each stratum.
+The deviation of a resampled stratum mean is scaled by the finite population correction, sqrt(1 - n/N): the interval
+of the mean narrows as the sample covers the strata. A stratum whose cases were all evaluated is exact.
+A stratum with a single value shows no variance: the intervals only hold once each stratum has its minimum
+(see below_minimum()).
+"""
+import math
+import random
+
+QUANTILES = (0.5, 0.95)
+# the statistics of an estimate, each with its _low and _high bounds
+STATISTICS = ("mean",) + tuple(f"p{round(q * 100)}" for q in QUANTILES)
+CONFIDENCE = 0.95
+BOOTSTRAP_REPLICATES = 1000
+# the fewest sampled cases of a stratum (when it has as many), to see its variance
+MIN_STRATUM_SAMPLE = 2
+
+
+def weighted_quantile(values, q):
+    """
+    :param values: (value, weight) pairs, sorted by value
+    :return: the q-quantile (0 <= q <= 1) of the weighted values. None if there are none
+    """
+    if not values:
+        return None
+    rank = q * sum(weight for (_, weight) in values)
+    seen = 0
+    for (value, weight) in values:
+        seen += weight
+        if seen >= rank:
+            return value
+    return values[-1][0]
+
+
+def sample_statistics(samples, sizes):
+    """
+    :param samples: {stratum: [sampled value]}, of the strata with values
+    :param sizes: {stratum: number of cases}
+    :return: (mean, [each QUANTILES]) of all the cases, each stratum weighted by its size
+    """
+    total = sum(sizes[stratum] for stratum in samples)
+    mean = sum(sizes[stratum] * sum(values) / len(values) for (stratum, values) in samples.items()) / total
+    weighted = sorted((value, sizes[stratum] / len(values))
+                      for (stratum, values) in samples.items() for value in values)
+    return mean, [weighted_quantile(weighted, q) for q in QUANTILES]
+
+
+class StratifiedSample:
+    """
+    A stratified random sample of test cases, drawn a few at a time (see next_cases()), so that sampling can stop
+    as soon as the estimates are precise enough
+    """
+
+    def __init__(self, cases, stratum, sample_size, seed=None):
+        """
+        :param stratum: the stratum of a case, e.g. lambda case: case['name']
+        :param sample_size: the cases to sample, at most (about: each stratum gets at least MIN_STRATUM_SAMPLE,
+            so the sample can be larger, see len())
+        :param seed: of the random sample, and of the bootstrap
+        """
+        self.rnd = random.Random(seed)
+        self.strata = {}
+        for case in cases:
+            self.strata.setdefault(stratum(case), []).append(case)
+        self.sizes = {name: len(stratum_cases) for (name, stratum_cases) in self.strata.items()}
+        for stratum_cases in self.strata.values():
+            self.rnd.shuffle(stratum_cases)
+        total = len(cases)
+        self.allocation = {name: min(size, max(MIN_STRATUM_SAMPLE, round(sample_size * size / total)))
+                           for (name, size) in self.sizes.items()}
+        self.minimum = {name: min(MIN_STRATUM_SAMPLE, size) for (name, size) in self.sizes.items()}
+        self.drawn = {name: 0 for name in self.strata}
+        self.values = {name: [] for name in self.strata}
+
+    def __len__(self):
+        return sum(self.allocation.values())
+
+    def next_cases(self, count):
+        """
+        draw the next cases to evaluate: the strata below their minimum first, then those furthest from their allocation
+        :return: up to `count` (stratum, case) pairs, none once the sample is drawn
+        """
+        drawn = []
+        for _ in range(count):
+            remaining = [name for name in self.strata if self.drawn[name] < self.allocation[name]]
+            if not remaining:
+                break
+            name = min(remaining, key=lambda name: (self.drawn[name] >= self.minimum[name],
+                                                    self.drawn[name] / self.allocation[name]))
+            drawn.append((name, self.strata[name][self.drawn[name]]))
+            self.drawn[name] += 1
+        return drawn
+
+    def add(self, stratum, value):
+        """
+        add the value of an evaluated case
+        """
+        self.values[stratum].append(value)
+
+    def sampled(self):
+        return sum(len(values) for values in self.values.values())
+
+    def below_minimum(self):
+        """
+        :return: the cases still to evaluate for each stratum to have its minimum of values. The confidence intervals
+            are too narrow before (a stratum with one value has no variance)
+        """
+        return sum(max(0, self.minimum[name] - len(values)) for (name, values) in self.values.items())
+
+    def _bootstrap(self, samples, replicates):
+        """
+        :return: [(mean, [each QUANTILES]) of each bootstrap replicate of the samples]
+        """
+        means = {name: sum(values) / len(values) for (name, values) in samples.items()}
+        corrections = {name: math.sqrt(1 - len(values) / self.sizes[name]) for (name, values) in samples.items()}
+        total = sum(self.sizes[name] for name in samples)
+        replicated = []
+        for _ in range(replicates):
+            resampled = {name: values if len(values) == self.sizes[name] else self.rnd.choices(values, k=len(values))
+                         for (name, values) in samples.items()}
+            (_, quantiles) = sample_statistics(resampled, self.sizes)
+            mean = sum(self.sizes[name] * (means[name] + corrections[name] * (sum(values) / len(values) - means[name]))
+                       for (name, values) in resampled.items()) / total
+            replicated.append((mean, quantiles))
+        return replicated
+
+    def estimate(self, strata=None, replicates=BOOTSTRAP_REPLICATES, confidence=CONFIDENCE):
+        """
+        :param strata: the strata to estimate, default all of them
+        :return: the estimates of the cases of the strata, as a dict: population (the cases of the strata),
+            cases (those of the strata with values: the estimate is partial if fewer), sampled,
+            and each of STATISTICS (e.g. mean, p50), with the low and high bounds of their confidence interval
+            (e.g. mean_low, mean_high). None if no case of the strata was evaluated
+        """
+        strata = strata or self.strata
+        samples = {name: self.values[name] for name in strata if self.values[name]}
+        if not samples:
+            return None
+        (mean, quantiles) = sample_statistics(samples, self.sizes)
+        replicated = self._bootstrap(samples, replicates)
+        low_index = math.floor((1 - confidence) / 2 * replicates)
+        high_index = max(math.ceil((1 + confidence) / 2 * replicates) - 1, low_index)
+        estimate = dict(population=sum(self.sizes[name] for name in strata),
+                        cases=sum(self.sizes[name] for name in samples),
+                        sampled=sum(len(values) for values in samples.values()))
+        statistics = [(STATISTICS[0], mean, [replicate_mean for (replicate_mean, _) in replicated])] + [
+            (name, quantile, [replicate_quantiles[index] for (_, replicate_quantiles) in replicated])
+            for (index, (name, quantile)) in enumerate(zip(STATISTICS[1:], quantiles))]
+        for (name, value, replicate_values) in statistics:
+            replicate_values.sort()
+            estimate[name] = round(value, 1)
+            estimate[f"{name}_low"] = round(replicate_values[low_index], 1)
+            estimate[f"{name}_high"] = round(replicate_values[high_index], 1)
+        return estimate
+
+    def estimates(self, replicates=BOOTSTRAP_REPLICATES, confidence=CONFIDENCE):
+        """
+        :return: {stratum: estimate()} of the strata with values, after the one of all the strata (None)
+        """
+        estimates = {None: self.estimate(None, replicates, confidence)}
+        for name in self.strata:
+            if self.values[name]:
+                estimates[name] = self.estimate([name], replicates, confidence)
+        return estimates
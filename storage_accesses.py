@@ -0,0 +1,74 @@
+from array import array
+
+SLOAD = 0
+SSTORE = 1
+OPCODE_NAMES = ("SLOAD", "SSTORE")
+
+
+class StorageAccesses:
+    """
+    The SLOAD/SSTORE accesses of a single contract, in execution order, kept in compact typed columns.
+    Slots are interned: the `slot` column holds an index into `slots` (the slot keys, as hex strings).
+    """
+    __slots__ = ('slot_ids', 'slots', 'slot', 'opcode', 'gas', 'refund', 'seq')
+
+    def __init__(self):
+        self.slot_ids = {}
+        self.slots = []
+        self.slot = array('q')
+        self.opcode = array('b')
+        # gas and refund used by the opcode. 0 if unknown (not followed by an opcode step)
+        self.gas = array('q')
+        self.refund = array('q')
+        # step number of the access in the transaction
+        self.seq = array('q')
+
+    @staticmethod
+    def from_columns(slots, slot, opcode, gas, refund, seq):
+        """
+        :return: accesses over existing columns (e.g. memoryviews of a mapped file, then read-only). not copied
+        """
+        accesses = StorageAccesses()
+        accesses.slots = slots
+        accesses.slot_ids = {slot_hex: slot_id for (slot_id, slot_hex) in enumerate(slots)}
+        (accesses.slot, accesses.opcode, accesses.gas, accesses.refund, accesses.seq) = (slot, opcode, gas, refund, seq)
+        return accesses
+
+    def __len__(self):
+        return len(self.slot)
+
+    def intern(self, slot_hex):
+        slot_id = self.slot_ids.get(slot_hex)
+        if slot_id is None:
+            slot_id = self.slot_ids[slot_hex] = len(self.slots)
+            self.slots.append(slot_hex)
+        return slot_id
+
+    def append(self, slot_hex, opcode, seq, gas=0, refund=0):
+        """
+        :param opcode: SLOAD or SSTORE
+        :return: index of the access, to later set its gas and refund
+        """
+        self.slot.append(self.intern(slot_hex))
+        self.opcode.append(opcode)
+        self.gas.append(gas)
+        self.refund.append(refund)
+        self.seq.append(seq)
+        return len(self.slot) - 1
+
+    def set_gas(self, index, gas, refund):
+        self.gas[index] = gas
+        self.refund[index] = refund
+
+    def extend(self, other, seq_offset=0):
+        """
+        append the accesses of another StorageAccesses, e.g. of the same contract seen under another key
+        :param seq_offset: added to the step numbers of the other accesses (e.g. those of a later segment of a trace)
+        :return: self
+        """
+        self.slot.extend(array('q', [self.intern(other.slots[slot_id]) for slot_id in other.slot]))
+        self.opcode.extend(other.opcode)
+        self.gas.extend(other.gas)
+        self.refund.extend(other.refund)
+        self.seq.extend(array('q', [seq + seq_offset for seq in other.seq]) if seq_offset else other.seq)
+        return self
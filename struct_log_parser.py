@@ -0,0 +1,324 @@
+"""
+Streaming front end for geth-style structLog traces, i.e. the result of `debug_traceTransaction`
+with the default (struct) logger:
+    {"gas": 21000, "failed": false, "returnValue": "", "structLogs": [{"pc": 0, "op": "PUSH1", "gas": ..,
+     "gasCost": 3, "depth": 1, "stack": ["0x80"], "refund": 0}, ...]}
+optionally wrapped in a JSON-RPC response. The structLogs array is decoded one entry at a time,
+so the memory used does not depend on the trace length.
+
+Unlike `cast run` traces, structLogs don't name the called contracts: frames are derived from the
+stack operands of the CALL-family opcodes, and the address of a created contract is only known when
+its constructor returns (it is then on the stack of the creator).
+"""
+import json
+import operator
+import re
+from functools import partial
+
+from chunk_bitmap import ChunkBitmap
+from chunk_table import ChunkTable
+from create2 import create2_address
+from eip4762 import AccessEventTracker
+from storage_accesses import SLOAD, SSTORE, StorageAccesses
+from trace_parser import ADDRESS_TOUCHING_OPCODES, access_push_data
+
+CHUNK_SIZE = 1 << 16
+STRUCT_LOGS_PATTERN = re.compile(r'"structLogs"\s*:\s*\[')
+# "gas" of the result is the gas used by the transaction. Only searched for outside of the structLogs
+GAS_USED_PATTERN = re.compile(r'"gas"\s*:\s*(\d+)')
+SEPARATOR_PATTERN = re.compile(r"[\s,]*")
+
+CALL_OPCODES = frozenset(["CALL", "CALLCODE", "DELEGATECALL", "STATICCALL"])
+CREATE_OPCODES = frozenset(["CREATE", "CREATE2"])
+
+
+def is_struct_log(head):
+    """
+    :param head: the first characters of a trace
+    :return: True for a JSON (structLog) trace, False for a `cast run` text trace
+    """
+    return head.lstrip().startswith("{")
+
+
+class StructLogReader:
+    """
+    Iterate over the structLogs of a JSON trace, given as text chunks.
+    The gas used of the transaction is set once the iteration is over.
+    """
+
+    def __init__(self, chunks):
+        """
+        :param chunks: iterable of text chunks, e.g. iter(partial(stream.read, CHUNK_SIZE), "")
+        """
+        self.chunks = iter(chunks)
+        self.gas_used = None
+
+    def _scan_gas_used(self, text):
+        match = GAS_USED_PATTERN.search(text)
+        if match is not None and self.gas_used is None:
+            self.gas_used = int(match.group(1))
+
+    def __iter__(self):
+        decode = json.JSONDecoder().raw_decode
+        buffer = ""
+        while True:
+            match = STRUCT_LOGS_PATTERN.search(buffer)
+            if match is not None:
+                break
+            chunk = next(self.chunks, "")
+            if chunk == "":
+                raise Exception("No structLogs in JSON trace")
+            buffer += chunk
+        self._scan_gas_used(buffer[:match.start()])
+
+        pos = match.end()
+        while True:
+            pos = SEPARATOR_PATTERN.match(buffer, pos).end()
+            if pos < len(buffer) and buffer[pos] == "]":
+                break
+            try:
+                if pos == len(buffer):
+                    raise ValueError("need more data")
+                (log, pos) = decode(buffer, pos)
+            except ValueError:
+                # the entry is cut by the end of the chunk: only keep what is left to decode
+                chunk = next(self.chunks, "")
+                if chunk == "":
+                    raise Exception("Truncated structLogs in JSON trace")
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield log
+
+        # the gas used may also follow the structLogs
+        trailer = buffer[pos + 1:]
+        for chunk in self.chunks:
+            trailer += chunk
+        self._scan_gas_used(trailer)
+
+
+class PendingAddress:
+    """
+    A created contract whose address is not known yet (until its constructor returns).
+    The address stays None if the creation failed (0 on the stack of the creator, e.g. a reverting constructor)
+    """
+    __slots__ = ('address_id',)
+
+    def __init__(self):
+        self.address_id = None
+
+
+def resolve(key):
+    return key.address_id if isinstance(key, PendingAddress) else key
+
+
+def parse_struct_logs(case, chunks, to_address, access_events=None, dumpall=False, chunk_tables=None):
+    """
+    parse a structLog JSON trace into the same results as parse_trace_results()
+    :param case: test case (only 'txHash' is used, for logging)
+    :param chunks: iterable of text chunks of the JSON trace
+    :param to_address: the contract called by the transaction (not part of the structLogs)
+    :param access_events: AccessEventTracker to feed (reset first)
+    :param dumpall: also count the accesses of each code chunk
+    :param chunk_tables: function(address) returning the ChunkTable of the code of a contract (None if unknown),
+        to also access the chunks of the PUSH data of each executed instruction
+    """
+    print(f"Evaluating transaction {case['txHash']}")
+    if access_events is None:
+        access_events = AccessEventTracker()
+    access_events.reset()
+    address_of = access_events.addresses
+    intern = access_events.intern
+
+    # access events involving a created contract are deferred until its address is known,
+    # then replayed in order, so that the tracker sees the same event sequence as with a `cast run` trace
+    deferred = []
+    unresolved = 0
+
+    def emit(event, *args):
+        if unresolved > 0:
+            deferred.append((event, args))
+        else:
+            event(*args)
+
+    # call frames: (code key, context key, code ChunkBitmap, PendingAddress of a constructor frame or None,
+    # ChunkTable.last_chunk of the code or None). keys are address ids, or the PendingAddress of a created contract
+    frames = []
+    code_key = context_key = code_chunks = last_chunks = None
+    # {code address id: ChunkTable.last_chunk} of the contracts called in the transaction
+    last_chunks_by_id = {}
+
+    def code_last_chunks(address_id):
+        if chunk_tables is None:
+            return None
+        if address_id not in last_chunks_by_id:
+            table = chunk_tables(address_of[address_id])
+            last_chunks_by_id[address_id] = table.last_chunk if table is not None else None
+        return last_chunks_by_id[address_id]
+
+    # the frame entered if the depth increases at the next step
+    next_frame = None
+    # a creation, resolved from the stack of the first step after it returns
+    pending_create = None
+    last_depth = None
+    chunks_by_key = {}
+    slots = {}
+    touched = {}
+    count_call_with_value = {}
+    # (creator key, PendingAddress)
+    creations = []
+    step_number = 0
+    pending_access = None
+
+    def complete_storage_access(refund):
+        (accesses, index, access_context_key, gas, access_refund) = pending_access
+        accesses.set_gas(index, gas, refund - access_refund)
+        emit(access_events.storage, access_context_key, accesses.slots[accesses.slot[index]],
+             accesses.opcode[index] == SSTORE, gas, refund - access_refund)
+
+    def resolve_create(created, stack):
+        nonlocal unresolved
+        address = int(stack[-1], 16) if stack else 0
+        if address != 0:
+            created.address_id = intern(f"0x{address:040x}")
+        unresolved -= 1
+        if unresolved == 0:
+            for (event, args) in deferred:
+                args = [resolve(arg) for arg in args]
+                # the accesses of a failed creation have no address to be attributed to, and are dropped.
+                # The calls made by its constructor still load their callee (from an unknown caller)
+                if None not in (args[1:] if event == access_events.call else args):
+                    event(*args)
+            deferred.clear()
+
+    reader = StructLogReader(chunks)
+    for log in reader:
+        step_number += 1
+        depth = log['depth']
+        stack = log.get('stack')
+        refund = log.get('refund', 0)
+
+        if pending_access is not None:
+            complete_storage_access(refund)
+            pending_access = None
+
+        if depth != last_depth:
+            if last_depth is None or depth > last_depth:
+                if next_frame is None:
+                    # the transaction's own call
+                    to_id = intern(to_address.lower())
+                    next_frame = (to_id, to_id, None, code_last_chunks(to_id))
+                    emit(access_events.call, None, to_id, to_id, False)
+                (new_code_key, new_context_key, created, new_last_chunks) = next_frame
+                if new_code_key not in chunks_by_key:
+                    chunks_by_key[new_code_key] = ChunkBitmap(count_hits=dumpall)
+                frames.append((new_code_key, new_context_key, chunks_by_key[new_code_key], created, new_last_chunks))
+                # resolved when the constructor returns
+                pending_create = None
+            else:
+                while len(frames) > depth:
+                    created = frames.pop()[3]
+                    if created is not None:
+                        resolve_create(created, stack)
+                if pending_create is not None:
+                    # the creator itself failed
+                    resolve_create(pending_create, None)
+                    pending_create = None
+            (code_key, context_key, code_chunks, _, last_chunks) = frames[-1]
+            last_depth = depth
+        elif pending_create is not None:
+            # no constructor frame (empty init code, or failed before running it)
+            resolve_create(pending_create, stack)
+            pending_create = None
+        next_frame = None
+
+        pc = log['pc']
+        chunk = pc // 31
+        if chunk not in code_chunks:
+            emit(access_events.code_chunk, code_key, chunk)
+            code_chunks.add(chunk)
+        elif dumpall:
+            code_chunks.add(chunk)
+        if last_chunks is not None and pc < len(last_chunks) and last_chunks[pc] != chunk:
+            access_push_data(code_chunks, chunk, last_chunks[pc], partial(emit, access_events.code_chunk, code_key))
+
+        opcode = log['op']
+        if opcode == "SLOAD" or opcode == "SSTORE":
+            storage_slot = f"0x{int(stack[-1], 16):064x}"
+            if context_key not in slots:
+                slots[context_key] = StorageAccesses()
+            accesses = slots[context_key]
+            index = accesses.append(storage_slot, SSTORE if opcode == "SSTORE" else SLOAD, step_number)
+            pending_access = (accesses, index, context_key, log['gasCost'], refund)
+        elif opcode in ADDRESS_TOUCHING_OPCODES:
+            touched_id = intern(f"0x{int(stack[-1], 16) & ((1 << 160) - 1):040x}")
+            if touched_id not in touched:
+                touched[touched_id] = set()
+            touched[touched_id].add(opcode)
+            emit(access_events.touch, touched_id, opcode)
+        elif opcode in CALL_OPCODES:
+            callee_id = intern(f"0x{int(stack[-2], 16) & ((1 << 160) - 1):040x}")
+            # DELEGATECALL and CALLCODE run the callee's code in the context of the caller
+            target_key = callee_id if opcode == "CALL" or opcode == "STATICCALL" else context_key
+            value_transfer = (opcode == "CALL" or opcode == "CALLCODE") and int(stack[-3], 16) != 0
+            if value_transfer:
+                count_call_with_value[target_key] = count_call_with_value.get(target_key, 0) + 1
+            emit(access_events.call, context_key, callee_id, target_key, value_transfer)
+            next_frame = (callee_id, target_key, None, code_last_chunks(callee_id))
+        elif opcode in CREATE_OPCODES:
+            memory = log.get('memory')
+            created = PendingAddress()
+            init_last_chunks = None
+            if memory is not None:
+                (offset, size) = (int(stack[-2], 16), int(stack[-3], 16))
+                init_code = "".join(memory)[2 * offset:2 * (offset + size)]
+                if chunk_tables is not None:
+                    init_last_chunks = ChunkTable.from_code(bytes.fromhex(init_code)).last_chunk
+                if opcode == "CREATE2" and not isinstance(context_key, PendingAddress):
+                    # with memory capture, the CREATE2 address is known upfront
+                    created.address_id = intern(create2_address(address_of[context_key], stack[-4], init_code))
+            creations.append((context_key, created))
+            if created.address_id is None:
+                unresolved += 1
+                pending_create = created
+                (created_key, constructor_of) = (created, created)
+            else:
+                (created_key, constructor_of) = (created.address_id, None)
+            value_transfer = int(stack[-1], 16) != 0
+            if value_transfer:
+                count_call_with_value[created_key] = count_call_with_value.get(created_key, 0) + 1
+            emit(access_events.create, created_key)
+            emit(access_events.call, context_key, created_key, created_key, value_transfer)
+            next_frame = (created_key, created_key, constructor_of, init_last_chunks)
+
+    if pending_access is not None:
+        complete_storage_access(0)
+    if pending_create is not None:
+        resolve_create(pending_create, None)
+
+    def by_address(items, merge):
+        # a created contract may also have been accessed under its address (e.g. called after its creation)
+        result = {}
+        for (key, value) in items:
+            if resolve(key) is None:
+                # in the constructor of a failed creation
+                continue
+            address = address_of[resolve(key)]
+            result[address] = merge(result[address], value) if address in result else value
+        return result
+
+    created_contracts = {}
+    for (creator_key, created) in creations:
+        if created.address_id is not None and resolve(creator_key) is not None:
+            created_contracts.setdefault(address_of[resolve(creator_key)], []).append(address_of[created.address_id])
+
+    return dict(
+        gas_used=reader.gas_used,
+        steps=step_number,
+        chunks=by_address(chunks_by_key.items(), operator.ior),
+        slots=by_address(slots.items(), StorageAccesses.extend),
+        touched=by_address(touched.items(), operator.ior),
+        count_call_with_value=by_address(count_call_with_value.items(), operator.add),
+        created_contracts=created_contracts,
+        storage_counts=access_events.storage_counts(),
+    )
@@ -0,0 +1,103 @@
+import io
+import os
+import sys
+
+import pytest
+
+# the modules of the estimator are at the top of the repository
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from trace_generator import generate_trace  # noqa: E402
+from trace_parser import parse_trace_results  # noqa: E402
+
+# code sizes given to the contracts of generated traces: those called, and those created
+CODE_SIZE = 12000
+CREATED_CODE_SIZE = 500
+# the block of the transactions of the fake `cast`
+BLOCK = 20000000
+# a `cast` of a node where every contract has CODE_SIZE bytes of code. `run -t --quick {tx}` writes the generated
+# trace of the seed given by the tx hash (see tx())
+FAKE_CAST = f"""#!/bin/sh
+case "$1" in
+    --version) echo "cast 0.0.0 (fake)";;
+    chain-id) echo 1;;
+    tx) echo {BLOCK};;
+    codesize) echo {CODE_SIZE};;
+    code) echo 0x{"5b" * CODE_SIZE};;
+    run) exec "{sys.executable}" "{REPO}/trace_generator.py" -seed $(($4));;
+    *) exit 1;;
+esac
+"""
+
+
+def generated(**params):
+    """
+    :return: the text of a generated trace (see trace_generator.TraceGenerator for the parameters)
+    """
+    out = io.StringIO()
+    generate_trace(out, **params)
+    return out.getvalue()
+
+
+def with_code_sizes(trace_data):
+    """
+    give parsed trace data the 'code_sizes' the estimation needs, as if looked up
+    """
+    trace_data['code_sizes'] = {address: CODE_SIZE for address in trace_data['chunks']}
+    for contracts in trace_data['created_contracts'].values():
+        for contract in contracts:
+            trace_data['code_sizes'][contract] = CREATED_CODE_SIZE
+    return trace_data
+
+
+def parsed(access_events=None, **params):
+    """
+    :return: the parsed trace data of a generated trace, with its code sizes
+    """
+    case = dict(txHash=f"seed{params.get('seed', 1)}")
+    return with_code_sizes(parse_trace_results(case, io.StringIO(generated(**params)), access_events))
+
+
+def storage_rows(accesses):
+    """
+    :return: the storage accesses of a StorageAccesses, as comparable rows
+    """
+    return [(accesses.slots[slot], opcode, gas, refund, seq) for (slot, opcode, gas, refund, seq)
+            in zip(accesses.slot, accesses.opcode, accesses.gas, accesses.refund, accesses.seq)]
+
+
+def chunk_lists(chunks):
+    """
+    :return: {address: accessed chunks} of {address: ChunkBitmap}
+    """
+    return {address: list(contract_chunks) for (address, contract_chunks) in chunks.items()}
+
+
+def tx(seed):
+    """
+    :return: the hash of the transaction of the generated trace of a seed, for the fake `cast`
+    """
+    return f"0x{seed:064x}"
+
+
+@pytest.fixture
+def configure_estimator(tmp_path, monkeypatch):
+    """
+    :return: verkle_gas_estimator.configure(), with the fake `cast` and a cache dir of the test by default.
+        The configuration of the estimator is restored after the test
+    """
+    import verkle_gas_estimator as estimator
+    for name in estimator.CONFIG_OPTIONS + ('rpc', 'results_variant', 'code_size_cache', 'trace_store'):
+        monkeypatch.setattr(estimator, name, getattr(estimator, name))
+    cast = tmp_path / "cast"
+    cast.write_text(FAKE_CAST)
+    cast.chmod(0o755)
+
+    def configure(rpc_url=None, **options):
+        options = dict(dict(cast_executable=str(cast), cache_dir=str(tmp_path / "cache")), **options)
+        estimator.configure(rpc_url, **options)
+
+    yield configure
+    estimator.current_chain_id.cache_clear()
+    estimator.cast_version.cache_clear()
@@ -0,0 +1,24 @@
+from block_witness import BlockWitness
+from conftest import parsed
+
+
+def summary(*seeds):
+    witness = BlockWitness()
+    for seed in seeds:
+        witness.add_transaction(parsed(seed=seed, storage_ratio=0.2, create2=3, value_calls=3))
+    return witness.summary()
+
+
+def test_repeated_accesses_are_counted_once():
+    once = summary(1)
+    twice = summary(1, 1)
+    assert twice.pop('transactions') == 2
+    once.pop('transactions')
+    assert twice == once
+
+
+def test_disjoint_transactions_add_up():
+    # the contracts of generated traces of different seeds are distinct
+    (first, second, block) = (summary(1), summary(2), summary(1, 2))
+    for (field, value) in block.items():
+        assert value == first[field] + second[field], field
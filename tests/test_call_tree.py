@@ -0,0 +1,35 @@
+import pytest
+
+from call_tree import CallTreeTracker, call_tree_results, folded_stacks
+from conftest import parsed
+from estimation import estimate_verkle_gas_cost_difference
+
+
+def frames(frame):
+    yield frame
+    for called in frame['calls']:
+        yield from frames(called)
+
+
+@pytest.mark.parametrize("params", [
+    dict(seed=1, touch_ratio=0.01),
+    dict(seed=3, steps=20000, max_depth=6, call_ratio=0.01, storage_ratio=0.3, sstore_ratio=0.5, create2=6,
+         value_calls=5, value_creates=2, touch_ratio=0.01),
+])
+def test_frame_costs_add_up_to_the_transaction(params):
+    case = dict(txHash=f"seed{params['seed']}", name=f"seed{params['seed']}")
+    tracker = CallTreeTracker()
+    trace_data = parsed(tracker, **params)
+    trace_data['call_tree'] = tracker.call_tree(trace_data['steps'])
+    verkle_results = estimate_verkle_gas_cost_difference(trace_data, {})
+    tree = call_tree_results(case, trace_data, verkle_results, {})
+
+    # the value transfers of the generated traces all go to contracts: every cost is attributed to a frame
+    assert tree['unattributed'] == 0
+    attributed = sum(call['total_gas_cost_difference'] for call in tree['calls'])
+    assert attributed == verkle_results['total_gas_cost_difference']
+    for frame in frames(tree['calls'][0]):
+        assert frame['total_gas_cost_difference'] == frame['gas_cost_difference'] + \
+            sum(called['total_gas_cost_difference'] for called in frame['calls'])
+    # the folded stacks hold the witness gas of every frame
+    assert sum(folded_stacks(tree).values()) == sum(call['total_witness_gas'] for call in tree['calls'])
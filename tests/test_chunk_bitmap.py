@@ -0,0 +1,42 @@
+import random
+
+from chunk_bitmap import ChunkBitmap, common_chunks, merge_chunks
+from estimation import CODE_OFFSET
+
+
+def bitmap(chunks, **params):
+    result = ChunkBitmap(**params)
+    for chunk in chunks:
+        result.add(chunk)
+    return result
+
+
+def test_bitmap_matches_a_set():
+    rng = random.Random(1)
+    chunks = [rng.randrange(2000) for _ in range(300)]
+    result = bitmap(chunks, num_chunks=10, count_hits=True)
+    accessed = set(chunks)
+    assert len(result) == len(accessed)
+    assert list(result) == sorted(accessed)
+    assert all(chunk in result for chunk in accessed)
+    assert 5000 not in result
+    assert result.max_chunk() == max(accessed)
+    assert result.branch_count() == len({chunk // 256 for chunk in accessed})
+    assert result.branch_ids(CODE_OFFSET) == sorted({(CODE_OFFSET + chunk) // 256 for chunk in accessed})
+    assert result.chunk_hits(chunks[0]) == chunks.count(chunks[0])
+    # sized to the code: accessed chunks are never dropped
+    result.resize(1)
+    assert list(result) == sorted(accessed)
+
+
+def test_merge_and_common_chunks():
+    first = {"0xa": bitmap([1, 300, 700]), "0xb": bitmap([2])}
+    second = {"0xa": bitmap([1, 5, 700, 1200])}
+    total = merge_chunks({}, first)
+    merge_chunks(total, second)
+    assert list(total["0xa"]) == [1, 5, 300, 700, 1200]
+    assert list(total["0xb"]) == [2]
+    # the merged maps are not changed
+    assert list(first["0xa"]) == [1, 300, 700]
+    assert list(common_chunks([first, second], "0xa")) == [1, 700]
+    assert len(common_chunks([first, second], "0xb")) == 0
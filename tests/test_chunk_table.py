@@ -0,0 +1,50 @@
+import io
+
+from chunk_table import ChunkTable
+from keccak import keccak256
+from trace_generator import sm_call_line
+from trace_parser import parse_trace_results
+
+CONTRACT = "0x00000000000000000000000000000000000000c0"
+SENDER = "0x00000000000000000000000000000000000000a0"
+PUSH1 = 0x60
+PUSH32 = 0x7f
+# 20 JUMPDESTs, a PUSH32 at pc 20 (its data, pc 21 to 52, runs into chunk 1), a JUMPDEST at pc 53,
+# and a PUSH2 at pc 61, the last byte of chunk 1, missing the last byte of its data
+CODE = bytes([0x5b] * 20 + [PUSH32] + [0xee] * 32 + [0x5b] + [0x00] * 7 + [PUSH1 + 1, 0xff])
+
+
+def step_line(pc, gas, opcode, opcode_byte):
+    return (f"depth:1, PC:{pc}, gas:{hex(gas)}({gas}), OPCODE: \"{opcode}\"({opcode_byte})  "
+            f"refund:0x0(0) Stack:[], Data size:0, Data: 0x\n")
+
+
+def test_push_data_chunks():
+    table = ChunkTable.from_code(CODE)
+    assert (table.code_size, len(table), table.code_hash) == (63, 3, keccak256(CODE))
+    # the data of the PUSH32 fills the first 22 bytes of chunk 1. that of the PUSH2 the first 2 bytes of chunk 2:
+    # the code is padded with zeros to whole chunks
+    assert list(table.pushdata) == [0, 22, 2]
+    assert table.last_chunk[20] == 1
+    # the data bytes, and the instructions not running into the next chunk, map to their own chunk
+    assert [table.last_chunk[pc] for pc in (0, 21, 30, 31, 52, 53)] == [0, 0, 0, 1, 1, 1]
+    assert table.last_chunk[61] == 2
+    assert [len(chunk) for chunk in table.chunkify(CODE)] == [32, 32, 32]
+
+
+def test_bytes_round_trip():
+    table = ChunkTable.from_code(CODE)
+    read = ChunkTable.from_bytes(table.to_bytes())
+    assert (read.code_hash, read.code_size, read.pushdata) == (table.code_hash, table.code_size, table.pushdata)
+    assert list(read.last_chunk) == list(table.last_chunk)
+
+
+def test_parser_accesses_push_data_chunks():
+    # only the PUSH32 runs: chunk 1 holds nothing but its data
+    trace = (sm_call_line(CONTRACT, SENDER, CONTRACT, "Call", 0)
+             + step_line(20, 99999, "PUSH32", PUSH32)
+             + "Gas used: 21004\n")
+    tables = {CONTRACT: ChunkTable.from_code(CODE)}
+    assert list(parse_trace_results(dict(txHash="push32"), io.StringIO(trace))['chunks'][CONTRACT]) == [0]
+    assert list(parse_trace_results(dict(txHash="push32"), io.StringIO(trace),
+                                    chunk_tables=tables.get)['chunks'][CONTRACT]) == [0, 1]
@@ -0,0 +1,93 @@
+from code_size_cache import CANCUN_BLOCKS, CodeSizeCache
+
+CANCUN = CANCUN_BLOCKS[1]
+CONTRACT = "0x00000000000000000000000000000000000000c0"
+ACCOUNT = "0x00000000000000000000000000000000000000a0"
+
+
+class Node:
+    """
+    the code of each address, deployed at a block, and the fetches made
+    """
+
+    def __init__(self, deployments):
+        self.deployments = deployments
+        self.fetches = []
+
+    def code(self, address, block):
+        self.fetches.append((address, block))
+        (deployed, code) = self.deployments.get(address, (0, b""))
+        return code if block >= deployed else b""
+
+    def code_size(self, address, block):
+        return len(self.code(address, block))
+
+
+def cache(tmp_path, node, **params):
+    return CodeSizeCache(str(tmp_path / "code-sizes.sqlite"), node.code_size, fetch_code=node.code, **params)
+
+
+def test_size_reused_at_later_blocks(tmp_path):
+    node = Node({CONTRACT: (0, b"\x60\x80" * 100)})
+    cache(tmp_path, node).get(1, CANCUN + 100, CONTRACT)
+    # another run, with an empty memory cache
+    sizes = cache(tmp_path, node)
+    assert sizes.get(1, CANCUN + 200, CONTRACT) == 200
+    assert sizes.get(1, CANCUN + 300, CONTRACT) == 200
+    assert node.fetches == [(CONTRACT, CANCUN + 100)]
+    # not at an earlier block, nor on another chain
+    assert sizes.get(1, CANCUN + 50, CONTRACT) == 200
+    assert sizes.get(5, CANCUN + 200, CONTRACT) == 200
+    assert node.fetches == [(CONTRACT, CANCUN + 100), (CONTRACT, CANCUN + 50), (CONTRACT, CANCUN + 200)]
+
+
+def test_size_not_reused_before_cancun(tmp_path):
+    # a metamorphic contract: self-destructed, and redeployed with another code at the same address
+    node = Node({CONTRACT: (0, b"\x00" * 100)})
+    cache(tmp_path, node).get(1, CANCUN - 200, CONTRACT)
+    node.deployments[CONTRACT] = (CANCUN - 150, b"\x00" * 40)
+    sizes = cache(tmp_path, node)
+    assert sizes.get(1, CANCUN - 100, CONTRACT) == 40
+    assert sizes.get(1, CANCUN - 100, CONTRACT) == 40
+    # nor from before Cancun to after it
+    assert sizes.get(1, CANCUN + 100, CONTRACT) == 40
+    assert node.fetches == [(CONTRACT, CANCUN - 200), (CONTRACT, CANCUN - 100), (CONTRACT, CANCUN + 100)]
+
+
+def test_address_without_code_fetched_again(tmp_path):
+    node = Node({CONTRACT: (CANCUN + 150, b"\x00" * 31)})
+    sizes = cache(tmp_path, node, memory_size=0)
+    assert sizes.get(1, CANCUN + 100, CONTRACT) == 0
+    assert sizes.get(1, CANCUN + 200, CONTRACT) == 31
+    assert sizes.get(1, CANCUN + 100, ACCOUNT) == 0
+    assert sizes.get(1, CANCUN + 100, ACCOUNT) == 0
+    assert len(node.fetches) == 3
+
+
+def test_delegated_account_fetched_again(tmp_path):
+    # an EOA delegating to a contract (EIP-7702), then to another one
+    node = Node({ACCOUNT: (0, bytes.fromhex("ef0100") + bytes.fromhex(CONTRACT[2:]))})
+    sizes = cache(tmp_path, node, memory_size=0)
+    assert sizes.get(1, CANCUN + 100, ACCOUNT) == 23
+    first = sizes.chunk_table(1, CANCUN + 100, ACCOUNT)
+    node.deployments[ACCOUNT] = (CANCUN + 150, bytes.fromhex("ef0100") + b"\xc1" * 20)
+    assert sizes.get(1, CANCUN + 200, ACCOUNT) == 23
+    assert sizes.chunk_table(1, CANCUN + 200, ACCOUNT).code_hash != first.code_hash
+    assert node.fetches == [(ACCOUNT, CANCUN + 100)] * 2 + [(ACCOUNT, CANCUN + 200)] * 2
+
+
+def test_chunk_table_reused_at_later_blocks(tmp_path):
+    node = Node({CONTRACT: (0, b"\x7f" + b"\x01" * 32 + b"\x00" * 40)})
+    table = cache(tmp_path, node).chunk_table(1, CANCUN + 100, CONTRACT)
+    sizes = cache(tmp_path, node)
+    assert sizes.chunk_table(1, CANCUN + 200, CONTRACT).code_hash == table.code_hash
+    assert sizes.get(1, CANCUN + 200, CONTRACT) == table.code_size
+    assert node.fetches == [(CONTRACT, CANCUN + 100)]
+
+
+def test_memory_only_cache(tmp_path):
+    node = Node({CONTRACT: (0, b"\x00" * 10)})
+    sizes = CodeSizeCache(None, node.code_size)
+    assert sizes.get(1, 100, CONTRACT) == 10
+    assert sizes.get(1, 200, CONTRACT) == 10
+    assert len(node.fetches) == 2
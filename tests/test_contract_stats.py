@@ -0,0 +1,85 @@
+import csv
+import json
+import random
+import statistics
+
+import pytest
+
+from contract_stats import METRICS, QUANTILES, ContractStats, QuantileSketch
+
+
+def stream(size, seed):
+    """
+    :return: integer values spread over orders of magnitude, of both signs and with zeros, like gas cost differences
+    """
+    rnd = random.Random(seed)
+    return [round(rnd.choice((-1, 1, 1, 1)) * rnd.lognormvariate(8, 2)) for _ in range(size)]
+
+
+def sketch_of(values, **params):
+    sketch = QuantileSketch(**params)
+    for value in values:
+        sketch.add(value)
+    return sketch
+
+
+@pytest.mark.parametrize("relative_accuracy", [0.01, 0.05])
+def test_quantiles_within_relative_accuracy(relative_accuracy):
+    values = stream(20000, seed=1)
+    sketch = sketch_of(values, relative_accuracy=relative_accuracy)
+    ordered = sorted(values)
+    exact = statistics.quantiles(values, n=100, method="inclusive")
+    for percent in (1, 10, 25, 50, 75, 90, 95, 99):
+        # the exact quantile is interpolated between two consecutive values, the sketch estimates the first one
+        rank = percent / 100 * (len(values) - 1)
+        gap = ordered[int(rank) + 1] - ordered[int(rank)]
+        estimate = sketch.quantile(percent / 100)
+        assert abs(estimate - exact[percent - 1]) <= relative_accuracy * abs(exact[percent - 1]) + gap, percent
+
+
+def test_extreme_quantiles():
+    values = stream(1000, seed=2)
+    sketch = sketch_of(values)
+    assert sketch.quantile(0) == pytest.approx(min(values), rel=0.01)
+    assert sketch.quantile(1) == pytest.approx(max(values), rel=0.01)
+    assert QuantileSketch().quantile(0.5) is None
+
+
+@pytest.mark.parametrize("max_buckets", [2048, 40])
+def test_merge_equals_single_sketch(max_buckets):
+    (first, second) = (stream(5000, seed=3), stream(3000, seed=4))
+    merged = sketch_of(first, max_buckets=max_buckets).merge(sketch_of(second, max_buckets=max_buckets))
+    single = sketch_of(first + second, max_buckets=max_buckets)
+    for field in ('positive', 'negative', 'zero', 'count'):
+        assert getattr(merged, field) == getattr(single, field), field
+    for q in (0, 0.01, 0.5, 0.95, 0.99, 1):
+        assert merged.quantile(q) == single.quantile(q)
+
+
+def test_merge_of_different_accuracies_fails():
+    with pytest.raises(Exception):
+        QuantileSketch(relative_accuracy=0.01).merge(QuantileSketch(relative_accuracy=0.02))
+
+
+def test_csv_and_json_reports_match(tmp_path):
+    rnd = random.Random(5)
+    addresses = [f"0x{index:040x}" for index in range(1, 6)]
+    stats = ContractStats()
+    for _ in range(200):
+        stats.add({address: [rnd.randint(-2000, 50000), rnd.randint(0, 400), rnd.randint(0, 3000)]
+                   for address in rnd.sample(addresses, 3)})
+    names = {addresses[0]: "Token"}
+    (csv_path, json_path) = (str(tmp_path / "stats.csv"), str(tmp_path / "stats.json"))
+    stats.write(csv_path, names)
+    stats.write(json_path, names)
+
+    with open(json_path) as json_file:
+        report = json.load(json_file)
+    with open(csv_path, newline="") as csv_file:
+        reader = csv.DictReader(csv_file)
+        csv_rows = list(reader)
+    assert report['transactions'] == 200
+    assert reader.fieldnames == list(report['contracts'][0])
+    assert len(reader.fieldnames) == 3 + len(METRICS) * (4 + len(QUANTILES))
+    assert csv_rows == [{field: str(value) for (field, value) in row.items()} for row in report['contracts']]
+    assert [row['address'] for row in csv_rows if row['contract_name'] != row['address']] == [addresses[0]]
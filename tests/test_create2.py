@@ -0,0 +1,67 @@
+import io
+
+import pytest
+
+import keccak
+from create2 import create2_address
+from trace_parser import parse_trace_results
+
+# the examples of EIP-1014: (caller, salt, init code, address)
+EIP1014_EXAMPLES = [
+    ("0x0000000000000000000000000000000000000000", "0x0", "00", "0x4D1A2e2bB4F88F0250f26Ffff098B0b30B26BF38"),
+    ("0xdeadbeef00000000000000000000000000000000", "0x0", "00", "0xB928f69Bb1D91Cd65274e3c79d8986362984fDA3"),
+    ("0xdeadbeef00000000000000000000000000000000",
+     "0x000000000000000000000000feed000000000000000000000000000000000000", "00",
+     "0xD04116cDd17beBE565EB2422F2497E06cC1C9833"),
+    ("0x0000000000000000000000000000000000000000", "0x0", "deadbeef", "0x70f2b2914A2a4b783FaEFb75f459A580616Fcb5e"),
+    ("0x00000000000000000000000000000000deadbeef", "0xcafebabe", "deadbeef",
+     "0x60f3f640a8508fC6a86d45DF051962668E1e8AC7"),
+    ("0x00000000000000000000000000000000deadbeef", "0xcafebabe", "deadbeef" * 11,
+     "0x1d8bfDC5D46DC4f61D6b6115972536eBE6A8854C"),
+    ("0x0000000000000000000000000000000000000000", "0x0", "", "0xE33C0C7F7df4809055C3ebA6c09CFe4BaF1BD9e0"),
+]
+
+# EIP-1014's last but one example, as a CREATE2 in the `cast run -t --quick` trace format, and the constructor call
+CREATE2_TRACE = """\
+SM CALL:   0x00000000000000000000000000000000deadbeef,context:CallContext { address: 0x00000000000000000000000000000000deadbeef, caller: 0x5ff137d4b0fdcd49dca30c7cf57e578a026d2789, code_address: 0x00000000000000000000000000000000deadbeef, apparent_value: 0x0_U256, scheme: Call }, is_static:false, transfer:Transfer { source: 0x5ff137d4b0fdcd49dca30c7cf57e578a026d2789, target: 0x00000000000000000000000000000000deadbeef, value: 0x0_U256 }, input_size:4
+depth:1, PC:0, gas:0x1c9c380(30000000), OPCODE: "PUSH1"(96)  refund:0x0(0) Stack:[], Data size:0, Data: 0x
+depth:1, PC:2, gas:0x1c9c37d(29999997), OPCODE: "CREATE2"(245)  refund:0x0(0) Stack:[0x00000000000000000000000000000000000000000000000000000000cafebabe_U256, 0x000000000000000000000000000000000000000000000000000000000000002c_U256, 0x0000000000000000000000000000000000000000000000000000000000000000_U256, 0x0000000000000000000000000000000000000000000000000000000000000000_U256], Data size:0, Data: 0x
+CREATE CALL: caller:0x00000000000000000000000000000000deadbeef, scheme:Create2 { salt: 0x00000000000000000000000000000000000000000000000000000000cafebabe_U256 }, value:0x0_U256, init_code:"deadbeefdeadbeefdeadbeefdeadbeefdeadbeefdeadbeefdeadbeefdeadbeefdeadbeefdeadbeefdeadbeef", gas_limit:29530618
+SM CALL:   0x1d8bfdc5d46dc4f61d6b6115972536ebe6a8854c,context:CallContext { address: 0x1d8bfdc5d46dc4f61d6b6115972536ebe6a8854c, caller: 0x00000000000000000000000000000000deadbeef, code_address: 0x1d8bfdc5d46dc4f61d6b6115972536ebe6a8854c, apparent_value: 0x0_U256, scheme: Call }, is_static:false, transfer:Transfer { source: 0x00000000000000000000000000000000deadbeef, target: 0x1d8bfdc5d46dc4f61d6b6115972536ebe6a8854c, value: 0x0_U256 }, input_size:0
+depth:2, PC:0, gas:0x1c29ffa(29531130), OPCODE: "INVALID"(222)  refund:0x0(0) Stack:[], Data size:0, Data: 0x
+depth:1, PC:3, gas:0x1c2358c(29504908), OPCODE: "STOP"(0)  refund:0x0(0) Stack:[0x0000000000000000000000001d8bfdc5d46dc4f61d6b6115972536ebe6a8854c_U256], Data size:0, Data: 0x
+Traces:
+  [495092] 0x00000000000000000000000000000000deadbeef::fallback()
+    └─ ← ()
+
+
+Transaction successfully executed.
+Gas used: 495092
+"""
+
+
+@pytest.mark.parametrize("caller, salt, init_code, address", EIP1014_EXAMPLES)
+def test_eip1014_examples(caller, salt, init_code, address):
+    assert create2_address(caller, salt, init_code) == address.lower()
+
+
+def test_keccak256():
+    assert keccak.keccak256(b"").hex() == "c5d2460186f7233c927e7db2dcc703c0e500b653ca82273b7bfad8045d85a470"
+    assert keccak.keccak256(b"abc").hex() == "4e03657aea45a94fc7d47ba826c8d667c0d1e6e33a64a036ec44f58fa12d6c45"
+    assert keccak.keccak256(b"The quick brown fox jumps over the lazy dog").hex() == \
+        "4d741b6f1eb29cb2a9b9911c82f56fa8d73b04959d3d9d222895df6c0b28aa15"
+
+
+@pytest.mark.parametrize("size", [0, 1, 135, 136, 137, 272, 1000])
+def test_python_keccak256_across_blocks(size):
+    # the fallback without pycryptodome, over the padding and block boundaries of its 136-byte rate
+    crypto_keccak = pytest.importorskip("Crypto.Hash.keccak")
+    data = (bytes(range(256)) * 4)[:size]
+    assert keccak._keccak256_python(data) == crypto_keccak.new(digest_bits=256, data=data).digest()
+
+
+def test_parsed_created_contract():
+    parsed = parse_trace_results(dict(txHash="create2"), io.StringIO(CREATE2_TRACE))
+    assert parsed['created_contracts'] == {
+        "0x00000000000000000000000000000000deadbeef": ["0x1d8bfdc5d46dc4f61d6b6115972536ebe6a8854c"]}
+    assert parsed['gas_used'] == 495092
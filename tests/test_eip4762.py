@@ -0,0 +1,29 @@
+import io
+
+from conftest import generated
+from eip4762 import AccessEventTracker
+from trace_parser import parse_trace_results
+
+
+def trace(seed):
+    return generated(seed=seed, storage_ratio=0.2, create2=3)
+
+
+def test_reset_forgets_interned_ids():
+    tracker = AccessEventTracker()
+    parse_trace_results(dict(txHash="seed1"), io.StringIO(trace(1)), tracker)
+    tables = (len(tracker.addresses), len(tracker.stem_ids), len(tracker.slot_keys))
+    assert min(tables) > 0
+    for seed in range(2, 6):
+        parse_trace_results(dict(txHash=f"seed{seed}"), io.StringIO(trace(seed)), tracker)
+    parse_trace_results(dict(txHash="seed1"), io.StringIO(trace(1)), tracker)
+    assert (len(tracker.addresses), len(tracker.stem_ids), len(tracker.slot_keys)) == tables
+
+
+def test_reused_tracker_gives_the_same_results():
+    tracker = AccessEventTracker()
+    parse_trace_results(dict(txHash="seed2"), io.StringIO(trace(2)), tracker)
+    reused = parse_trace_results(dict(txHash="seed1"), io.StringIO(trace(1)), tracker)
+    fresh = parse_trace_results(dict(txHash="seed1"), io.StringIO(trace(1)))
+    assert reused['storage_counts'] == fresh['storage_counts']
+    assert reused['created_contracts'] == fresh['created_contracts']
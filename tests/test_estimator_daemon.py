@@ -0,0 +1,152 @@
+import http.client
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from conftest import BLOCK, CODE_SIZE, generated, tx
+from estimator_daemon import EstimateHandler, EstimatorService
+
+CODE = "0x" + "5b" * CODE_SIZE
+
+
+class StubNode(ThreadingHTTPServer):
+    """
+    a JSON-RPC node of chain 1, where every contract has the same code, counting the eth_getCode lookups
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.lock = threading.Lock()
+        self.code_lookups = 0
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        response = [self.answer(call) for call in payload] if isinstance(payload, list) else self.answer(payload)
+        body = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def answer(self, call):
+        if call['method'] == "eth_getCode":
+            with self.server.lock:
+                self.server.code_lookups += 1
+            result = CODE
+        else:
+            result = {"eth_chainId": "0x1", "eth_getTransactionByHash": dict(blockNumber=hex(BLOCK))}[call['method']]
+        return dict(jsonrpc="2.0", id=call['id'], result=result)
+
+
+def serve(server):
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    return thread
+
+
+@pytest.fixture
+def node():
+    server = StubNode()
+    serve(server)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def daemon(tmp_path, configure_estimator, node):
+    """
+    :return: the port of a daemon, estimating with the fake `cast` and the stub node
+    """
+    # each request runs cast and parses its trace, rather than reusing the parsed data of an earlier one
+    configure_estimator(f"http://127.0.0.1:{node.server_address[1]}", store_traces=False)
+    uploads = tmp_path / "uploads"
+    uploads.mkdir()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), EstimateHandler)
+    server.service = EstimatorService(str(uploads))
+    serve(server)
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def request(port, method, path, body=None, headers=None):
+    """
+    :return: the status and the JSON body of the response
+    """
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    try:
+        connection.request(method, path, body, headers or {})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def results(body):
+    # the same estimation, whatever the request
+    return {name: value for (name, value) in body.items() if name not in ('name', 'elapsed')}
+
+
+def test_estimate_and_uploaded_trace_agree(daemon):
+    (status, estimated) = request(daemon, "POST", "/estimate", json.dumps(dict(tx=tx(3), block=BLOCK)))
+    assert status == 200, estimated
+    assert estimated['name'] == tx(3)
+    assert estimated['contracts']
+
+    (status, uploaded) = request(daemon, "POST", "/estimate/trace?name=seed3", generated(seed=3).encode())
+    assert status == 200, uploaded
+    assert uploaded['name'] == "seed3"
+    assert results(uploaded) == results(estimated)
+
+
+@pytest.mark.parametrize(("path", "body", "headers"), [
+    ("/estimate", b"[1]", {}),
+    ("/estimate", b"not json", {}),
+    ("/estimate", b'{"tx": 1}', {}),
+    ("/estimate", b'{"tx": "0x1", "block": "latest"}', {}),
+    ("/estimate/trace", b"...", {"Content-Encoding": "br"}),
+])
+def test_bad_request(daemon, path, body, headers):
+    (status, reply) = request(daemon, "POST", path, body, headers)
+    assert status == 400
+    assert reply['error']
+    (status, reply) = request(daemon, "GET", "/status")
+    assert reply['errors'] == 0
+
+
+def test_concurrent_requests_share_the_caches(daemon, node):
+    seeds = [1, 2, 3, 4] * 3
+
+    def estimate(seed):
+        return request(daemon, "POST", "/estimate", json.dumps(dict(tx=tx(seed))))
+
+    with ThreadPoolExecutor(max_workers=len(seeds)) as executor:
+        replies = list(executor.map(estimate, seeds))
+    assert all(status == 200 for (status, _) in replies), replies
+    by_seed = {}
+    for (seed, (_, body)) in zip(seeds, replies):
+        assert results(body) == by_seed.setdefault(seed, results(body))
+
+    # the code sizes of the contracts are all known by now: none is looked up again
+    lookups = node.code_lookups
+    assert lookups > 0
+    with ThreadPoolExecutor(max_workers=len(seeds)) as executor:
+        again = list(executor.map(estimate, seeds))
+    assert [results(body) for (_, body) in again] == [results(body) for (_, body) in replies]
+    assert node.code_lookups == lookups
+
+    (status, reply) = request(daemon, "GET", "/status")
+    assert (reply['requests'], reply['errors'], reply['in_flight']) == (2 * len(seeds), 0, 0)
+    assert reply['code_size_cache']['memory_hits'] > 0
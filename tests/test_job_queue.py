@@ -0,0 +1,117 @@
+import multiprocessing
+import os
+import time
+from functools import partial
+
+import pytest
+
+import verkle_gas_estimator
+from job_queue import DONE, FAILED, LEASED, JobQueue
+
+
+def cases(count):
+    return [dict(txHash=f"0x{index:x}", name=f"case{index}") for index in range(count)]
+
+
+def evaluate_logged(log_path, case):
+    """
+    an evaluate_queued_case() which logs the transactions it evaluates, with the process evaluating them
+    """
+    with open(log_path, "a") as log:
+        log.write(f"{os.getpid()} {case['txHash']}\n")
+    # long enough for the workers to take turns
+    time.sleep(0.01)
+    if case['txHash'] == "0xbad":
+        return None, "Exception: bad transaction"
+    return ([case['name'], 100, 90], {}), None
+
+
+def fake_evaluation(log_path):
+    # picklable, to be evaluated by -j worker processes
+    return partial(evaluate_logged, log_path)
+
+
+def drain(path):
+    verkle_gas_estimator.drain_queue(JobQueue(path, "test"))
+
+
+def test_workers_evaluate_each_case_once(tmp_path, monkeypatch):
+    path = str(tmp_path / "queue.sqlite")
+    log_path = str(tmp_path / "evaluated.log")
+    monkeypatch.setattr(verkle_gas_estimator, "evaluate_queued_case", fake_evaluation(log_path))
+    monkeypatch.setattr(verkle_gas_estimator, "jobs", 1)
+    monkeypatch.setattr(verkle_gas_estimator, "QUEUE_POLL_SECONDS", 0.05)
+    queue = JobQueue(path, "test")
+    queue.add(cases(40))
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=drain, args=(path,)) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+        assert worker.exitcode == 0
+    with open(log_path) as log:
+        evaluated = [line.split() for line in log]
+    assert sorted(tx for (_, tx) in evaluated) == sorted(case['txHash'] for case in cases(40))
+    assert len({pid for (pid, _) in evaluated}) > 1
+    assert queue.counts() == {DONE: 40}
+    assert [case['name'] for (case, _, _) in queue.results()] == [case['name'] for case in cases(40)]
+
+
+def test_expired_lease_is_claimed_again(tmp_path):
+    queue = JobQueue(str(tmp_path / "queue.sqlite"), "test", lease_seconds=0)
+    queue.add(cases(2))
+    assert [case['txHash'] for case in queue.claim("dead", 1)] == ["0x0"]
+    # the dead worker's case, whose lease expired, comes first
+    assert [case['txHash'] for case in queue.claim("alive", 2)] == ["0x0", "0x1"]
+    queue.complete("0x0", "alive", dict(pre_verkle_gas_used=1))
+    queue.complete("0x0", "dead", dict(pre_verkle_gas_used=2))
+    assert [result for (_, result, _) in queue.results()] == [dict(pre_verkle_gas_used=1)]
+    assert queue.counts() == {DONE: 1, LEASED: 1}
+
+
+def test_failed_case_is_given_up(tmp_path, monkeypatch):
+    path = str(tmp_path / "queue.sqlite")
+    monkeypatch.setattr(verkle_gas_estimator, "evaluate_queued_case", fake_evaluation(str(tmp_path / "log")))
+    monkeypatch.setattr(verkle_gas_estimator, "jobs", 1)
+    queue = JobQueue(path, "test", max_attempts=2)
+    queue.add([dict(txHash="0xbad", name="bad"), dict(txHash="0x0", name="case0 double")])
+    verkle_gas_estimator.drain_queue(queue)
+    assert queue.counts() == {DONE: 1, FAILED: 1}
+    assert queue.failures() == [("0xbad", "Exception: bad transaction")]
+    # the failed case keeps its row, and is no baseline of the marginal gas of the next one
+    rows = list(verkle_gas_estimator.add_marginal_columns(verkle_gas_estimator.queued_rows(queue)))
+    assert rows == [["bad", FAILED, FAILED], ["case0 double", 100, 90, FAILED, FAILED]]
+
+
+def test_one_pool_for_all_claims(tmp_path, monkeypatch):
+    log_path = str(tmp_path / "evaluated.log")
+    monkeypatch.setattr(verkle_gas_estimator, "evaluate_queued_case", fake_evaluation(log_path))
+    monkeypatch.setattr(verkle_gas_estimator, "jobs", 2)
+    pools = []
+
+    def worker_pool(jobs):
+        pools.append(jobs)
+        return multiprocessing.get_context("fork").Pool(jobs)
+
+    monkeypatch.setattr(verkle_gas_estimator, "worker_pool", worker_pool)
+    queue = JobQueue(str(tmp_path / "queue.sqlite"), "test")
+    queue.add(cases(7))
+    verkle_gas_estimator.drain_queue(queue)
+    assert queue.counts() == {DONE: 7}
+    # 4 claims, by the 2 processes of a single pool (the last claim, of a single case, is evaluated here)
+    assert pools == [2]
+    with open(log_path) as log:
+        assert len({line.split()[0] for line in log} - {str(os.getpid())}) <= 2
+
+
+def test_version_mismatch(tmp_path):
+    path = str(tmp_path / "queue.sqlite")
+    JobQueue(path, "1").add(cases(1))
+    with pytest.raises(Exception, match="estimator version"):
+        JobQueue(path, "2").counts()
+
+
+def test_queue_rejects_sampling():
+    with pytest.raises(Exception, match="-queue cannot be used"):
+        verkle_gas_estimator.main(["-queue", "queue.sqlite", "-sample", "10"])
@@ -0,0 +1,38 @@
+import shutil
+
+import verkle_gas_estimator
+from journal import Journal
+
+
+def test_entries_of_another_version_are_ignored(tmp_path):
+    path = str(tmp_path / "run.journal")
+    journal = Journal(path, "1-aaa")
+    journal.append("0x1", pre_verkle_gas_used=100, post_verkle_gas_used=90)
+    journal.close()
+    journal = Journal(path, "1-bbb")
+    journal.append("0x2", pre_verkle_gas_used=200, post_verkle_gas_used=180)
+    journal.close()
+    assert list(Journal(path, "1-aaa").load()) == ["0x1"]
+    assert list(Journal(path, "1-bbb").load()) == ["0x2"]
+
+
+def test_results_version_follows_the_sources(tmp_path, monkeypatch):
+    for name in verkle_gas_estimator.RESULTS_SOURCES + ("benchmark.py",):
+        shutil.copy(name, tmp_path / name)
+    monkeypatch.setattr(verkle_gas_estimator, "__file__", str(tmp_path / "verkle_gas_estimator.py"))
+    verkle_gas_estimator.sources_hash.cache_clear()
+    try:
+        version = verkle_gas_estimator.results_version()
+        parsed_variant = verkle_gas_estimator.parsed_variant()
+        (tmp_path / "notes.txt").write_text("not a source")
+        with open(tmp_path / "benchmark.py", "a") as source:
+            source.write("\n# edited\n")
+        verkle_gas_estimator.sources_hash.cache_clear()
+        assert verkle_gas_estimator.results_version() == version
+        with open(tmp_path / "estimation.py", "a") as source:
+            source.write("\n# edited\n")
+        verkle_gas_estimator.sources_hash.cache_clear()
+        assert verkle_gas_estimator.results_version() != version
+        assert verkle_gas_estimator.parsed_variant() != parsed_variant
+    finally:
+        verkle_gas_estimator.sources_hash.cache_clear()
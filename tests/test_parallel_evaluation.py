@@ -0,0 +1,29 @@
+import verkle_gas_estimator as estimator
+from conftest import tx
+
+# baselines, and the cases measured relative to them
+NAMES = ["transfer", "transfer double", "swap", "swap four", "mint", "mint double", "mint four"]
+
+
+def evaluate(jobs, capsys, monkeypatch):
+    """
+    :return: the CSV rows of the cases evaluated with -j jobs, and the transactions in the order they were printed
+    """
+    monkeypatch.setattr(estimator, "jobs", jobs)
+    cases = [dict(txHash=tx(seed), name=name) for (seed, name) in enumerate(NAMES, 1)]
+    rows = list(estimator.add_marginal_columns(estimator.evaluate_test_cases(cases)))
+    printed = [line.split()[-1] for line in capsys.readouterr().out.splitlines()
+               if line.startswith("Evaluating transaction")]
+    return rows, printed
+
+
+def test_parallel_rows_equal_sequential_rows(configure_estimator, capsys, monkeypatch, tmp_path):
+    configure_estimator(cache_dir=str(tmp_path / "sequential"))
+    (sequential, printed) = evaluate(1, capsys, monkeypatch)
+    assert [row[0] for row in sequential] == NAMES
+    assert all(len(row) == 5 for row in sequential if "double" in row[0] or "four" in row[0])
+    assert printed == [tx(seed) for seed in range(1, len(NAMES) + 1)]
+
+    # nothing cached: the workers parse and look up everything again
+    configure_estimator(cache_dir=str(tmp_path / "parallel"))
+    assert evaluate(3, capsys, monkeypatch) == (sequential, printed)
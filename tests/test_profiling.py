@@ -0,0 +1,47 @@
+import glob
+import json
+import pstats
+
+import pytest
+
+import profiling
+import verkle_gas_estimator as estimator
+from conftest import tx
+
+CASES = [dict(txHash=tx(seed), name=f"seed{seed}") for seed in (1, 2, 3)]
+
+
+def evaluate(monkeypatch, jobs):
+    monkeypatch.setattr(estimator, "jobs", jobs)
+    rows = list(estimator.evaluate_test_cases(CASES))
+    estimator.report_profile()
+    return rows
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_profiling_gives_the_same_estimates(configure_estimator, monkeypatch, tmp_path, jobs):
+    configure_estimator()
+    expected = evaluate(monkeypatch, jobs)
+
+    (profile_path, stats_path) = (str(tmp_path / "profile.jsonl"), str(tmp_path / "parse.pstats"))
+    monkeypatch.setattr(estimator, "profile_path", profile_path)
+    monkeypatch.setattr(estimator, "parse_profiler", profiling.ParseProfiler(stats_path))
+    monkeypatch.setattr(estimator, "run_profile", profiling.Profile())
+    monkeypatch.setattr(estimator, "profiled_cases", 0)
+    assert evaluate(monkeypatch, jobs) == expected
+
+    with open(profile_path) as profile:
+        profiles = [json.loads(line) for line in profile]
+    assert [profile['case'] for profile in profiles] == [case['name'] for case in CASES] + ["total"]
+    for profile in profiles[:-1]:
+        assert {"total", "parse", "code sizes", "estimate"} <= set(profile['phases'])
+        assert profile['counters']['opcodes'] > 0
+    assert profiles[-1]['cases'] == len(CASES)
+    assert profiles[-1]['counters']['opcodes'] == sum(profile['counters']['opcodes'] for profile in profiles[:-1])
+
+    # the parse loop is profiled by the process parsing: here, or in each -j worker
+    paths = [stats_path] if jobs == 1 else glob.glob(f"{stats_path}.*")
+    assert paths
+    for path in paths:
+        functions = {function for (_, _, function) in pstats.Stats(path).stats}
+        assert "parse_trace_results" in functions
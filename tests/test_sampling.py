@@ -0,0 +1,78 @@
+import random
+
+from sampling import MIN_STRATUM_SAMPLE, StratifiedSample
+
+
+def population(strata, size, seed=1):
+    """
+    :return: cases of `strata` strata of `size` cases each, with values of different means and spreads
+    """
+    rnd = random.Random(seed)
+    return [dict(stratum=stratum, value=rnd.gauss(1000 * stratum, 100 + 50 * stratum))
+            for stratum in range(strata) for _ in range(size)]
+
+
+def evaluate(sample, count):
+    for (stratum, case) in sample.next_cases(count):
+        sample.add(stratum, case['value'])
+
+
+def test_first_round_reaches_minimum():
+    cases = population(10, 100)
+    sample = StratifiedSample(cases, lambda case: case['stratum'], 100, seed=1)
+    assert sample.below_minimum() == 10 * MIN_STRATUM_SAMPLE
+    # a round smaller than the minimum leaves strata with a single value
+    evaluate(sample, 10)
+    assert sample.below_minimum() == 10
+    evaluate(sample, sample.below_minimum())
+    assert sample.below_minimum() == 0
+    assert all(len(values) == MIN_STRATUM_SAMPLE for values in sample.values.values())
+
+
+def test_minimum_before_allocation():
+    # a large stratum does not hold back the minimum of the small ones
+    cases = population(1, 1000) + [dict(stratum=stratum, value=0) for stratum in (1, 2) for _ in range(5)]
+    sample = StratifiedSample(cases, lambda case: case['stratum'], 100, seed=1)
+    evaluate(sample, sample.below_minimum())
+    assert sample.below_minimum() == 0
+
+
+def test_interval_of_known_population():
+    cases = population(10, 100)
+    true_mean = sum(case['value'] for case in cases) / len(cases)
+    sample = StratifiedSample(cases, lambda case: case['stratum'], 100, seed=2)
+    evaluate(sample, sample.below_minimum())
+    estimate = sample.estimate()
+    assert estimate['mean_high'] - estimate['mean_low'] > 0
+    assert estimate['p95_high'] - estimate['p95_low'] > 0
+    assert estimate['cases'] == estimate['population'] == len(cases)
+    evaluate(sample, len(sample))
+    estimate = sample.estimate()
+    assert estimate['sampled'] == len(sample) == 100
+    assert estimate['mean_low'] < true_mean < estimate['mean_high']
+    assert estimate['mean_low'] <= estimate['mean'] <= estimate['mean_high']
+
+
+def test_whole_population_is_exact():
+    cases = population(3, 4)
+    sample = StratifiedSample(cases, lambda case: case['stratum'], len(cases), seed=3)
+    evaluate(sample, len(cases))
+    estimate = sample.estimate()
+    true_mean = round(sum(case['value'] for case in cases) / len(cases), 1)
+    assert estimate['mean'] == estimate['mean_low'] == estimate['mean_high'] == true_mean
+
+
+def test_partial_estimate():
+    cases = population(30, 100)
+    sample = StratifiedSample(cases, lambda case: case['stratum'], 60, seed=4)
+    evaluate(sample, 10)
+    estimate = sample.estimate()
+    assert estimate['population'] == 3000
+    assert estimate['cases'] == 1000
+    assert sample.below_minimum() > 0
+
+
+def test_sample_size_raised_by_minimum():
+    cases = population(5, 10)
+    sample = StratifiedSample(cases, lambda case: case['stratum'], 3, seed=5)
+    assert len(sample) == 5 * MIN_STRATUM_SAMPLE
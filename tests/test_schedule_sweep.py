@@ -0,0 +1,30 @@
+import pytest
+
+import estimation
+from conftest import parsed
+from estimation import (SCHEDULE_PARAMETERS, estimate_verkle_gas_cost_difference, schedule_counts,
+                        sweep_gas_cost_differences)
+
+SCHEDULES = [
+    {},
+    dict(WITNESS_BRANCH_COST=3800, WITNESS_CHUNK_COST=350),
+    {name: 1000 + 7 * index for (index, name) in enumerate(SCHEDULE_PARAMETERS)},
+]
+
+
+@pytest.mark.parametrize("numpy", [True, False])
+def test_sweep_equals_estimation_with_the_schedule(monkeypatch, numpy):
+    if numpy:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(estimation, "np", None)
+    transactions = [parsed(seed=seed, storage_ratio=0.3, sstore_ratio=0.5, create2=4, value_calls=5, touch_ratio=0.01)
+                    for seed in (1, 3)]
+    differences = sweep_gas_cost_differences([schedule_counts(trace_data) for trace_data in transactions], SCHEDULES)
+    for (schedule_index, schedule) in enumerate(SCHEDULES):
+        with monkeypatch.context() as patched:
+            for (name, cost) in schedule.items():
+                patched.setattr(estimation, name, cost)
+            for (trace_data, tx_differences) in zip(transactions, differences):
+                expected = estimate_verkle_gas_cost_difference(trace_data, {})['total_gas_cost_difference']
+                assert tx_differences[schedule_index] == expected
@@ -0,0 +1,76 @@
+import io
+import json
+
+import pytest
+
+from conftest import chunk_lists, generated, storage_rows, with_code_sizes
+from estimation import estimate_verkle_gas_cost_difference
+from struct_log_parser import parse_struct_logs
+from trace_parser import parse_trace_results
+
+# generator parameters of the transactions parsed from both trace formats
+TRANSACTIONS = [
+    dict(seed=1),
+    dict(seed=3, storage_ratio=0.3, sstore_ratio=0.5, create2=4, value_calls=5),
+    # value-bearing CREATE2 calls
+    dict(seed=5, create2=6, value_creates=3),
+    dict(seed=4, steps=20000, max_depth=8, call_ratio=0.02, create2=10, value_creates=2),
+]
+
+
+@pytest.mark.parametrize("params", TRANSACTIONS)
+def test_struct_log_parity(params):
+    text = generated(**params)
+    case = dict(txHash=f"seed{params['seed']}")
+    expected = parse_trace_results(case, io.StringIO(text))
+    # structLogs don't name the called contract: the first call of the text trace does
+    to_address = text.split("SM CALL:", 1)[1].split(",", 1)[0].strip()
+    parsed = parse_struct_logs(case, [generated(struct_log=True, **params)], to_address)
+
+    for key in ('gas_used', 'steps', 'touched', 'count_call_with_value', 'created_contracts', 'storage_counts'):
+        assert parsed[key] == expected[key], key
+    assert chunk_lists(parsed['chunks']) == chunk_lists(expected['chunks'])
+    assert {address: storage_rows(accesses) for (address, accesses) in parsed['slots'].items()} == \
+        {address: storage_rows(accesses) for (address, accesses) in expected['slots'].items()}
+
+    assert estimate_verkle_gas_cost_difference(with_code_sizes(parsed), {}) == \
+        estimate_verkle_gas_cost_difference(with_code_sizes(expected), {})
+
+
+def test_value_bearing_create2_is_counted():
+    params = dict(seed=5, create2=6, value_creates=3)
+    text = generated(**params)
+    to_address = text.split("SM CALL:", 1)[1].split(",", 1)[0].strip()
+    parsed = parse_struct_logs(dict(txHash="seed5"), [generated(struct_log=True, **params)], to_address)
+    created = {address for addresses in parsed['created_contracts'].values() for address in addresses}
+    assert len(created & set(parsed['count_call_with_value'])) == 3
+
+
+def test_reverting_constructor_is_not_attributed():
+    (to_address, other) = ("0x" + "11" * 20, "0x" + "22" * 20)
+
+    def step(pc, op, depth, stack=()):
+        return dict(pc=pc, op=op, gas=100000, gasCost=3, depth=depth, stack=list(stack), refund=0)
+
+    logs = [
+        step(0, "PUSH1", 1),
+        # CREATE of value 0, without memory capture: the address is that left on the stack by the constructor
+        step(40, "CREATE", 1, ["0x20", "0x0", "0x0"]),
+        # the constructor writes storage and calls another contract, then reverts
+        step(0, "SSTORE", 2, ["0x2a", "0x1"]),
+        step(70, "CALL", 2, ["0x0", "0x0", "0x0", "0x0", "0x0", other, "0xffff"]),
+        step(0, "STOP", 3),
+        step(71, "REVERT", 2, ["0x0", "0x0"]),
+        # the failed creation leaves 0 on the stack
+        step(41, "POP", 1, ["0x0"]),
+        step(42, "SLOAD", 1, ["0x5"]),
+        step(43, "STOP", 1),
+    ]
+    trace = json.dumps(dict(gas=60000, failed=False, returnValue="", structLogs=logs))
+    parsed = parse_struct_logs(dict(txHash="revert"), [trace], to_address)
+
+    assert chunk_lists(parsed['chunks']) == {to_address: [0, 1], other: [0]}
+    assert list(parsed['slots']) == [to_address]
+    assert parsed['created_contracts'] == {}
+    assert parsed['count_call_with_value'] == {}
+    assert list(parsed['storage_counts']) == [to_address]
@@ -0,0 +1,18 @@
+from conftest import chunk_lists, parsed, storage_rows
+from estimation import estimate_verkle_gas_cost_difference
+from trace_data_file import read_trace_data, write_trace_data
+
+
+def test_round_trip(tmp_path):
+    trace_data = parsed(seed=3, storage_ratio=0.3, sstore_ratio=0.5, create2=4, value_calls=5)
+    path = str(tmp_path / "seed3.vtd")
+    write_trace_data(path, trace_data)
+    read = read_trace_data(path)
+
+    for key in ('gas_used', 'steps', 'touched', 'count_call_with_value', 'created_contracts', 'storage_counts',
+                'code_sizes'):
+        assert read[key] == trace_data[key], key
+    assert chunk_lists(read['chunks']) == chunk_lists(trace_data['chunks'])
+    assert {address: storage_rows(accesses) for (address, accesses) in read['slots'].items()} == \
+        {address: storage_rows(accesses) for (address, accesses) in trace_data['slots'].items()}
+    assert estimate_verkle_gas_cost_difference(read, {}) == estimate_verkle_gas_cost_difference(trace_data, {})
@@ -0,0 +1,27 @@
+import io
+
+import trace_segments
+from conftest import chunk_lists, generated, storage_rows
+from eip4762 import AccessEventTracker
+from trace_parser import parse_trace_results
+from trace_segments import parse_trace_file_parallel, split_trace
+
+
+def test_segmented_parse_equals_sequential_parse(tmp_path, monkeypatch):
+    # many calls from depth 1, to split the trace at
+    text = generated(seed=4, steps=5000, max_depth=2, call_ratio=0.05, storage_ratio=0.2, create2=6, value_calls=4,
+                     touch_ratio=0.01)
+    path = tmp_path / "trace.txt"
+    path.write_text(text)
+    # segments of a few KB, rather than of MBs
+    monkeypatch.setattr(trace_segments, "MIN_SEGMENT_BYTES", 1 << 12)
+    assert len(split_trace(path.read_bytes(), 8)) > 4
+
+    case = dict(txHash="seed4")
+    expected = parse_trace_results(case, io.StringIO(text))
+    parsed = parse_trace_file_parallel(case, str(path), 2, AccessEventTracker())
+    for key in ('gas_used', 'steps', 'touched', 'count_call_with_value', 'created_contracts', 'storage_counts'):
+        assert parsed[key] == expected[key], key
+    assert chunk_lists(parsed['chunks']) == chunk_lists(expected['chunks'])
+    assert {address: storage_rows(accesses) for (address, accesses) in parsed['slots'].items()} == \
+        {address: storage_rows(accesses) for (address, accesses) in expected['slots'].items()}
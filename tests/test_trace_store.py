@@ -0,0 +1,74 @@
+import hashlib
+import io
+import os
+
+import pytest
+
+import trace_store
+from conftest import generated
+from trace_store import CAPTURE_BATCH_LINES, TraceStore
+
+TX = "0x" + "ab" * 32
+
+
+def lines(**params):
+    return io.StringIO(generated(**params)).readlines()
+
+
+def files(root):
+    return sorted(os.path.relpath(os.path.join(directory, name), root)
+                  for (directory, _, names) in os.walk(root) for name in names)
+
+
+@pytest.mark.parametrize("suffix", [".gz", ".zst"])
+def test_capture_find_read(tmp_path, suffix):
+    if suffix == ".zst":
+        pytest.importorskip("zstandard")
+    store = TraceStore(str(tmp_path))
+    store.suffix = suffix
+    # more than a batch of lines
+    trace = lines(seed=2, steps=3 * CAPTURE_BATCH_LINES)
+    assert list(store.capture(TX, "cast 1.0", iter(trace), dict(chain_id=1, block=20000000))) == trace
+
+    ref = store.find(TX, "cast 1.0")
+    digest = hashlib.sha256("".join(trace).encode()).hexdigest()
+    assert ref == dict(chain_id=1, block=20000000, tx=TX, cast_version="cast 1.0", object=digest, suffix=suffix)
+    # the most recent capture, whatever its cast version
+    assert store.find(TX) == ref
+    assert store.find(TX, "cast 2.0") == ref
+    (read_ref, read_lines) = store.read(TX, "cast 1.0")
+    assert read_ref == ref
+    assert list(read_lines) == trace
+    assert files(str(tmp_path)) == sorted([os.path.join("objects", digest[:2], digest + suffix),
+                                           os.path.join("refs", "cast_1.0", TX + ".json")])
+
+
+def test_partially_consumed_capture_is_not_stored(tmp_path):
+    store = TraceStore(str(tmp_path))
+    capture = store.capture(TX, "cast 1.0", iter(lines(seed=2, steps=3 * CAPTURE_BATCH_LINES)))
+    for _ in range(CAPTURE_BATCH_LINES + 10):
+        next(capture)
+    capture.close()
+    assert store.find(TX) is None
+    assert files(str(tmp_path)) == []
+
+
+@pytest.mark.parametrize("failing", ["open", "write"])
+def test_writer_error_reaches_the_caller(tmp_path, monkeypatch, failing):
+    class FailingStream(io.StringIO):
+        def write(self, text):
+            raise OSError("No space left on device")
+
+    def open_compressed(path, mode):
+        if failing == "open":
+            raise OSError("Permission denied")
+        return FailingStream()
+
+    monkeypatch.setattr(trace_store, "_open_compressed", open_compressed)
+    store = TraceStore(str(tmp_path))
+    # many more batches than the writer queue holds: the capture must not block on it
+    trace = lines(seed=2, steps=40 * CAPTURE_BATCH_LINES)
+    with pytest.raises(OSError):
+        list(store.capture(TX, "cast 1.0", iter(trace)))
+    assert store.find(TX) is None
+    assert files(str(tmp_path)) == []
@@ -0,0 +1,63 @@
+import io
+
+import pytest
+
+from trace_generator import generate_trace, sm_call_line, step_line
+from trace_parser import parse_trace_results
+from trace_tokenizer import CREATE_CALL, OTHER, STEP, tokenize
+
+FACTORY = "0x00000000000000000000000000000000000000fa"
+SENDER = "0x00000000000000000000000000000000000000a0"
+CREATED = "0x000000000000000000000000000000000000c0de"
+# a CREATE (no salt: its address is the one of the constructor's SM CALL)
+CREATE_LINE = (f"CREATE CALL: caller:{FACTORY}, scheme:Create, value:0x0_U256, "
+               f"init_code:\"6080604052348015600f57600080fd5b50\", gas_limit:29530618\n")
+
+
+def trace_lines():
+    out = io.StringIO()
+    generate_trace(out, steps=200, seed=1)
+    return out.getvalue().splitlines(keepends=True)
+
+
+def test_truncated_step_line():
+    lines = trace_lines()
+    line_number = next(index for (index, line) in enumerate(lines, 1) if line.startswith("depth:")) + 3
+    lines[line_number - 1] = lines[line_number - 1][:40] + "\n"
+    with pytest.raises(Exception, match=f"Malformed trace line {line_number}: depth:"):
+        parse_trace_results(dict(txHash="truncated"), iter(lines))
+
+
+def test_truncated_call_line():
+    lines = [line if not line.startswith("SM CALL") else line[:30] + "\n" for line in trace_lines()]
+    with pytest.raises(Exception, match="Malformed trace line 2: SM CALL"):
+        list(tokenize(lines))
+
+
+def test_steps_and_other_lines():
+    lines = trace_lines()
+    tokens = list(tokenize(["console.log: depth: 3\n"] + lines))
+    assert sum(1 for (kind, _) in tokens if kind == STEP) == sum(1 for line in lines if line.startswith("depth:"))
+    assert tokens[0] == (OTHER, None)
+
+
+def create_trace(constructor_runs):
+    lines = [sm_call_line(FACTORY, SENDER, FACTORY, "Call", 0), step_line(1, 0, 1000000, "PUSH1", 0, []),
+             CREATE_LINE]
+    if constructor_runs:
+        lines += [sm_call_line(CREATED, FACTORY, CREATED, "Call", 0), step_line(2, 0, 900000, "PUSH1", 0, [])]
+    return lines + [step_line(1, 3, 800000, "STOP", 0, []), "Gas used: 221000\n"]
+
+
+def test_create_without_salt():
+    ((_, (caller, salt, init_code)),) = [token for token in tokenize(create_trace(True)) if token[0] == CREATE_CALL]
+    assert (caller, salt, init_code) == (FACTORY, None, "6080604052348015600f57600080fd5b50")
+    parsed = parse_trace_results(dict(txHash="create"), iter(create_trace(True)))
+    assert parsed['created_contracts'] == {FACTORY: [CREATED]}
+    assert list(parsed['chunks']) == [FACTORY, CREATED]
+
+
+def test_create_failing_before_its_constructor():
+    # e.g. the caller lacks the value: the next line is a step of the caller
+    parsed = parse_trace_results(dict(txHash="create"), iter(create_trace(False)))
+    assert parsed['created_contracts'] == {}
@@ -0,0 +1,218 @@
+"""
+Compact binary format of parsed trace data (the results of parse_trace_results(), with their 'code_sizes'),
+to re-estimate transactions without running cast and the parser again.
+
+A file is a header, a directory of typed sections, then the sections, each aligned to 8 bytes:
+    header: magic "VGTD", format version, section count, gas used, steps
+    directory: for each section, its name, array typecode, offset and item count
+Addresses are kept once, in a string table of 20-byte entries, and referenced by index.
+Per-contract variable-size data (chunk bitmaps, storage accesses) is concatenated in a section,
+with the end offset of each contract in another one.
+
+read_trace_data() maps the file: the chunk bitmaps and the storage access columns are memoryviews
+of the mapping, nothing is copied until used.
+"""
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+
+from chunk_bitmap import ChunkBitmap
+from eip4762 import STORAGE_COUNTS, TOUCHING_OPCODE_HEADER_LEAVES
+from storage_accesses import StorageAccesses
+
+MAGIC = b"VGTD"
+# bump when the format, or the results of the parser, change: older files are then ignored
+TRACE_DATA_VERSION = 2
+HEADER = struct.Struct("<4sIIIqq")
+DIRECTORY_ENTRY = struct.Struct("<16s4sQQ")
+ADDRESS_BYTES = 20
+SLOT_BYTES = 32
+# code size of the addresses without one
+NO_VALUE = -(1 << 63)
+TOUCHING_OPCODES = tuple(sorted(TOUCHING_OPCODE_HEADER_LEAVES))
+# the typed columns of StorageAccesses
+ACCESS_COLUMNS = (('slot', 'q'), ('opcode', 'b'), ('gas', 'q'), ('refund', 'q'), ('seq', 'q'))
+
+
+def _check_byte_order():
+    # sections are written and mapped in the native byte order
+    if sys.byteorder != "little":
+        raise Exception("Trace data files are only supported on little-endian machines")
+
+
+def _ends(sizes):
+    ends = array('Q')
+    total = 0
+    for size in sizes:
+        total += size
+        ends.append(total)
+    return ends
+
+
+def write_trace_data(path, trace_data):
+    """
+    write parsed trace data, atomically
+    :param trace_data: results of parse_trace_results(), with 'code_sizes'
+    """
+    _check_byte_order()
+    address_ids = {}
+
+    def address_id(address):
+        if address not in address_ids:
+            address_ids[address] = len(address_ids)
+        return address_ids[address]
+
+    chunks = trace_data['chunks']
+    slots = trace_data['slots']
+    created = array('I')
+    for (creator, contracts) in trace_data['created_contracts'].items():
+        for contract in contracts:
+            created.extend((address_id(creator), address_id(contract)))
+    chunk_address = array('I', [address_id(address) for address in chunks])
+    slot_address = array('I', [address_id(address) for address in slots])
+    for address in list(trace_data['touched']) + list(trace_data['count_call_with_value']) + list(
+            trace_data.get('storage_counts', {})):
+        address_id(address)
+
+    count = len(address_ids)
+    code_sizes = array('q', [NO_VALUE]) * count
+    call_value = array('Q', [0]) * count
+    touched = array('B', [0]) * count
+    storage_counts = array('q', [0]) * (count * len(STORAGE_COUNTS))
+    for (address, code_size) in trace_data['code_sizes'].items():
+        if address in address_ids:
+            code_sizes[address_ids[address]] = code_size
+    for (address, calls) in trace_data['count_call_with_value'].items():
+        call_value[address_ids[address]] = calls
+    for (address, opcodes) in trace_data['touched'].items():
+        touched[address_ids[address]] = sum(1 << TOUCHING_OPCODES.index(opcode) for opcode in opcodes)
+    for (address, counts) in trace_data.get('storage_counts', {}).items():
+        row = address_ids[address] * len(STORAGE_COUNTS)
+        storage_counts[row:row + len(STORAGE_COUNTS)] = array('q', [counts[name] for name in STORAGE_COUNTS])
+
+    bitmaps = list(chunks.values())
+    sections = dict(
+        addresses=array('B', b"".join(bytes.fromhex(address[2:]) for address in address_ids)),
+        code_sizes=code_sizes,
+        call_value=call_value,
+        touched=touched,
+        storage_counts=storage_counts,
+        created=created,
+        chunk_address=chunk_address,
+        chunk_end=_ends(len(bitmap.bits) for bitmap in bitmaps),
+        chunk_bits=array('B', b"".join(bitmap.bits for bitmap in bitmaps)),
+    )
+    if any(bitmap.hits is not None for bitmap in bitmaps):
+        # with -a, the hits of each chunk
+        hits = [array('I', bitmap.hits) if bitmap.hits is not None else array('I') for bitmap in bitmaps]
+        sections['hits_end'] = _ends(len(contract_hits) for contract_hits in hits)
+        sections['hits'] = array('I', b"".join(contract_hits.tobytes() for contract_hits in hits))
+
+    accesses = list(slots.values())
+    sections.update(
+        slot_address=slot_address,
+        access_end=_ends(len(contract_accesses) for contract_accesses in accesses),
+        slot_key_end=_ends(len(contract_accesses.slots) for contract_accesses in accesses),
+        slot_keys=array('B', b"".join(int(slot, 16).to_bytes(SLOT_BYTES, "big")
+                                      for contract_accesses in accesses for slot in contract_accesses.slots)),
+    )
+    for (column, typecode) in ACCESS_COLUMNS:
+        sections[column] = array(typecode, b"".join(getattr(contract_accesses, column).tobytes()
+                                                    for contract_accesses in accesses))
+
+    gas_used = trace_data['gas_used']
+    offset = HEADER.size + len(sections) * DIRECTORY_ENTRY.size
+    directory = []
+    for (name, values) in sections.items():
+        offset = (offset + 7) & ~7
+        directory.append(DIRECTORY_ENTRY.pack(name.encode(), values.typecode.encode(), offset, len(values)))
+        offset += len(values) * values.itemsize
+
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as out:
+        out.write(HEADER.pack(MAGIC, TRACE_DATA_VERSION, len(sections), 0,
+                              gas_used if gas_used is not None else -1, trace_data['steps']))
+        out.write(b"".join(directory))
+        for values in sections.values():
+            out.write(bytes(-out.tell() & 7))
+            values.tofile(out)
+    os.replace(tmp_path, path)
+
+
+def read_trace_data(path):
+    """
+    map a trace data file
+    :return: the trace data, as returned by parse_trace_results() (with 'code_sizes').
+        Its ChunkBitmaps and StorageAccesses are read-only views of the file.
+    """
+    _check_byte_order()
+    with open(path, "rb") as f:
+        view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    (magic, version, section_count, _, gas_used, steps) = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise Exception(f"{path} is not a trace data file")
+    if version != TRACE_DATA_VERSION:
+        raise Exception(f"{path} is trace data version {version}, expected {TRACE_DATA_VERSION}")
+    sections = {}
+    for index in range(section_count):
+        (name, typecode, offset, count) = DIRECTORY_ENTRY.unpack_from(view, HEADER.size + index * DIRECTORY_ENTRY.size)
+        typecode = typecode.rstrip(b"\0").decode()
+        sections[name.rstrip(b"\0").decode()] = view[offset:offset + count * struct.calcsize(typecode)].cast(typecode)
+
+    table = sections['addresses']
+    addresses = ["0x" + table[start:start + ADDRESS_BYTES].hex() for start in range(0, len(table), ADDRESS_BYTES)]
+
+    chunks = {}
+    hits = sections.get('hits')
+    bits_start = hits_start = 0
+    for (index, address_index) in enumerate(sections['chunk_address']):
+        bits_end = sections['chunk_end'][index]
+        contract_hits = None
+        if hits is not None:
+            hits_end = sections['hits_end'][index]
+            contract_hits = hits[hits_start:hits_end]
+            hits_start = hits_end
+        chunks[addresses[address_index]] = ChunkBitmap.from_buffer(sections['chunk_bits'][bits_start:bits_end],
+                                                                   contract_hits)
+        bits_start = bits_end
+
+    slots = {}
+    slot_keys = sections['slot_keys']
+    access_start = key_start = 0
+    for (index, address_index) in enumerate(sections['slot_address']):
+        (access_end, key_end) = (sections['access_end'][index], sections['slot_key_end'][index])
+        keys = ["0x" + slot_keys[key * SLOT_BYTES:(key + 1) * SLOT_BYTES].hex() for key in range(key_start, key_end)]
+        slots[addresses[address_index]] = StorageAccesses.from_columns(
+            keys, *(sections[column][access_start:access_end] for (column, _) in ACCESS_COLUMNS))
+        (access_start, key_start) = (access_end, key_end)
+
+    created_contracts = {}
+    created = sections['created']
+    for index in range(0, len(created), 2):
+        created_contracts.setdefault(addresses[created[index]], []).append(addresses[created[index + 1]])
+
+    storage_counts = {}
+    counts = sections['storage_counts']
+    for (address_index, address) in enumerate(addresses):
+        row = counts[address_index * len(STORAGE_COUNTS):(address_index + 1) * len(STORAGE_COUNTS)]
+        if row[0] != 0:
+            storage_counts[address] = dict(zip(STORAGE_COUNTS, row))
+
+    touched = sections['touched']
+    return dict(
+        gas_used=gas_used if gas_used >= 0 else None,
+        steps=steps,
+        chunks=chunks,
+        slots=slots,
+        touched={address: {opcode for (bit, opcode) in enumerate(TOUCHING_OPCODES) if touched[index] >> bit & 1}
+                 for (index, address) in enumerate(addresses) if touched[index]},
+        count_call_with_value={address: sections['call_value'][index]
+                               for (index, address) in enumerate(addresses) if sections['call_value'][index]},
+        created_contracts=created_contracts,
+        storage_counts=storage_counts,
+        code_sizes={address: sections['code_sizes'][index]
+                    for (index, address) in enumerate(addresses) if sections['code_sizes'][index] != NO_VALUE},
+    )
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Generate synthetic traces in the `cast run -t --quick` format (or as geth structLogs JSON),
+to measure the parser and the estimation without a node. The traces are deterministic for a given seed:
+both formats of a seed describe the same execution.
+"""
+import random
+import re
+import sys
+
+from create2 import create2_address
+
+OPCODE_BYTES = {
+    "PUSH1": 96, "ADD": 1, "MSTORE": 82, "JUMPDEST": 91, "SWAP1": 144, "SLOAD": 84, "SSTORE": 85, "CALL": 241,
+    "STATICCALL": 250, "DELEGATECALL": 244, "CREATE2": 245, "EXTCODESIZE": 59, "BALANCE": 49, "STOP": 0,
+    "RETURN": 243,
+}
+PLAIN_OPCODES = ["PUSH1", "ADD", "MSTORE", "JUMPDEST", "SWAP1"]
+BLOCK_GAS_LIMIT = 30_000_000
+# large traces would use more gas than a block has
+START_GAS_PER_STEP = 1000
+
+
+def word(value):
+    return f"0x{value:064x}_U256"
+
+
+def step_line(depth, pc, gas, opcode, refund, stack):
+    stack_str = ", ".join(word(value) for value in stack)
+    return (f"depth:{depth}, PC:{pc}, gas:{hex(gas)}({gas}), OPCODE: \"{opcode}\"({OPCODE_BYTES[opcode]})  "
+            f"refund:{hex(refund)}({refund}) Stack:[{stack_str}], Data size:0, Data: 0x\n")
+
+
+def struct_log(depth, pc, gas, opcode, cost, refund, stack):
+    stack_json = ",".join(f'"{hex(value)}"' for value in stack)
+    return (f'{{"pc":{pc},"op":"{opcode}","gas":{gas},"gasCost":{cost},"depth":{depth},'
+            f'"stack":[{stack_json}],"refund":{refund}}}')
+
+
+def sm_call_line(address, caller, code_address, scheme, value):
+    return (f"SM CALL:   {address},context:CallContext {{ address: {address}, caller: {caller}, "
+            f"code_address: {code_address}, apparent_value: {hex(value)}_U256, scheme: {scheme} }}, "
+            f"is_static:false, transfer:Transfer {{ source: {caller}, target: {address}, value: {hex(value)}_U256 }}, "
+            f"input_size:388\n")
+
+
+class TraceGenerator:
+    """
+    A transaction calling into a pool of contracts. Each step is a plain opcode, a storage access,
+    an address-touching opcode or a call (CALL, STATICCALL, DELEGATECALL or CREATE2) to a nested frame.
+    """
+
+    def __init__(self, steps=10000, max_depth=4, storage_ratio=0.05, sstore_ratio=0.3, call_ratio=0.002,
+                 touch_ratio=0.002, create2=2, value_calls=2, contracts=20, code_size=12000, seed=1,
+                 struct_log=False, value_creates=0):
+        """
+        :param steps: number of opcode steps
+        :param max_depth: maximum call depth
+        :param storage_ratio: fraction of the steps that are SLOAD or SSTORE
+        :param sstore_ratio: fraction of the storage accesses that are SSTORE
+        :param call_ratio: fraction of the steps that call another contract (if below max_depth)
+        :param touch_ratio: fraction of the steps that are EXTCODESIZE or BALANCE
+        :param create2: number of CREATE2 calls
+        :param value_calls: number of CALLs transferring value
+        :param contracts: number of contracts in the pool
+        :param code_size: jumps land anywhere in the first code_size bytes of a contract
+        :param struct_log: write the trace as geth structLogs JSON (debug_traceTransaction) instead
+        :param value_creates: number of the CREATE2 calls transferring value (the first ones)
+        """
+        self.steps = steps
+        self.max_depth = max_depth
+        self.storage_ratio = storage_ratio
+        self.sstore_ratio = sstore_ratio
+        self.call_ratio = call_ratio
+        self.touch_ratio = touch_ratio
+        self.creates_left = create2
+        self.value_calls_left = value_calls
+        self.code_size = code_size
+        self.rnd = random.Random(seed)
+        self.pool = [f"0x{self.rnd.getrandbits(160):040x}" for _ in range(contracts)]
+        self.sender = f"0x{self.rnd.getrandbits(160):040x}"
+        self.start_gas = max(BLOCK_GAS_LIMIT, steps * START_GAS_PER_STEP)
+        self.gas = self.start_gas
+        self.refund = 0
+        self.emitted = 0
+        self.struct_log = struct_log
+        self.value_creates_left = value_creates
+
+    def generate(self, out):
+        """
+        write the trace to a text stream
+        """
+        entry = self.pool[0]
+        if self.struct_log:
+            # the gas used is only known at the end: written after the structLogs
+            out.write('{"structLogs":[\n')
+            self._frame(out, 1, entry, self.sender, entry, "Call", 0, self.steps)
+            out.write(f'\n],"failed":false,"returnValue":"","gas":{self.start_gas - self.gas}}}\n')
+            return
+        out.write("Executing previous transactions from the block.\n")
+        self._frame(out, 1, entry, self.sender, entry, "Call", 0, self.steps)
+        gas_used = self.start_gas - self.gas
+        out.write("Traces:\n")
+        out.write(f"  [{gas_used}] {entry}::fallback()\n")
+        out.write("    └─ ← ()\n\n\n")
+        out.write("Transaction successfully executed.\n")
+        out.write(f"Gas used: {gas_used}\n")
+
+    def _step(self, out, depth, pc, opcode, stack, cost, refund=0):
+        if not self.struct_log:
+            out.write(step_line(depth, pc, self.gas, opcode, self.refund, stack))
+        elif self.emitted == 0:
+            out.write(struct_log(depth, pc, self.gas, opcode, cost, self.refund, stack))
+        else:
+            out.write(",\n" + struct_log(depth, pc, self.gas, opcode, cost, self.refund, stack))
+        self.emitted += 1
+        self.gas -= cost
+        # the refund of an opcode shows in the next step
+        self.refund += refund
+
+    def _frame(self, out, depth, address, caller, code_address, scheme, value, budget):
+        rnd = self.rnd
+        if not self.struct_log:
+            out.write(sm_call_line(address, caller, code_address, scheme, value))
+        slots = [rnd.getrandbits(rnd.choice([6, 256])) for _ in range(8)]
+        # compiled contracts start with PUSH1 0x80
+        self._step(out, depth, 0, "PUSH1", [], 3)
+        pc = 2
+        while budget > 0 and self.emitted < self.steps:
+            budget -= 1
+            r = rnd.random()
+            stack = [rnd.getrandbits(32), rnd.getrandbits(32)]
+            if r < self.storage_ratio:
+                slot = rnd.choice(slots)
+                if rnd.random() < self.sstore_ratio:
+                    cost = rnd.choice([20000, 2900, 100, 5000])
+                    refund = 4800 if cost == 2900 and rnd.random() < 0.3 else 0
+                    self._step(out, depth, pc, "SSTORE", stack + [rnd.getrandbits(64), slot], cost, refund)
+                else:
+                    self._step(out, depth, pc, "SLOAD", stack + [slot], rnd.choice([2100, 100]))
+            elif r < self.storage_ratio + self.touch_ratio:
+                touched = int(rnd.choice(self.pool + [self.sender]), 16)
+                self._step(out, depth, pc, rnd.choice(["EXTCODESIZE", "BALANCE"]), stack + [touched], 2600)
+            elif r < self.storage_ratio + self.touch_ratio + self.call_ratio and depth < self.max_depth:
+                result = self._call(out, depth, pc, address, stack)
+                # the opcode following a call is a plain stack operation (ISZERO, SWAP...)
+                pc += 1
+                self._step(out, depth, pc, "SWAP1", stack + [result], 3)
+            else:
+                self._step(out, depth, pc, rnd.choice(PLAIN_OPCODES), stack, 3)
+            if rnd.random() < 0.05:
+                pc = rnd.randint(0, self.code_size)
+            else:
+                pc += rnd.choice([1, 1, 2, 33])
+        self._step(out, depth, pc, "RETURN", [0, 0], 0)
+
+    def _call(self, out, depth, pc, address, stack):
+        """
+        :return: the value pushed by the call: 1 (success), or the created address
+        """
+        rnd = self.rnd
+        budget = rnd.randint(10, self.steps // 10 + 10)
+        if self.creates_left > 0 and rnd.random() < 0.2:
+            self.creates_left -= 1
+            salt = rnd.getrandbits(256)
+            init_code = f"{rnd.getrandbits(8 * 64):0128x}"
+            value = 0
+            if self.value_creates_left > 0:
+                self.value_creates_left -= 1
+                value = rnd.randint(1, 10 ** 18)
+            # value, offset, size, salt
+            self._step(out, depth, pc, "CREATE2", stack + [salt, len(init_code) // 2, 0, value], 32000)
+            if not self.struct_log:
+                out.write(f"CREATE CALL: caller:{address}, scheme:Create2 {{ salt: 0x{salt:064x}_U256 }}, "
+                          f"value:{hex(value)}_U256, init_code:\"{init_code}\", gas_limit:{self.gas}\n")
+            created = create2_address(address, hex(salt), init_code)
+            self._frame(out, depth + 1, created, address, created, "Call", value, rnd.randint(10, 200))
+            return int(created, 16)
+        callee = rnd.choice(self.pool)
+        opcode = rnd.choice(["CALL", "STATICCALL", "DELEGATECALL"])
+        value = 0
+        if opcode == "CALL" and self.value_calls_left > 0 and rnd.random() < 0.3:
+            self.value_calls_left -= 1
+            value = rnd.randint(1, 10 ** 18)
+        self._step(out, depth, pc, opcode, stack + [value, int(callee, 16), self.gas], 2600)
+        if opcode == "DELEGATECALL":
+            # runs the callee's code in the context of the caller
+            self._frame(out, depth + 1, address, address, callee, "DelegateCall", 0, budget)
+        else:
+            self._frame(out, depth + 1, callee, address, callee, "Call", value, budget)
+        return 1
+
+
+def generate_trace(out, **params):
+    """
+    write a synthetic trace to a text stream. see TraceGenerator for the parameters.
+    """
+    TraceGenerator(**params).generate(out)
+
+
+def parse_count(value):
+    """
+    :return: the int value of a count like "10000", "10k" or "1m"
+    """
+    match = re.fullmatch(r"(\d+)([kKmM]?)", value)
+    if match is None:
+        raise Exception(f"Invalid count {value}")
+    return int(match.group(1)) * {"": 1, "k": 1000, "m": 1000000}[match.group(2).lower()]
+
+
+def usage():
+    print(f"usage: {sys.argv[0]} [options]")
+    print("write a synthetic `cast run -t --quick` trace to stdout")
+    print("Options:")
+    print("  -steps {N} number of opcode steps, e.g. 10000, 10k, 1m (default: 10k)")
+    print("  -depth {N} maximum call depth (default: 4)")
+    print("  -storage {ratio} fraction of the steps that are SLOAD or SSTORE (default: 0.05)")
+    print("  -sstore {ratio} fraction of the storage accesses that are SSTORE (default: 0.3)")
+    print("  -calls {ratio} fraction of the steps that call another contract (default: 0.002)")
+    print("  -touch {ratio} fraction of the steps that are EXTCODESIZE or BALANCE (default: 0.002)")
+    print("  -create2 {N} number of CREATE2 calls (default: 2)")
+    print("  -value-calls {N} number of CALLs transferring value (default: 2)")
+    print("  -value-creates {N} number of the CREATE2 calls transferring value (default: 0)")
+    print("  -contracts {N} number of contracts called (default: 20)")
+    print("  -seed {N} random seed (default: 1)")
+    print("  -structlog write geth structLogs JSON (as returned by debug_traceTransaction) instead")
+    print("  -o {file} write to a file instead of stdout")
+    sys.exit(1)
+
+
+OPTIONS = {
+    "-steps": ("steps", parse_count),
+    "-depth": ("max_depth", int),
+    "-storage": ("storage_ratio", float),
+    "-sstore": ("sstore_ratio", float),
+    "-calls": ("call_ratio", float),
+    "-touch": ("touch_ratio", float),
+    "-create2": ("create2", int),
+    "-value-calls": ("value_calls", int),
+    "-value-creates": ("value_creates", int),
+    "-contracts": ("contracts", int),
+    "-seed": ("seed", int),
+}
+
+
+def main():
+    args = sys.argv[1:]
+    params = {}
+    output = None
+    while len(args) > 0:
+        opt = args.pop(0)
+        if opt in OPTIONS:
+            (name, convert) = OPTIONS[opt]
+            params[name] = convert(args.pop(0))
+        elif opt == "-structlog":
+            params['struct_log'] = True
+        elif opt == "-o":
+            output = args.pop(0)
+        else:
+            usage()
+    if output is None:
+        generate_trace(sys.stdout, **params)
+    else:
+        with open(output, "w") as out:
+            generate_trace(out, **params)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+from functools import partial
+
+from chunk_bitmap import ChunkBitmap
+from chunk_table import ChunkTable
+from create2 import create2_address
+from eip4762 import AccessEventTracker
+from storage_accesses import SLOAD, SSTORE, OPCODE_NAMES, StorageAccesses
+from trace_tokenizer import (STEP, SM_CALL, CREATE_CALL, GAS_USED, DEPTH_GROUP, PC_GROUP, GAS_GROUP, OPCODE_GROUP,
+                             REFUND_GROUP, STACK_GROUP, tokenize, split_stack, step_fields)
+
+# call_opcodes=["CALL", "CALLCODE", "DELEGATECALL", "STATICCALL"]
+ADDRESS_TOUCHING_OPCODES = frozenset(["EXTCODESIZE", "EXTCODECOPY", "EXTCODEHASH", "BALANCE", "SELFDESTRUCT"])
+
+
+def report_storage_access(pending_access, next_stack_str):
+    (accesses, index, _, _, _, context_address, storage_slot, val) = pending_access
+    opcode = OPCODE_NAMES[accesses.opcode[index]]
+    gas = accesses.gas[index]
+    refund = accesses.refund[index]
+    if opcode == "SSTORE":
+        print(f"{opcode} context={context_address} slot={storage_slot} gas={gas} refund={refund} val={val}")
+    else:
+        ret = split_stack(next_stack_str, 1)[0] if next_stack_str is not None else None
+        print(f"{opcode} context={context_address} slot={storage_slot} gas={gas} refund={refund}, ret={ret}")
+
+
+def access_push_data(code_chunks, chunk, last_chunk, code_chunk_event):
+    """
+    access the chunks after `chunk`, up to `last_chunk`, holding the data of an executed PUSH
+    :param code_chunk_event: function(chunk) called on the first access of a chunk
+    """
+    for data_chunk in range(chunk + 1, last_chunk + 1):
+        if data_chunk not in code_chunks:
+            code_chunk_event(data_chunk)
+        code_chunks.add(data_chunk)
+
+
+def parse_trace_results(case, lines, access_events=None, dumpall=False, debug=False, extra_debug=False,
+                        chunk_tables=None, frame=None):
+    """
+    parse a `cast run -t --quick` trace.
+    :param case: test case (only 'txHash' is used, for logging)
+    :param lines: iterable of trace lines. consumed lazily, so a stream_cast() generator is parsed while cast runs
+    :param access_events: AccessEventTracker to feed (reset first)
+    :param dumpall: also count the accesses of each code chunk
+    :param debug: print each call and storage access
+    :param extra_debug: also print each step
+    :param chunk_tables: function(address) returning the ChunkTable of the code of a contract (None if unknown),
+        to also access the chunks of the PUSH data of each executed instruction
+    :param frame: (code address, context address, init code hex or None) of the depth 1 frame, when the lines are
+        a segment of a trace starting with a call made from depth 1 (see trace_segments.py)
+    """
+    if frame is None:
+        print(f"Evaluating transaction {case['txHash']}")
+    if access_events is None:
+        access_events = AccessEventTracker()
+    access_events.reset()
+    address_of = access_events.addresses
+
+    # call frames: (code address id, context address id, code ChunkBitmap, ChunkTable.last_chunk of the code or None).
+    # addresses are interned once, at SM CALL time: steps only deal with ints
+    frames = []
+    code_id = context_id = code_chunks = last_chunks = None
+    # the frame of the latest SM CALL, pushed at its first step
+    sm_code_id = sm_context_id = sm_last_chunks = sm_scheme = None
+    # {code address id: ChunkTable.last_chunk} of the contracts called in the transaction
+    last_chunks_by_id = {}
+    # the table of the init code of the latest CREATE CALL, run by the SM CALL right after it (at the same step)
+    init_table = None
+    init_step = None
+    # the caller of the latest CREATE CALL of a CREATE: the created address is that of the SM CALL right after it
+    pending_create = None
+    last_depth = None
+    # keyed by address id, until the results are returned
+    chunks = {}
+    slots = {}
+    touched = {}
+    count_call_with_value = {}
+    created_contracts = {}
+    gas_used = None
+    step_number = 0
+
+    # the gas and refund used by an opcode are only known at the next step:
+    # storage access of the previous step, still waiting for its gas and refund
+    pending_access = None
+
+    if frame is not None:
+        (frame_code_address, frame_context_address, frame_init_code) = frame
+        code_id = access_events.intern(frame_code_address)
+        context_id = access_events.intern(frame_context_address)
+        code_chunks = chunks[code_id] = ChunkBitmap(count_hits=dumpall)
+        if chunk_tables is not None:
+            table = (ChunkTable.from_code(bytes.fromhex(frame_init_code)) if frame_init_code is not None
+                     else chunk_tables(frame_code_address))
+            last_chunks = table.last_chunk if table is not None else None
+        frames.append((code_id, context_id, code_chunks, last_chunks))
+        access_events.enter_frame(code_id, context_id, None, 1)
+        last_depth = "1"
+
+    def add_created_contract(caller, created_address):
+        if caller not in created_contracts:
+            created_contracts[caller] = []
+        created_contracts[caller].append(created_address)
+        access_events.create(access_events.intern(created_address))
+
+    def complete_storage_access(gas, refund):
+        (accesses, index, _, _, access_context_id) = pending_access[:5]
+        accesses.set_gas(index, gas, refund)
+        access_events.storage(access_context_id, accesses.slots[accesses.slot[index]],
+                              accesses.opcode[index] == SSTORE, gas, refund)
+
+    for (kind, step) in tokenize(lines):
+        if kind == STEP:
+            step_number += 1
+            # a CREATE which failed before running its init code
+            pending_create = None
+
+            if pending_access is not None:
+                # gas, refund by the previous opcode
+                (access_gas, access_refund) = pending_access[2:4]
+                complete_storage_access(access_gas - int(step.group(GAS_GROUP)),
+                                        int(step.group(REFUND_GROUP)) - access_refund)
+                if debug: report_storage_access(pending_access, step.group(STACK_GROUP))
+                pending_access = None
+
+            # depths below 10 are single characters, which are never allocated
+            depth = step.group(DEPTH_GROUP)
+            if depth != last_depth:
+                if last_depth is None or int(depth) == int(last_depth) + 1:
+                    if sm_code_id not in chunks:
+                        # with -a, also count the accesses of each chunk
+                        chunks[sm_code_id] = ChunkBitmap(count_hits=dumpall)
+                    frames.append((sm_code_id, sm_context_id, chunks[sm_code_id], sm_last_chunks))
+                    access_events.enter_frame(sm_code_id, sm_context_id, sm_scheme, step_number)
+                elif int(depth) == int(last_depth) - 1:
+                    frames.pop()
+                    access_events.exit_frame(step_number)
+                (code_id, context_id, code_chunks, last_chunks) = frames[-1]
+                last_depth = depth
+
+            pc = int(step.group(PC_GROUP))
+            chunk = pc // 31
+            if dumpall:
+                if chunk not in code_chunks:
+                    access_events.code_chunk(code_id, chunk)
+                code_chunks.add(chunk)
+            else:
+                # inlined ChunkBitmap.add(): set the bit in place, only grow the bitmap when needed
+                byte = chunk >> 3
+                bit = 1 << (chunk & 7)
+                try:
+                    bits = code_chunks.bits[byte]
+                    if not bits & bit:
+                        code_chunks.bits[byte] = bits | bit
+                        access_events.code_chunk(code_id, chunk)
+                except IndexError:
+                    code_chunks.add(chunk)
+                    access_events.code_chunk(code_id, chunk)
+            if last_chunks is not None and pc < len(last_chunks) and last_chunks[pc] != chunk:
+                access_push_data(code_chunks, chunk, last_chunks[pc], partial(access_events.code_chunk, code_id))
+            if extra_debug:
+                (_, pc, step_gas, opcode, _, stack_str) = step_fields(step)
+                print(f"{depth} {address_of[code_id]}, {chunk}, {pc}, {opcode}, {step_gas}, {split_stack(stack_str, 2)}")
+
+            # only the opcodes starting with these letters are of interest: the name of the others is never extracted
+            if step.string[step.start(OPCODE_GROUP)] not in "SEB":
+                continue
+            opcode = step.group(OPCODE_GROUP)
+            if opcode in ADDRESS_TOUCHING_OPCODES:
+                (touched_address,) = split_stack(step.group(STACK_GROUP), 1)
+                # add address to the list of touched addresses
+                # (note: in normal case, these opcodes are used in conjuction of "call" opcodes, but
+                # a code may call (say) EXTCODESIZE without making a call
+                touched_id = access_events.intern(f"0x{touched_address[26:]}".lower())
+                if touched_id not in touched:
+                    touched[touched_id] = set()
+                touched[touched_id].add(opcode)
+                access_events.touch(touched_id, opcode)
+            elif opcode == "SSTORE" or opcode == "SLOAD":
+                if opcode == "SSTORE":
+                    (val, storage_slot) = split_stack(step.group(STACK_GROUP), 2)
+                    storage_opcode = SSTORE
+                else:
+                    (storage_slot,) = split_stack(step.group(STACK_GROUP), 1)
+                    val = None
+                    storage_opcode = SLOAD
+                if context_id not in slots:
+                    slots[context_id] = StorageAccesses()
+                accesses = slots[context_id]
+                index = accesses.append(storage_slot, storage_opcode, step_number)
+                pending_access = (accesses, index, int(step.group(GAS_GROUP)), int(step.group(REFUND_GROUP)),
+                                  context_id, address_of[context_id], storage_slot, val)
+            continue
+
+        # cannot check *CALL: next opcode is in different context
+        if pending_access is not None:
+            complete_storage_access(0, 0)
+            if debug: report_storage_access(pending_access, None)
+            pending_access = None
+
+        if kind == SM_CALL:
+            # SM CALL:   0x7fc..,context:CallContext { address: 0x7fc, caller: 0x5ff, code_address: 0x7fc, apparent_value: 0x0_U256, scheme: Call }, is_static:false, transfer:Transfer { source: 0x5ff137d4b0fdcd49dca30c7cf57e578a026d2789, target:
+            # 0x7fc98430eaedbb6070b35b39d798725049088348, value: 0x0_U256 }, input_size:388
+            (sm_context_address, sm_code_address, scheme, sm_value) = step
+            if debug: print(f"Call {scheme} code-address: {sm_code_address}")
+            if pending_create is not None:
+                # the constructor of a CREATE: runs at the created address
+                add_created_contract(pending_create, sm_context_address.lower())
+                pending_create = None
+            sm_context_id = access_events.intern(sm_context_address.lower())
+            sm_code_id = access_events.intern(sm_code_address.lower())
+            sm_scheme = scheme
+            value_transfer = int(sm_value, 16) != 0
+            if value_transfer:
+                if sm_context_id not in count_call_with_value:
+                    count_call_with_value[sm_context_id] = 0
+                count_call_with_value[sm_context_id] += 1
+            # the caller is unknown for the transaction's own call (the sender)
+            access_events.call(context_id, sm_code_id, sm_context_id, value_transfer)
+            if chunk_tables is not None:
+                if init_table is not None and init_step == step_number:
+                    # a constructor: runs the init code
+                    sm_last_chunks = init_table.last_chunk
+                else:
+                    if sm_code_id not in last_chunks_by_id:
+                        table = chunk_tables(address_of[sm_code_id])
+                        last_chunks_by_id[sm_code_id] = table.last_chunk if table is not None else None
+                    sm_last_chunks = last_chunks_by_id[sm_code_id]
+                init_table = None
+
+        elif kind == CREATE_CALL:
+            (caller, salt, initcode) = step
+            caller = caller.lower()
+            if salt is None:
+                # a CREATE: its address depends on the nonce of the caller, known from the SM CALL which follows
+                pending_create = caller
+            else:
+                add_created_contract(caller, create2_address(caller, salt, initcode))
+            if chunk_tables is not None:
+                init_table = ChunkTable.from_code(bytes.fromhex(initcode))
+                init_step = step_number
+
+        elif kind == GAS_USED:
+            gas_used = step
+
+    if pending_access is not None:
+        complete_storage_access(0, 0)
+
+    return dict(
+        gas_used=gas_used,
+        steps=step_number,
+        chunks={address_of[address_id]: code_chunks for (address_id, code_chunks) in chunks.items()},
+        slots={address_of[address_id]: accesses for (address_id, accesses) in slots.items()},
+        touched={address_of[address_id]: opcodes for (address_id, opcodes) in touched.items()},
+        count_call_with_value={address_of[address_id]: count for (address_id, count) in count_call_with_value.items()},
+        created_contracts=created_contracts,
+        storage_counts=access_events.storage_counts(),
+    )
@@ -0,0 +1,176 @@
+"""
+Parallel parsing of a single large `cast run -t --quick` trace file.
+
+The file is memory-mapped and split into segments before the calls made from depth 1 (an `SM CALL:` or
+`CREATE CALL:` line right after a depth 1 step): a segment then starts with the call stack holding only the
+transaction's own frame, which is known from the head of the trace. Each segment is parsed by a worker process,
+with its access events recorded (see eip4762.AccessEventLog) rather than charged.
+The results are merged in the order of the segments, and the events replayed in order into the AccessEventTracker:
+the merged trace data is the same as the one of the sequential parser.
+"""
+import contextlib
+import io
+import mmap
+import multiprocessing
+import os
+
+from chunk_bitmap import merge_chunks
+from eip4762 import AccessEventLog, replay_events
+from storage_accesses import StorageAccesses
+from trace_parser import parse_trace_results
+from trace_tokenizer import SM_CALL, CREATE_CALL, tokenize
+
+# smaller segments don't pay for their process
+MIN_SEGMENT_BYTES = 16 << 20
+# segments per worker: segments take uneven times to parse
+SEGMENTS_PER_JOB = 4
+READ_BLOCK_SIZE = 1 << 22
+
+
+def is_splittable(path):
+    """
+    :return: whether a trace file can be parsed in segments: an uncompressed `cast run` trace (not structLogs),
+        of at least 2 segments
+    """
+    if path.endswith((".gz", ".zst")) or not os.path.isfile(path) or os.path.getsize(path) < 2 * MIN_SEGMENT_BYTES:
+        return False
+    with open(path, "rb") as f:
+        return not f.read(4096).lstrip().startswith(b"{")
+
+
+def _next_boundary(data, pos):
+    """
+    :return: the offset of the first call line made from depth 1 at or after pos, None if there is none
+    """
+    while True:
+        found = data.find(b" CALL:", pos)
+        if found < 0:
+            return None
+        line_start = data.rfind(b"\n", 0, found) + 1
+        if data[line_start:found] in (b"SM", b"CREATE") and line_start > 0:
+            previous_start = data.rfind(b"\n", 0, line_start - 1) + 1
+            if data[previous_start:previous_start + 8] == b"depth:1,":
+                return line_start
+        pos = found + 1
+
+
+def top_frame(data):
+    """
+    :return: the frame of depth 1: (code address, context address, init code hex or None), from the calls
+        before the first step of the trace
+    """
+    head_end = data.find(b"\ndepth:")
+    frame = None
+    init_code = None
+    for (kind, fields) in tokenize(bytes(data[:max(head_end, 0)]).decode().split("\n")):
+        if kind == CREATE_CALL:
+            init_code = fields[2]
+        elif kind == SM_CALL:
+            (context_address, code_address) = fields[:2]
+            frame = (code_address.lower(), context_address.lower(), init_code)
+            init_code = None
+    return frame
+
+
+def split_trace(data, count):
+    """
+    :param data: the trace (bytes, or an mmap)
+    :return: the (start, end) offsets of up to `count` segments of the trace, split before calls made from depth 1
+    """
+    starts = [0]
+    for index in range(1, count):
+        boundary = _next_boundary(data, max(len(data) * index // count, starts[-1] + 1))
+        if boundary is None:
+            break
+        if boundary > starts[-1]:
+            starts.append(boundary)
+    return list(zip(starts, starts[1:] + [len(data)]))
+
+
+def segment_lines(data, start, end):
+    """
+    :return: the lines of a segment of the trace, as a generator
+    """
+    pos = start
+    while pos < end:
+        stop = min(pos + READ_BLOCK_SIZE, end)
+        if stop < end:
+            # whole lines only
+            newline = data.rfind(b"\n", pos, stop)
+            if newline < 0:
+                # a line longer than a block
+                newline = data.find(b"\n", stop, end)
+            stop = newline + 1 if newline >= 0 else end
+        lines = data[pos:stop].decode().split("\n")
+        if lines[-1] == "":
+            lines.pop()
+        yield from lines
+        pos = stop
+
+
+# the trace being parsed, for the workers (inherited when they are forked)
+_segment_job = None
+
+
+def _parse_segment(segment):
+    """
+    parse a segment of the trace of _segment_job, in a worker process
+    :return: its parse results, the addresses and events of its AccessEventLog, and its console output
+    """
+    (case, path, frame, dumpall, chunk_tables) = _segment_job
+    (start, end) = segment
+    access_events = AccessEventLog()
+    output = io.StringIO()
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data, \
+            contextlib.redirect_stdout(output):
+        trace_results = parse_trace_results(case, segment_lines(data, start, end), access_events, dumpall=dumpall,
+                                            chunk_tables=chunk_tables, frame=frame if start > 0 else None)
+    return trace_results, access_events.addresses, access_events.events, output.getvalue()
+
+
+def merge_segment_results(merged, trace_results, steps_before):
+    """
+    merge the parse results of a segment into those of the segments before it, in place
+    :param steps_before: the number of steps of the segments before, to number the storage accesses
+    """
+    merge_chunks(merged['chunks'], trace_results['chunks'])
+    for (address, accesses) in trace_results['slots'].items():
+        if address not in merged['slots']:
+            merged['slots'][address] = StorageAccesses()
+        merged['slots'][address].extend(accesses, steps_before)
+    for (address, opcodes) in trace_results['touched'].items():
+        merged['touched'].setdefault(address, set()).update(opcodes)
+    for (address, count) in trace_results['count_call_with_value'].items():
+        merged['count_call_with_value'][address] = merged['count_call_with_value'].get(address, 0) + count
+    for (caller, created) in trace_results['created_contracts'].items():
+        merged['created_contracts'].setdefault(caller, []).extend(created)
+    if trace_results['gas_used'] is not None:
+        merged['gas_used'] = trace_results['gas_used']
+    merged['steps'] += trace_results['steps']
+
+
+def parse_trace_file_parallel(case, path, jobs, access_events, dumpall=False, chunk_tables=None):
+    """
+    parse a trace file in segments, in `jobs` worker processes (see parse_trace_results() for the parameters)
+    :return: the parsed trace, as parse_trace_results() returns it
+    """
+    global _segment_job
+    access_events.reset()
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        frame = top_frame(data)
+        count = min(jobs * SEGMENTS_PER_JOB, len(data) // MIN_SEGMENT_BYTES)
+        segments = split_trace(data, count) if frame is not None else [(0, len(data))]
+    _segment_job = (case, path, frame, dumpall, chunk_tables)
+    merged = dict(gas_used=None, steps=0, chunks={}, slots={}, touched={}, count_call_with_value={},
+                  created_contracts={})
+    try:
+        with multiprocessing.get_context("fork").Pool(min(jobs, len(segments))) as pool:
+            # merged as they come, in order, while the later segments are parsed
+            for (trace_results, addresses, events, output) in pool.imap(_parse_segment, segments):
+                print(output, end="")
+                replay_events(access_events, addresses, events)
+                merge_segment_results(merged, trace_results, merged['steps'])
+    finally:
+        _segment_job = None
+    merged['storage_counts'] = access_events.storage_counts()
+    return merged
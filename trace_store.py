@@ -0,0 +1,227 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+import queue
+import re
+import tempfile
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from trace_data_file import TRACE_DATA_VERSION, read_trace_data, write_trace_data
+
+CAPTURE_BATCH_LINES = 4096
+
+
+def _safe_name(name):
+    return re.sub(r"[^\w.-]", "_", name)
+
+
+def _open_compressed(path, mode):
+    """
+    open a compressed trace file in text mode ("rt" or "wt"). the codec is chosen by the file suffix.
+    """
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise Exception(f"{path} is zstd-compressed, but the 'zstandard' module is not installed")
+        raw = open(path, mode.replace("t", "b"))
+        if "r" in mode:
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        else:
+            stream = zstandard.ZstdCompressor(level=3).stream_writer(raw, closefd=True)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    if path.endswith(".gz"):
+        # fast compression: traces are large, and captured while being parsed
+        return gzip.open(path, mode, compresslevel=3, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def open_trace_file(path):
+    """
+    :return: a text stream over a (possibly .gz or .zst compressed) trace file
+    """
+    return _open_compressed(path, "rt")
+
+
+class TraceStore:
+    """
+    A local store of captured `cast run -t --quick` outputs.
+    Traces are stored compressed and content-addressed, under objects/{hash[:2]}/{hash}.{zst|gz}
+    (hash is the sha256 of the uncompressed trace).
+    refs/{cast version}/{tx}.json maps a transaction to its trace object, along with metadata
+    (chain id and block) needed to replay it without an RPC node.
+    blocks/{block}.json lists the transactions of a block, to replay a whole block.
+    parsed/v{version}/{hash[:2]}/{hash}[.{variant}].vtd is the parsed trace data of a trace object
+    (see trace_data_file.py), to re-estimate it without parsing. The variant names the parser sources
+    and parsing options that change the parsed data (e.g. chunk tables).
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.suffix = ".zst" if zstandard is not None else ".gz"
+
+    def _ref_path(self, tx, cast_version):
+        return os.path.join(self.root, "refs", _safe_name(cast_version or "unknown"), _safe_name(tx) + ".json")
+
+    def _object_path(self, digest, suffix):
+        return os.path.join(self.root, "objects", digest[:2], digest + suffix)
+
+    def find(self, tx, cast_version=None):
+        """
+        :return: the ref of a stored trace, preferring the given cast version, otherwise the most recent capture.
+            None if the transaction was never captured.
+        """
+        if cast_version is not None and os.path.exists(self._ref_path(tx, cast_version)):
+            ref_path = self._ref_path(tx, cast_version)
+        else:
+            refs_dir = os.path.join(self.root, "refs")
+            candidates = [os.path.join(refs_dir, version, _safe_name(tx) + ".json")
+                          for version in (os.listdir(refs_dir) if os.path.isdir(refs_dir) else [])]
+            candidates = [path for path in candidates if os.path.exists(path)]
+            if len(candidates) == 0:
+                return None
+            ref_path = max(candidates, key=os.path.getmtime)
+        with open(ref_path) as f:
+            return json.load(f)
+
+    def read(self, tx, cast_version=None):
+        """
+        :return: the ref of the stored trace, and a generator of its lines
+        """
+        ref = self.find(tx, cast_version)
+        if ref is None:
+            raise Exception(f"No stored trace for {tx} in {self.root}")
+        return ref, self._read_lines(self._object_path(ref['object'], ref['suffix']))
+
+    def _parsed_path(self, digest, variant=None):
+        name = digest + (f".{variant}" if variant else "") + ".vtd"
+        return os.path.join(self.root, "parsed", f"v{TRACE_DATA_VERSION}", digest[:2], name)
+
+    def store_parsed(self, tx, cast_version, trace_data, variant=None):
+        """
+        keep the parsed trace data of a stored trace (with its code sizes)
+        :return: False if the trace of the transaction is not stored
+        """
+        ref = self.find(tx, cast_version)
+        if ref is None:
+            return False
+        path = self._parsed_path(ref['object'], variant)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_trace_data(path, trace_data)
+        return True
+
+    def has_parsed(self, tx, cast_version=None, variant=None):
+        """
+        :return: whether the parsed trace data of a transaction is stored
+        """
+        ref = self.find(tx, cast_version)
+        return ref is not None and os.path.exists(self._parsed_path(ref['object'], variant))
+
+    def read_parsed(self, tx, cast_version=None, variant=None):
+        """
+        :return: the ref of the stored trace, and its parsed trace data (memory-mapped)
+        """
+        ref = self.find(tx, cast_version)
+        if ref is None:
+            raise Exception(f"No stored trace for {tx} in {self.root}")
+        path = self._parsed_path(ref['object'], variant)
+        if not os.path.exists(path):
+            raise Exception(f"No parsed trace data for {tx} in {self.root}: evaluate it once without -reestimate")
+        return ref, read_trace_data(path)
+
+    def _block_path(self, block):
+        return os.path.join(self.root, "blocks", _safe_name(str(block)) + ".json")
+
+    def store_block(self, block, transactions, metadata=None):
+        """
+        keep the list of transactions of a block
+        """
+        path = self._block_path(block)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(dict(metadata or {}, block=block, transactions=transactions), f)
+        os.replace(tmp_path, path)
+
+    def read_block(self, block):
+        """
+        :return: the stored block, with its list of 'transactions'
+        """
+        path = self._block_path(block)
+        if not os.path.exists(path):
+            raise Exception(f"No stored block {block} in {self.root}")
+        with open(path) as f:
+            return json.load(f)
+
+    @staticmethod
+    def _read_lines(path):
+        with open_trace_file(path) as f:
+            yield from f
+
+    def capture(self, tx, cast_version, lines, metadata=None):
+        """
+        store the trace of a transaction while it is being read.
+        Compression runs in a background thread, in batches of lines, so it overlaps with the parsing.
+        :param lines: trace lines (e.g. a stream_cast() generator)
+        :param metadata: extra fields to keep in the ref (e.g. chain_id, block)
+        :return: a generator yielding the same lines. The trace is stored only once all lines were consumed.
+        """
+        objects_dir = os.path.join(self.root, "objects")
+        os.makedirs(objects_dir, exist_ok=True)
+        (fd, tmp_path) = tempfile.mkstemp(dir=objects_dir, suffix=".tmp" + self.suffix)
+        os.close(fd)
+        digest = hashlib.sha256()
+        # bounded, so that a slow disk throttles the parser rather than buffering the trace in memory
+        batches = queue.Queue(maxsize=16)
+        errors = []
+        writer = threading.Thread(target=self._write_batches, args=(tmp_path, batches, digest, errors), daemon=True)
+        writer.start()
+        completed = False
+        try:
+            batch = []
+            for line in lines:
+                batch.append(line)
+                if len(batch) == CAPTURE_BATCH_LINES:
+                    batches.put("".join(batch))
+                    batch = []
+                yield line
+            batches.put("".join(batch))
+            completed = True
+        finally:
+            batches.put(None)
+            writer.join()
+            if not completed or errors:
+                os.remove(tmp_path)
+        if errors:
+            raise errors[0]
+
+        digest = digest.hexdigest()
+        object_path = self._object_path(digest, self.suffix)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        os.replace(tmp_path, object_path)
+
+        ref = dict(metadata or {}, tx=tx, cast_version=cast_version, object=digest, suffix=self.suffix)
+        ref_path = self._ref_path(tx, cast_version)
+        os.makedirs(os.path.dirname(ref_path), exist_ok=True)
+        tmp_ref_path = f"{ref_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_ref_path, "w") as f:
+            json.dump(ref, f)
+        os.replace(tmp_ref_path, ref_path)
+
+    @staticmethod
+    def _write_batches(path, batches, digest, errors):
+        try:
+            with _open_compressed(path, "wt") as out:
+                while (batch := batches.get()) is not None:
+                    digest.update(batch.encode())
+                    out.write(batch)
+        except Exception as e:
+            errors.append(e)
+            # keep draining, so the parser is never blocked on a full queue
+            while batches.get() is not None:
+                pass
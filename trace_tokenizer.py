@@ -0,0 +1,102 @@
+"""
+Single-pass tokenizer for `cast run -t --quick` traces.
+
+Each line is matched at most once, by a compiled pattern selected by a cheap prefix check.
+The per-opcode gas and refund are NOT parsed from the following line: the parser derives them
+from the state of the previous step token.
+Step tokens are the match objects themselves: the parser only extracts (and converts) the groups it needs.
+"""
+import re
+
+STEP = 0
+SM_CALL = 1
+CREATE_CALL = 2
+TRACES = 3
+GAS_USED = 4
+OTHER = 5
+
+# depth:1, PC:0, gas:0x10c631(1099313), OPCODE: "PUSH1"(96)  refund:0x0(0) Stack:[], Data size:0, Data: 0x
+STEP_PATTERN = re.compile(
+    r'depth:(\d+), PC:(\d+), gas:\w+\((\d+)\), OPCODE: "(\w+)"\(\d+\)\s+refund:\w+\((\d+)\)\s+Stack:\[([^\]]*)\]')
+# SM CALL:   0x7fc..,context:CallContext { address: 0x7fc, caller: 0x5ff, code_address: 0x7fc, apparent_value: 0x0_U256, scheme: Call }, ...
+SM_CALL_PATTERN = re.compile(
+    r"address: (\w+).*code_address: (\w+).*scheme: (\w+).* value: (\w+)_U256")
+# CREATE CALL: caller:0x5de4839a76cf55d0c90e2061ef4386d962E15ae3, scheme:Create2 { salt: 0x0000000000000000000000000000000000000000114ea8212b2f9f4cb29398d9_U256
+# (a CREATE has no salt: scheme:Create)
+CREATE_CALL_PATTERN = re.compile(
+    r"caller:(\w+)(?:.*salt: (\w+)_U256)?.* init_code:\"(\w*)\"")
+GAS_USED_PATTERN = re.compile(r"Gas used: (\d+)")
+# groups of a STEP_PATTERN match
+(DEPTH_GROUP, PC_GROUP, GAS_GROUP, OPCODE_GROUP, REFUND_GROUP, STACK_GROUP) = range(1, 7)
+
+
+step_match = STEP_PATTERN.match
+step_search = STEP_PATTERN.search
+
+
+def tokenize_step(line):
+    """
+    :return: the STEP_PATTERN match of a step line. Groups are only extracted on demand (see step_fields)
+    """
+    return STEP_PATTERN.match(line) if line.startswith("depth:") else STEP_PATTERN.search(line)
+
+
+def step_fields(step):
+    """
+    :return: (depth, pc, gas, opcode, refund, stack_str) of a step token.
+        stack_str is left unsplit: most opcodes never look at the stack.
+    """
+    (depth, pc, gas, opcode, refund, stack_str) = step.groups()
+    return int(depth), int(pc), int(gas), opcode, int(refund), stack_str
+
+
+def split_stack(stack_str, count):
+    """
+    :return: the top `count` stack items (top of the stack is last), with their "_U256" suffix removed
+    """
+    return [item.replace("_U256", "") for item in stack_str.rsplit(", ", count)[-count:]]
+
+
+def malformed_line(line_number, line):
+    return Exception(f"Malformed trace line {line_number}: {line.strip()[:200]}")
+
+
+def tokenize(lines):
+    """
+    yield a (kind, fields) token for each line of a trace.
+    Once the "Traces:" section starts, only GAS_USED tokens are yielded.
+    A step, SM CALL or CREATE CALL line that can't be parsed raises an Exception, with its line number
+    """
+    in_traces = False
+    for (line_number, line) in enumerate(lines, 1):
+        if in_traces:
+            if "Gas used:" in line:
+                yield GAS_USED, int(GAS_USED_PATTERN.search(line).group(1))
+            continue
+        # fast path: the vast majority of the lines are opcode steps
+        if line.startswith("depth:"):
+            step = step_match(line)
+            if step is None:
+                raise malformed_line(line_number, line)
+            yield STEP, step
+        elif "Traces:" in line:
+            in_traces = True
+            yield TRACES, None
+        elif "CREATE CALL:" in line:
+            match = CREATE_CALL_PATTERN.search(line)
+            if match is None:
+                raise malformed_line(line_number, line)
+            yield CREATE_CALL, match.groups()
+        elif "SM CALL" in line:
+            match = SM_CALL_PATTERN.search(line)
+            if match is None:
+                raise malformed_line(line_number, line)
+            yield SM_CALL, match.groups()
+        elif "depth:" in line:
+            step = step_search(line)
+            # otherwise, e.g. a console.log mentioning "depth:"
+            yield (STEP, step) if step is not None else (OTHER, None)
+        elif "Gas used:" in line:
+            yield GAS_USED, int(GAS_USED_PATTERN.search(line).group(1))
+        else:
+            yield OTHER, None
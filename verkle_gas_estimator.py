@@ -1,33 +1,114 @@
 #!/usr/bin/env python3
+"""
+Estimate the gas used by transactions after verkle tree integration (EIP-4762). See usage() for the command line.
+
+The pipeline is also a library: trace source (case_trace) -> parsed trace data (load_test_case)
+-> estimation (estimate_test_case). E.g.
+
+    import verkle_gas_estimator as estimator
+    from print_results import results_as_dict
+    estimator.configure(cache_dir="cache", rpc_url="http://localhost:8545")
+    (gas_used, trace_data, results) = estimator.estimate_test_case(dict(txHash="0x..", name="0x.."))
+    print(json.dumps(results_as_dict(gas_used, results)))
+
+A case is a transaction ('txHash'), or a trace file ('traceFile', with 'to' for structLogs).
+Importing has no side effect beyond opening (lazily) the caches in the default cache dir.
+The estimation functions are safe to call from concurrent threads (see estimator_daemon.py).
+"""
+import contextlib
 import csv
+import hashlib
+import io
 import json
+import multiprocessing
 import os
 import re
+import socket
 import subprocess
 import sys
+import threading
+import time
+from itertools import chain
+from functools import lru_cache, partial
 
-from estimation import estimate_verkle_gas_cost_difference
-from print_results import print_results
+import profiling
+
+from block_witness import BlockWitness
+from call_tree import CallTreeTracker, CallTreeWriter, call_tree_results
+from code_size_cache import CodeSizeCache
+from contract_stats import ContractStats, contract_metrics
+from eip4762 import AccessEventTracker
+from estimation import (ESTIMATOR_VERSION, SCHEDULE_PARAMETERS, estimate_verkle_gas_cost_difference,
+                        schedule_counts, sweep_gas_cost_differences)
+from job_queue import DEFAULT_LEASE_SECONDS, FAILED, LEASED, JobQueue
+from journal import Journal
+from print_results import print_results, print_block_results
+from rpc_client import RpcClient
+from sampling import CONFIDENCE, MIN_STRATUM_SAMPLE, STATISTICS, StratifiedSample
+from struct_log_parser import CHUNK_SIZE, is_struct_log, parse_struct_logs
+from trace_parser import parse_trace_results
+from trace_segments import is_splittable, parse_trace_file_parallel
+from trace_store import TraceStore, open_trace_file
 
 
 # Function to run cast command and return output
 def run_cast(command):
+    profiling.count(f"subprocess cast {command.split()[0]}")
     cmd = f"{cast_executable} {command}"
     return subprocess.check_output(cmd, shell=True, text=True).strip()
 
 
+# Function to run cast command and yield its output line by line, while it is still running
+def stream_cast(command):
+    profiling.count(f"subprocess cast {command.split()[0]}")
+    cmd = f"{cast_executable} {command}"
+    process = subprocess.Popen(cmd, shell=True, text=True, stdout=subprocess.PIPE)
+    completed = False
+    try:
+        for line in process.stdout:
+            yield line
+        completed = True
+    finally:
+        if not completed:
+            # consumer stopped reading early: don't wait for a (possibly huge) trace to finish
+            process.kill()
+        process.stdout.close()
+        returncode = process.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd)
+
+
+# options, set by main() from the command line, or by configure()
 names = {}
-test_cases = []
+to_address = None
+stats_path = None
+# JSON-RPC client for the state lookups. None to use cast
+rpc = None
 
 dumpall = False
+verbose = False
+use_chunk_tables = False
+# attribute the costs to the call frames of each transaction (see call_tree.py)
+call_trees = False
+call_tree_path = None
+jobs = 1
+offline = False
+reestimate = False
+store_traces = True
+profile_path = None
+parse_profiler = None
 debug = os.environ.get("DEBUG") is not None
 extraDebug = False
 __dir__ = os.path.dirname(os.path.realpath(__file__))
 # make sure to use "cast" from an empty folder. it runs VERY slow if there are sub-folders...
 cast_executable = __dir__ + "/fastcast"
 cast_executable = "cd /tmp; cast"
-# call_opcodes=["CALL", "CALLCODE", "DELEGATECALL", "STATICCALL"]
-ADDRESS_TOUCHING_OPCODES = ["EXTCODESIZE", "EXTCODECOPY", "EXTCODEHASH", "BALANCE", "SELFDESTRUCT"]
+cache_dir = os.environ.get("VERKLE_CACHE_DIR", os.path.expanduser("~/.cache/verkle-gas-estimator"))
+# parsing options changing the results: their parsed data and journal are kept apart
+results_variant = None
+# the options configure() accepts
+CONFIG_OPTIONS = ('names', 'to_address', 'dumpall', 'use_chunk_tables', 'call_trees', 'offline', 'reestimate',
+                  'store_traces', 'debug', 'cast_executable', 'cache_dir')
 
 
 def usage():
@@ -36,240 +117,990 @@ def usage():
     print("Options:")
     print("  -a dump all chunks, not only count/max")
     print("  -c {cast-path} use specified 'cast' implementation ")
+    print("  -rpc {url} JSON-RPC node for the state lookups (batched code sizes, blocks), instead of a cast process each.")
+    print("         also passed to 'cast run' as --rpc-url")
+    print("  -cache {dir} directory of the persistent code size cache (default: $VERKLE_CACHE_DIR or ~/.cache/verkle-gas-estimator)")
     print("  -contracts match contract addresses with names in given JSON file")
     print("  -multiple iterate over transactions in a JSON results file and calculate results for each entry")
+    print("         evaluated transactions are journaled: an interrupted run, restarted, skips them")
+    print("  -journal {file} journal of -multiple (default: verkle-effects-estimate.journal). Delete it to start over.")
+    print("         Transactions journaled with other estimator sources, or other -chunk-tables, are evaluated again")
+    print("  -queue {file} with -multiple, add its transactions to a shared job queue (SQLite file), then evaluate them")
+    print("         as one of its workers. Without -multiple, join the workers of an existing queue. Any number of")
+    print("         workers (processes, or hosts sharing the file) drain it; each writes the CSV once all are evaluated")
+    print("         (not with -sweep, -sample or -precision)")
+    print(f"  -lease {{seconds}} with -queue, time after which the cases of a dead worker are claimed again "
+          f"(default: {DEFAULT_LEASE_SECONDS})")
+    print("  -block {N} evaluate all transactions of block N, and the block-level witness (distinct branches and leaves)")
+    print("  -j {N} with -multiple or -block, evaluate N transactions in parallel")
+    print("         with a single (uncompressed) trace file, parse segments of it in N processes")
+    print("  -stats {file.json|file.csv} with -multiple or -block, write per-contract statistics across the transactions")
+    print("         (count, sum, min/max, mean, p50/p95/p99 of the cost difference, chunks and code cost),")
+    print("         instead of printing the results of each transaction")
+    print("  -v with -stats, still print the results of each transaction")
+    print("  -sample {N} with -multiple or -block, evaluate a stratified random sample of about N transactions only,")
+    print(f"         and estimate the mean, p50 and p95 of the gas cost difference with {round(CONFIDENCE * 100)}% bootstrap")
+    print("         confidence intervals, of all transactions and of each stratum, into verkle-sample-estimate.csv")
+    print("         (the sampled transactions into verkle-sample-cases.csv). Each stratum gets at least "
+          f"{MIN_STRATUM_SAMPLE} transactions")
+    print("  -precision {gas} with -multiple or -block, sample until the confidence interval of the mean gas cost")
+    print("         difference is within +/- gas (at most -sample transactions, default all)")
+    print("  -strata {name|contract} strata of -sample: the name of the cases (default), or the called contract")
+    print("  -seed {N} seed of the random sample, to draw the same one again")
+    print("  -sweep {schedules.csv} evaluate each gas schedule (rows of 'name' and costs, e.g. WITNESS_BRANCH_COST)")
+    print("         on each transaction, into verkle-schedule-sweep.csv. Costs left out keep their current value")
+    print("  -chunk-tables fetch the bytecode of each contract, to also count the code chunks of the data of the PUSH")
+    print("         opcodes (EIP-4762). Chunk tables are kept by code hash in the cache dir")
+    print("  -calltree {file.json|file.folded} attribute the gas cost difference of each transaction to its call frames")
+    print("         (code chunks, storage, value transfers, creations, touched addresses), in the parsing pass:")
+    print("         the call tree of each transaction as JSON lines, or the verkle witness gas of each call path as")
+    print("         folded stacks (for flamegraph tools), across all transactions. Not with structLogs or -reestimate")
+    print("  -offline replay traces (and code sizes) previously captured in the cache dir, without running cast")
+    print("  -nostore don't capture the traces of 'cast run' (and their parsed data) in the cache dir")
+    print("  -reestimate estimate from the parsed data kept in the cache dir, without cast or parsing (implies -offline)")
+    print("  -profile {file} write the time of each phase (wall, and CPU of the thread running it), and counters,")
+    print("         of each case as JSON lines, and print a rollup")
+    print("  -profile-parse {file} cProfile the parse loop only, into a pstats file (with -j: {file}.{pid} per worker)")
+    print("  -to {address} the contract called by the transaction of a structLogs file (not part of the trace)")
     print("Parameters:")
     print("  tx - tx to read. It (and all following params) are passed directly into `cast run -t --quick`")
     print("  file - if the first param is an existing file, it is read instead.")
-    print("         The file should be the output of `cast run -t --quick {tx} > FILE`")
+    print("         The file should be the output of `cast run -t --quick {tx} > FILE` (optionally .gz/.zst compressed),")
+    print("         or the geth structLogs JSON of `debug_traceTransaction` (with -to). /dev/stdin reads a pipe.")
     sys.exit(1)
 
 
-args = sys.argv[1:]
-if args == []:
-    args = ["-h"]
-
-while len(args) > 0 and re.match("^-", args[0]):
-    opt = args.pop(0)
-    if opt == "-h":
-        usage()
-    elif opt == "-c":
-        cast_executable = args.pop(0)
-    elif opt == "-a":
-        dumpall = True
-    elif opt == "-d":
-        debug = True
-    elif opt == "-dd":
-        debug = True
-        extraDebug = True
-    elif opt == "-contracts":
-        f = open(args.pop(0))
-        file = json.load(f)
-        names = file["contracts"]
-    elif opt == "-multiple":
-        f = open(args.pop(0))
-        multiple_results = json.load(f)
-        test_cases = multiple_results['results']
-        names = multiple_results['contracts']
+def fetch_code_size(address, block):
+    if offline:
+        raise Exception(f"Code size of {address} at block {block} is not cached, and cannot be fetched offline")
+    if rpc is not None:
+        return fetch_code_sizes([address], block)[0]
+    if block is not None:
+        try:
+            return int(run_cast(f"codesize {address} --block {block} 2>/dev/null"))
+        except:
+            # no archive state for that block: fall back to the latest code, as it is usually the same
+            pass
+    try:
+        return int(run_cast(f"codesize {address} 2>/dev/null"))
+    except:
+        return -1
+
+
+def fetch_code_sizes(addresses, block):
+    """
+    :return: the code sizes of the addresses, from a JSON-RPC batch of eth_getCode (-1 if unknown)
+    """
+    if offline:
+        raise Exception(f"Code sizes of {addresses} at block {block} are not cached, and cannot be fetched offline")
+    return [(len(code) - 2) // 2 if code is not None else -1 for code in fetch_codes(addresses, block)]
+
+
+def fetch_codes(addresses, block):
+    """
+    :return: the code of the addresses (hex), from a JSON-RPC batch of eth_getCode (None if unknown)
+    """
+    profiling.count("rpc eth_getCode", len(addresses))
+    codes = [None] * len(addresses)
+    if block is not None:
+        codes = rpc.batch([("eth_getCode", [address, hex(block)]) for address in addresses])
+    # no archive state for that block: fall back to the latest code, as it is usually the same
+    latest = [index for (index, code) in enumerate(codes) if not isinstance(code, str)]
+    if latest:
+        profiling.count("rpc eth_getCode", len(latest))
+        for (index, code) in zip(latest, rpc.batch([("eth_getCode", [addresses[index], "latest"]) for index in latest])):
+            codes[index] = code
+    return [code if isinstance(code, str) else None for code in codes]
+
+
+def fetch_code(address, block):
+    """
+    :return: the bytecode of a contract, None if unknown
+    """
+    if offline:
+        raise Exception(f"Code of {address} at block {block} is not cached, and cannot be fetched offline")
+    if rpc is not None:
+        code = fetch_codes([address], block)[0]
     else:
-        raise Exception("Unknown option " + opt)
+        code = None
+        for block_option in ([f" --block {block}"] if block is not None else []) + [""]:
+            try:
+                code = run_cast(f"code {address}{block_option} 2>/dev/null")
+                break
+            except:
+                # no archive state for that block: fall back to the latest code, as it is usually the same
+                pass
+    return bytes.fromhex(code[2:]) if code is not None else None
 
 
-def parse_trace_results(case, output):
-    print(f"Evaluating transaction {case['txHash']}")
+def fetch_block_transactions(block):
+    """
+    :return: the block number, and the hashes of the transactions of the block
+    """
+    if rpc is not None:
+        profiling.count("rpc eth_getBlockByNumber")
+        block_json = rpc.call("eth_getBlockByNumber", hex(int(block)) if str(block).isdigit() else block, False)
+        if block_json is None:
+            raise Exception(f"Block {block} not found")
+    else:
+        block_json = json.loads(run_cast(f"block {block} --json"))
+    transactions = [tx if isinstance(tx, str) else tx['hash'] for tx in block_json['transactions']]
+    return int(block_json['number'], 0), transactions
 
-    addrs = []
-    lastdepth = 0
-    chunks = {}
-    slots = {}
-    touched = {}
-    code_sizes = {}
-    count_call_with_value = {}
-    created_contracts = {}
 
-    # line = None
-    # lastGas = None
-    # lastRefund = None
+def fetch_transaction_block(tx):
+    try:
+        if rpc is not None:
+            profiling.count("rpc eth_getTransactionByHash")
+            return int(rpc.call("eth_getTransactionByHash", tx)['blockNumber'], 16)
+        return int(run_cast(f"tx {tx} blockNumber 2>/dev/null"))
+    except:
+        return None
 
-    lines = output.splitlines()
-    for lineNumber in range(len(lines)):
-        line = lines[lineNumber]
-        if "Traces:" in line:
-            break
-        if "CREATE CALL:" in line:
-            # CREATE CALL: caller:0x5de4839a76cf55d0c90e2061ef4386d962E15ae3, scheme:Create2 { salt: 0x0000000000000000000000000000000000000000114ea8212b2f9f4cb29398d9_U256
-
-            (caller, salt, initcode) = re.search(
-                r"caller:(\w+).*salt: (\w+)_U256.* init_code:\"(\w+)\"",
-                line).groups()
-
-            res = run_cast(f"keccak `cast concat-hex 0xff {caller} {salt} \\`cast keccak 0x{initcode}\\` `")
-            # res is 32-byte. need to take last 20
-            created_address = "0x" + res[26:]
-            created_address = created_address.lower()
-            caller = caller.lower()
-            if caller not in created_contracts:
-                created_contracts[caller] = []
-            created_contracts[caller].append(created_address)
-            continue
-        if "SM CALL" in line:
-            # SM CALL:   0x7fc..,context:CallContext { address: 0x7fc, caller: 0x5ff, code_address: 0x7fc, apparent_value: 0x0_U256, scheme: Call }, is_static:false, transfer:Transfer { source: 0x5ff137d4b0fdcd49dca30c7cf57e578a026d2789, target:
-            # 0x7fc98430eaedbb6070b35b39d798725049088348, value: 0x0_U256 }, input_size:388
-            (sm_context_address, sm_code_address, scheme, sm_value) = re.search(
-                r"address: (\w+).*code_address: (\w+).*scheme: (\w+).* value: (\w+)_U256",
-                line).groups()
-            if debug: print(f"Call {scheme} code-address: {sm_code_address}")
-            sm_context_address = sm_context_address.lower()
-            if int(sm_value, 16) != 0:
-                if sm_context_address not in count_call_with_value:
-                    count_call_with_value[sm_context_address] = 0
-                count_call_with_value[sm_context_address] += 1
-            continue
 
-        if "depth:" in line:
-
-            # depth:1, PC:0, gas:0x10c631(1099313), OPCODE: "PUSH1"(96)  refund:0x0(0) Stack:[], Data size:0, Data: 0x
-            (depth, pc, lineGas, opcode, lineRefund, stackStr) = re.search(
-                r"depth:(\d+).*PC:(\d+).*gas:\w+\((\w+)\).*OPCODE: \"(\w+)\".*refund:\w+\((\w+)\).*Stack:\[(.*)\]",
-                line).groups()
-
-            gas = None
-            refund = None
-            # cannot check *CALL: next opcode is in different context
-            if "depth:" in lines[lineNumber + 1]:
-                (nextGas, nextRefund, next_stack_str) = re.search(
-                    r"gas:\w+\((\w+)\).*refund:\w+\((\w+)\).*Stack:\[(.*)\]",
-                    lines[lineNumber + 1]).groups()
-
-                # gas, refund by this opcode
-                gas = int(lineGas) - int(nextGas)
-                refund = int(nextRefund) - int(lineRefund)
-
-            stack = stackStr.replace("_U256", "").split(", ")[-2:]
-
-            if opcode in ADDRESS_TOUCHING_OPCODES:
-                touched_address = stack[-1]
-                touched_address = f"0x{touched_address[26:]}"
-                touched[touched_address.lower()] = True
-                # add address to the list of touched addresses
-                # (note: in normal case, these opcodes are used in conjuction of "call" opcodes, but
-                # a code may call (say) EXTCODESIZE without making a call
-
-            if opcode == "SSTORE":
-                (val, storage_slot) = stack
-                context_address = context_address.lower()
-                if context_address not in slots:
-                    slots[context_address] = {}
-                if storage_slot not in slots[context_address]:
-                    slots[context_address][storage_slot] = []
-
-                slots[context_address][storage_slot].append({
-                    'opcode': opcode,
-                    'gas': gas,
-                    'refund': refund
-                })
-                if debug: print(
-                    f"{opcode} context={context_address} slot={storage_slot} gas={gas} refund={refund} val={val}")
-            if opcode == "SLOAD":
-                (storage_slot,) = stack[-1:]
-                context_address = context_address.lower()
-                if context_address not in slots:
-                    slots[context_address] = {}
-                if storage_slot not in slots[context_address]:
-                    slots[context_address][storage_slot] = []
-                slots[context_address][storage_slot].append({
-                    'opcode': opcode,
-                    'gas': gas,
-                    'refund': refund
-                })
-                next_stack = next_stack_str.replace("_U256", "").split(", ")[-2:]
-                if debug: print(
-                    f"{opcode} context={context_address} slot={storage_slot} gas={gas} refund={refund}, ret={next_stack[-1:][0]}")
-            if depth:
-                depth = int(depth)
-                if depth == lastdepth + 1:
-                    addrs.append((sm_code_address, sm_context_address))
-                    (addr, context_address) = addrs[-1]
-                if depth == lastdepth - 1:
-                    addrs.pop()
-                    (addr, context_address) = addrs[-1]
-                pc = int(pc)
-                chunk = pc // 31
-                addr = addr.lower()
-                if addr not in chunks:
-                    chunks[addr] = {}
-                chunks[addr][chunk] = chunks[addr].get(chunk, 0) + 1
-                if extraDebug:
-                    print(f"{depth} {addr}, {chunk}, {pc}, {opcode}, {gas}, {stack}")
-                lastdepth = depth
-
-    for address in chunks:
-        code_sizes[address] = -1
-        try:
-            code_sizes[address] = int(run_cast(f"codesize {address} 2>/dev/null"))
-        except:
-            pass
+@lru_cache(maxsize=None)
+def current_chain_id():
+    try:
+        if rpc is not None:
+            return int(rpc.call("eth_chainId"), 16)
+        return int(run_cast("chain-id 2>/dev/null"))
+    except:
+        return None
+
+
+@lru_cache(maxsize=None)
+def cast_version():
+    try:
+        return run_cast("--version 2>/dev/null")
+    except:
+        return None
+
+
+def open_caches():
+    """
+    (re)create the code size cache and the trace store, in cache_dir. Nothing is opened before the first lookup
+    """
+    global code_size_cache, trace_store
+    code_size_cache = CodeSizeCache(os.path.join(cache_dir, "code-sizes.sqlite"), fetch_code_size,
+                                    fetch_code_sizes=fetch_code_sizes if rpc is not None else None,
+                                    fetch_code=fetch_code)
+    trace_store = TraceStore(os.path.join(cache_dir, "traces"))
+
+
+def configure(rpc_url=None, **options):
+    """
+    set the options of the estimation, as the command line does, for use as a library. The caches are reopened.
+    :param rpc_url: JSON-RPC node for the state lookups (-rpc)
+    :param options: new values of any of CONFIG_OPTIONS
+    """
+    global rpc, offline, results_variant
+    unknown = set(options) - set(CONFIG_OPTIONS)
+    if unknown:
+        raise Exception(f"Unknown options: {', '.join(sorted(unknown))}. Known: {', '.join(CONFIG_OPTIONS)}")
+    globals().update(options)
+    if rpc_url is not None:
+        rpc = RpcClient(rpc_url)
+    if reestimate:
+        offline = True
+    results_variant = "chunk-tables" if use_chunk_tables else None
+    # resolved again, from the new node
+    current_chain_id.cache_clear()
+    cast_version.cache_clear()
+    open_caches()
+
+
+open_caches()
+# the AccessEventTracker of each thread, reused across its transactions (reset() starts each one)
+thread_state = threading.local()
+
+
+def thread_access_events():
+    tracker_class = CallTreeTracker if call_trees else AccessEventTracker
+    if type(getattr(thread_state, 'access_events', None)) is not tracker_class:
+        thread_state.access_events = tracker_class()
+    return thread_state.access_events
 
-    return dict(
-        code_sizes=code_sizes,
-        chunks=chunks,
-        slots=slots,
-        touched=touched,
-        count_call_with_value=count_call_with_value,
-        created_contracts=created_contracts
-    )
+
+def case_trace(case):
+    """
+    :return: the trace lines of a test case, the (chain id, block) to look up its code sizes at,
+        and whether the trace is structLogs JSON (then given as text chunks, rather than lines)
+    """
+    tx = case['txHash']
+    if 'traceFile' in case:
+        chain_id = None if offline else current_chain_id()
+        stream = open_trace_file(case['traceFile'])
+        head = stream.read(CHUNK_SIZE)
+        if is_struct_log(head):
+            return chain([head], iter(partial(stream.read, CHUNK_SIZE), "")), chain_id, None, True
+        # the first line may be cut by the peek
+        return chain(io.StringIO(head + stream.readline()), stream), chain_id, None, False
+    if offline:
+        profiling.count("trace store reads")
+        (ref, lines) = trace_store.read(tx, cast_version())
+        return lines, ref.get('chain_id'), ref.get('block'), False
+    chain_id = current_chain_id()
+    if 'block' in case:
+        block = case['block']
+    else:
+        block = code_size_cache.transaction_block(chain_id, tx, fetch_transaction_block)
+    lines = stream_cast(f"run -t --quick {tx}" + (f" --rpc-url {rpc.url}" if rpc is not None else ""))
+    if store_traces:
+        profiling.count("traces captured")
+        lines = trace_store.capture(tx, cast_version(), lines, dict(chain_id=chain_id, block=block))
+    return lines, chain_id, block, False
+
+
+def parse_test_case(case):
+    """
+    :return: the parsed trace of a test case, with the code sizes of its contracts
+    """
+    with profiling.phase("trace setup"):
+        if jobs > 1 and not debug and not call_trees and 'traceFile' in case and is_splittable(case['traceFile']):
+            # a large saved trace: parsed in segments, by -j worker processes
+            (lines, chain_id, block, struct_log) = (None, None if offline else current_chain_id(), None, False)
+        else:
+            (lines, chain_id, block, struct_log) = case_trace(case)
+    if profiling.current is not None and lines is not None:
+        # time spent waiting for cast (or reading the trace file), rather than parsing
+        lines = profiling.current.timed_lines(lines, "read trace", "json chunks" if struct_log else "lines")
+    chunk_tables = partial(code_size_cache.chunk_table, chain_id, block) if use_chunk_tables else None
+    if call_trees and struct_log:
+        raise Exception(f"Call trees are built from `cast run` traces only, not structLogs: {case['txHash']}")
+    access_events = thread_access_events()
+    with profiling.phase("parse"), parse_profiler.capture() if parse_profiler is not None else contextlib.nullcontext():
+        if lines is None:
+            trace_results = parse_trace_file_parallel(case, case['traceFile'], jobs, access_events,
+                                                      dumpall=dumpall, chunk_tables=chunk_tables)
+        elif struct_log:
+            to = case.get('to', to_address)
+            if to is None:
+                raise Exception(f"structLogs don't name the called contract: use -to {{address}} with {case['txHash']}")
+            trace_results = parse_struct_logs(case, lines, to, access_events, dumpall=dumpall,
+                                              chunk_tables=chunk_tables)
+        else:
+            trace_results = parse_trace_results(case, lines, access_events, dumpall=dumpall, debug=debug,
+                                                extra_debug=extraDebug, chunk_tables=chunk_tables)
+        if call_trees:
+            trace_results['call_tree'] = access_events.call_tree(trace_results['steps'])
+    profiling.exclusive_time("parse", "read trace")
+    profiling.count("opcodes", trace_results['steps'])
+    profiling.count("create2 addresses", sum(len(created) for created in trace_results['created_contracts'].values()))
+    if trace_results['gas_used'] is None:
+        raise Exception(f"No 'Gas used' in trace of {case['txHash']}")
+    with profiling.phase("code sizes"):
+        trace_results['code_sizes'] = code_size_cache.prefetch(chain_id, block, list(trace_results['chunks']))
+        for (address, code_chunks) in trace_results['chunks'].items():
+            code_size = trace_results['code_sizes'][address]
+            if code_size >= 0:
+                code_chunks.resize((code_size + 30) // 31)
+    if store_traces and 'traceFile' not in case:
+        with profiling.phase("store parsed"):
+            trace_store.store_parsed(case['txHash'], cast_version(), trace_results,
+                                     parsed_variant(case.get('block')))
+    return trace_results
+
+
+def load_test_case(case, reuse_parsed=False):
+    """
+    :param reuse_parsed: use the parsed data kept in the cache dir if there is one, as -reestimate does,
+        otherwise parse the trace
+    :return: the parsed trace of a test case: from its parsed data with -reestimate, otherwise parsed now
+    """
+    variant = parsed_variant(case.get('block'))
+    if 'traceFile' not in case and (reestimate or reuse_parsed and trace_store.has_parsed(
+            case['txHash'], cast_version(), variant)):
+        print(f"Evaluating transaction {case['txHash']}")
+        with profiling.phase("load parsed"):
+            (_, trace_results) = trace_store.read_parsed(case['txHash'], cast_version(), variant)
+        return trace_results
+    return parse_test_case(case)
+
+
+def estimate_test_case(case, reuse_parsed=False):
+    """
+    :param reuse_parsed: see load_test_case(). Not with call_trees: the call tree is built by the parsing
+    :return: the pre-verkle gas used of a test case, its parsed trace and its verkle estimation
+        (with its 'call_tree' if call_trees, see call_tree.call_tree_results())
+    """
+    trace_results = load_test_case(case, reuse_parsed and not call_trees)
+    with profiling.phase("estimate"):
+        verkle_results = estimate_verkle_gas_cost_difference(trace_results, names)
+        if call_trees:
+            if 'call_tree' not in trace_results:
+                raise Exception(f"No call tree for {case['txHash']}: the trace must be parsed (not with -reestimate)")
+            verkle_results['call_tree'] = call_tree_results(case, trace_results, verkle_results, names)
+            if call_tree_path is not None:
+                pending_call_trees.append(verkle_results['call_tree'])
+    return trace_results['gas_used'], trace_results, verkle_results
+
+
+# the call trees of the cases evaluated, not written yet (see write_call_trees())
+pending_call_trees = []
+call_tree_writer = None
+
+
+def write_call_trees(trees=None):
+    """
+    write call trees to -calltree
+    :param trees: the call trees of cases evaluated in a worker process, default the ones evaluated here
+    """
+    global call_tree_writer
+    if trees is None:
+        trees = list(pending_call_trees)
+        pending_call_trees.clear()
+    if not trees:
+        return
+    if call_tree_writer is None:
+        call_tree_writer = CallTreeWriter(call_tree_path)
+    for tree in trees:
+        call_tree_writer.write(tree)
 
 
 def evaluate_test_case(case):
-    output = run_cast(f"run -t --quick {case['txHash']}")
-    pre_verkle_gas_used = int(re.search(r"Gas used: (\d+)", output).groups(0)[0])
-    trace_results = parse_trace_results(case, output)
-    verkle_results = estimate_verkle_gas_cost_difference(trace_results, names)
-    print_results(case['name'], pre_verkle_gas_used, verkle_results, dumpall)
+    (pre_verkle_gas_used, _, verkle_results) = estimate_test_case(case)
+    with profiling.phase("print results"):
+        print_results(case['name'], pre_verkle_gas_used, verkle_results, dumpall)
     post_verkle_gas_used = pre_verkle_gas_used + verkle_results['total_gas_cost_difference']
     return [case['name'], pre_verkle_gas_used, post_verkle_gas_used]
 
 
-def write_csv(rows):
-    with open('verkle-effects-estimate.csv', 'w', newline='') as csvfile:
+def evaluate_multiple_case(case):
+    """
+    evaluate a test case of -multiple. Its results are not printed with -stats (unless -v)
+    :return: the CSV row of the test case, and its contract_metrics()
+    """
+    (pre_verkle_gas_used, _, verkle_results) = estimate_test_case(case)
+    if stats_path is None or verbose:
+        with profiling.phase("print results"):
+            print_results(case['name'], pre_verkle_gas_used, verkle_results, dumpall)
+    post_verkle_gas_used = pre_verkle_gas_used + verkle_results['total_gas_cost_difference']
+    return [case['name'], pre_verkle_gas_used, post_verkle_gas_used], contract_metrics(verkle_results)
+
+
+def evaluate_block_transaction(case):
+    """
+    :return: the CSV row of a transaction of a block, its parsed trace, to be merged into the block witness,
+        and its contract_metrics()
+    """
+    (pre_verkle_gas_used, trace_results, verkle_results) = estimate_test_case(case)
+    if debug or verbose:
+        print_results(case['name'], pre_verkle_gas_used, verkle_results, dumpall)
+    post_verkle_gas_used = pre_verkle_gas_used + verkle_results['total_gas_cost_difference']
+    print(f"pre-verkle gas used: {pre_verkle_gas_used}, post-verkle estimation: {post_verkle_gas_used}")
+    return [case['name'], pre_verkle_gas_used, post_verkle_gas_used], trace_results, contract_metrics(verkle_results)
+
+
+CACHE_COUNTERS = ("code size memory hits", "code size disk hits", "code size fetches")
+
+
+def evaluate_profiled(case, evaluate=evaluate_test_case):
+    """
+    evaluate a test case, with its profile if profiling is enabled
+    :return: the result of evaluate(case), and the profile of the case as a dict (None when not profiling)
+    """
+    if profile_path is None:
+        return evaluate(case), None
+    profiling.current = profiling.Profile()
+    stats_before = code_size_cache.stats()
+    try:
+        with profiling.phase("total"):
+            result = evaluate(case)
+        for (name, after, before) in zip(CACHE_COUNTERS, code_size_cache.stats(), stats_before):
+            profiling.count(name, after - before)
+        return result, profiling.current.as_dict()
+    finally:
+        profiling.current = None
+
+
+run_profile = profiling.Profile()
+profiled_cases = 0
+run_start = time.perf_counter()
+
+
+def record_profile(case, profile):
+    """
+    write the profile of a case, and add it to the rollup of the run
+    """
+    global profiled_cases
+    if profile is None:
+        return
+    with open(profile_path, "a" if profiled_cases > 0 else "w") as out:
+        profiling.write_case(out, case['name'], profile)
+    run_profile.merge(profile)
+    profiled_cases += 1
+
+
+def report_profile():
+    if profile_path is None:
+        return
+    wall = time.perf_counter() - run_start
+    with open(profile_path, "a") as out:
+        profiling.write_case(out, "total", dict(run_profile.as_dict(), cases=profiled_cases, wall=round(wall, 6)))
+    for line in profiling.report(run_profile, profiled_cases, wall):
+        print(line)
+    if parse_profiler is not None and jobs <= 1:
+        parse_profiler.dump()
+
+
+def evaluate_test_case_captured(case, evaluate=evaluate_test_case):
+    """
+    evaluate a test case in a worker process.
+    :return: the result of evaluate(case), the console output of the case, the code size cache stats it added,
+        its profile, and its call trees
+    """
+    stats_before = code_size_cache.stats()
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        (result, profile) = evaluate_profiled(case, evaluate)
+    stats = [after - before for (after, before) in zip(code_size_cache.stats(), stats_before)]
+    if parse_profiler is not None:
+        parse_profiler.dump(f"{parse_profiler.path}.{os.getpid()}")
+    trees = list(pending_call_trees)
+    pending_call_trees.clear()
+    return result, output.getvalue(), stats, profile, trees
+
+
+def worker_pool(jobs):
+    """
+    :return: a pool of `jobs` worker processes
+    """
+    # resolve once here, rather than in each worker
+    if not offline:
+        current_chain_id()
+        cast_version()
+    return multiprocessing.get_context("fork").Pool(jobs)
+
+
+def evaluate_test_cases_parallel(cases, jobs, evaluate=evaluate_test_case, pool=None):
+    """
+    evaluate test cases in a pool of worker processes.
+    :param pool: the worker_pool() to use (e.g. across the claims of a job queue). By default, one for these cases
+    :return: the results of evaluate(case) (e.g. CSV rows), as a generator in the order of the cases.
+        The output of each case is printed as a whole, in order.
+    """
+    if pool is None:
+        with worker_pool(jobs) as pool:
+            yield from evaluate_test_cases_parallel(cases, jobs, evaluate, pool)
+        return
+    for (case, (result, output, stats, profile, trees)) in zip(
+            cases, pool.imap(partial(evaluate_test_case_captured, evaluate=evaluate), cases)):
+        sys.stdout.write(output)
+        sys.stdout.flush()
+        code_size_cache.add_stats(stats)
+        record_profile(case, profile)
+        write_call_trees(trees)
+        yield result
+
+
+def evaluate_test_cases(cases, evaluate=evaluate_test_case, pool=None):
+    """
+    :param pool: see evaluate_test_cases_parallel()
+    :return: the results of evaluate(case), as a generator in the order of the cases. In parallel with -j
+        (a single case is evaluated here: its trace may be parsed in parallel instead)
+    """
+    if jobs > 1 and len(cases) > 1:
+        yield from evaluate_test_cases_parallel(cases, jobs, evaluate, pool)
+        return
+    for case in cases:
+        (result, profile) = evaluate_profiled(case, evaluate)
+        record_profile(case, profile)
+        write_call_trees()
+        yield result
+
+
+def evaluate_sweep_case(case):
+    """
+    :return: the name, pre-verkle gas used and schedule_counts() of a test case
+    """
+    trace_results = load_test_case(case)
+    with profiling.phase("estimate"):
+        return [case['name'], trace_results['gas_used'], schedule_counts(trace_results)]
+
+
+def read_schedules(path):
+    """
+    :return: (name, {parameter: cost}) of each gas schedule of a CSV file, after the current costs ("default")
+    """
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        unknown = set(reader.fieldnames or []) - {"name"} - set(SCHEDULE_PARAMETERS)
+        if unknown:
+            raise Exception(f"Unknown gas schedule parameters in {path}: {', '.join(sorted(unknown))}. "
+                            f"Known: {', '.join(SCHEDULE_PARAMETERS)}")
+        schedules = [(row['name'], {name: int(value) for (name, value) in row.items() if name != "name" and value})
+                     for row in reader]
+    if "default" not in [name for (name, _) in schedules]:
+        schedules.insert(0, ("default", {}))
+    return schedules
+
+
+def sweep_schedules(cases, schedules):
+    """
+    evaluate gas schedules on test cases: each trace is reduced once to its counts,
+    then all schedules are applied at once. Writes a row per transaction and schedule.
+    """
+    rows = list(evaluate_test_cases(cases, evaluate_sweep_case))
+    differences = sweep_gas_cost_differences([counts for (_, _, counts) in rows],
+                                             [schedule for (_, schedule) in schedules])
+    with open('verkle-schedule-sweep.csv', 'w', newline='') as csvfile:
         writer = csv.writer(csvfile)
-        writer.writerow(
-            [
-                "name",
-                "pre_verkle_gas_used",
-                "post_verkle_gas_used",
-                "marginal_pre_verkle",
-                "marginal_post_verkle"
-            ]
-        )
-        for row in rows:
-            writer.writerow(row)
+        writer.writerow(["name", "schedule", "pre_verkle_gas_used", "post_verkle_gas_used"])
+        for ((name, pre_verkle_gas_used, _), tx_differences) in zip(rows, differences):
+            for ((schedule_name, _), difference) in zip(schedules, tx_differences):
+                writer.writerow([name, schedule_name, pre_verkle_gas_used, pre_verkle_gas_used + difference])
+    print(f"{len(schedules)} gas schedules on {len(rows)} transactions written to verkle-schedule-sweep.csv")
+
+
+def block_cases(block):
+    """
+    :return: the block number, and a test case for each transaction of the block
+    """
+    if offline:
+        stored_block = trace_store.read_block(block)
+        (block, transactions) = (stored_block['block'], stored_block['transactions'])
+    else:
+        (block, transactions) = fetch_block_transactions(block)
+        trace_store.store_block(block, transactions, dict(chain_id=current_chain_id()))
+    return block, [dict(txHash=tx, name=tx, block=block) for tx in transactions]
+
+
+def evaluate_block(block, cases, stats=None):
+    """
+    evaluate all transactions of a block, merging each into the block witness as soon as it is parsed.
+    :param stats: ContractStats to add the transactions to
+    """
+    witness = BlockWitness()
+    rows = []
+    for (row, trace_results, metrics) in evaluate_test_cases(cases, evaluate_block_transaction):
+        witness.add_transaction(trace_results)
+        rows.append(row)
+        if stats is not None:
+            stats.add(metrics)
+    print_block_results(block, rows, witness.summary())
+
+
+def fetch_transaction_targets(txs):
+    """
+    :return: {tx: the address called by the transaction, None for a contract creation}
+    """
+    if rpc is not None:
+        profiling.count("rpc eth_getTransactionByHash", len(txs))
+        transactions = rpc.batch([("eth_getTransactionByHash", [tx]) for tx in txs])
+        for (tx, transaction) in zip(txs, transactions):
+            if not isinstance(transaction, dict):
+                raise Exception(f"Transaction {tx} not found: {transaction}")
+        return {tx: transaction['to'] for (tx, transaction) in zip(txs, transactions)}
+    return {tx: run_cast(f"tx {tx} to 2>/dev/null") or None for tx in txs}
+
+
+def case_strata(cases, strata_by):
+    """
+    :param strata_by: "name", or "contract" (the called contract, fetched unless the case has 'to')
+    :return: the stratum of each case, by the id of the case
+    """
+    if strata_by == "name":
+        return {id(case): case['name'] for case in cases}
+    if strata_by != "contract":
+        raise Exception(f"Unknown strata {strata_by}: expected name or contract")
+    unknown = [case['txHash'] for case in cases if case.get('to') is None]
+    if unknown and offline:
+        raise Exception("-strata contract needs the called contract of each transaction ('to' of the cases): "
+                        "not available offline")
+    targets = fetch_transaction_targets(sorted(set(unknown))) if unknown else {}
+    return {id(case): str(case.get('to') or targets[case['txHash']]).lower() for case in cases}
+
+
+def evaluate_sample_case(case):
+    """
+    evaluate a test case of -sample. Its results are only printed with -v
+    :return: the CSV row of the test case, and its total gas cost difference
+    """
+    (pre_verkle_gas_used, _, verkle_results) = estimate_test_case(case)
+    if verbose:
+        with profiling.phase("print results"):
+            print_results(case['name'], pre_verkle_gas_used, verkle_results, dumpall)
+    difference = verkle_results['total_gas_cost_difference']
+    return [case['name'], pre_verkle_gas_used, pre_verkle_gas_used + difference], difference
+
+
+# cases evaluated between checks of -precision (or -j, if more)
+SAMPLE_ROUND = 10
+SAMPLE_CSV = 'verkle-sample-cases.csv'
+
+
+def evaluate_sample(cases, sample_size, precision, strata_by, seed):
+    """
+    evaluate a stratified random sample of test cases, a round at a time, until the confidence interval
+    of the mean gas cost difference is within +/- precision (if given), or the sample is drawn.
+    The precision is only checked once each stratum has its minimum of cases (see StratifiedSample.below_minimum()).
+    Writes the sampled rows to SAMPLE_CSV (without marginal columns: their baselines are not sampled),
+    and the estimates of all the cases and of each stratum to verkle-sample-estimate.csv
+    """
+    strata = case_strata(cases, strata_by)
+    sample = StratifiedSample(cases, lambda case: strata[id(case)],
+                              len(cases) if sample_size is None else sample_size, seed)
+    if sample_size is not None and len(sample) > sample_size:
+        print(f"sample of {sample_size} raised to {len(sample)}: each stratum gets at least "
+              f"{MIN_STRATUM_SAMPLE} transactions (or all of them, if fewer)")
+    print(f"sampling up to {len(sample)} of {len(cases)} transactions, in {len(sample.strata)} strata")
+    rows = {}
+    estimate = None
+    while True:
+        drawn = sample.next_cases(max(SAMPLE_ROUND, jobs, sample.below_minimum()))
+        if not drawn:
+            break
+        for ((stratum, case), (row, difference)) in zip(
+                drawn, evaluate_test_cases([case for (_, case) in drawn], evaluate_sample_case)):
+            sample.add(stratum, difference)
+            rows[id(case)] = row
+        if precision is not None and sample.below_minimum() == 0:
+            estimate = sample.estimate()
+            print(f"{estimate['sampled']} sampled: mean gas cost difference {estimate['mean']} "
+                  f"[{estimate['mean_low']}, {estimate['mean_high']}]")
+            if (estimate['mean_high'] - estimate['mean_low']) / 2 <= precision:
+                break
+    if estimate is not None and (estimate['mean_high'] - estimate['mean_low']) / 2 > precision:
+        print(f"precision of {precision} gas not reached with the whole sample")
+    write_csv((rows[id(case)] for case in cases if id(case) in rows), SAMPLE_CSV, marginal=False)
+    estimates = sample.estimates()
+    fields = list(estimates[None])
+    with open('verkle-sample-estimate.csv', 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["stratum"] + fields)
+        for (stratum, stratum_estimate) in estimates.items():
+            writer.writerow(["all" if stratum is None else stratum] + [stratum_estimate[field] for field in fields])
+    total = estimates[None]
+    print(f"{total['sampled']} of {total['population']} transactions sampled. Gas cost difference, "
+          f"with {round(CONFIDENCE * 100)}% confidence intervals:")
+    if total['cases'] < total['population']:
+        print(f"  (partial: of the {total['cases']} transactions of the strata sampled only)")
+    for field in STATISTICS:
+        print(f"  {field}: {total[field]} [{total[field + '_low']}, {total[field + '_high']}]")
+    print(f"sampled transactions written to {SAMPLE_CSV}, "
+          f"estimates of {len(estimates) - 1} strata to verkle-sample-estimate.csv")
+
+
+# the sources the parsed data and the results depend on (not e.g. the benchmark, nor the daemon)
+RESULTS_SOURCES = ('trace_tokenizer.py', 'trace_parser.py', 'struct_log_parser.py', 'trace_segments.py',
+                   'storage_accesses.py', 'chunk_bitmap.py', 'chunk_table.py', 'create2.py', 'keccak.py',
+                   'eip4762.py', 'estimation.py', 'trace_data_file.py', 'print_results.py')
+
+
+@lru_cache(maxsize=None)
+def sources_hash():
+    """
+    :return: a hash of the sources of the estimator which its results depend on (see RESULTS_SOURCES)
+    """
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in RESULTS_SOURCES:
+        with open(os.path.join(directory, name), 'rb') as source:
+            digest.update(name.encode() + b"\0" + source.read() + b"\0")
+    return digest.hexdigest()[:12]
+
 
+def results_version():
+    """
+    :return: the version of the results of the estimation: of the estimator and of its sources (so that journals
+        and job queues are not resumed after the sources changed), with the options changing them (see results_variant)
+    """
+    version = f"{ESTIMATOR_VERSION}-{sources_hash()}"
+    return version if results_variant is None else f"{version}-{results_variant}"
 
-# Check if file exists, read file instead of running cast run
-if len(args) > 0 and os.path.exists(args[0]):
-    with open(args[0], 'r') as f:
-        cast_output = f.read()
-        estimate_verkle_gas_cost_difference(cast_output, names)
-elif len(test_cases) > 0:
-    evaluated = []
+
+def parsed_variant(block=None):
+    """
+    :param block: the block of the code sizes, if the case gives one (otherwise, the block of the transaction)
+    :return: the variant of the parsed data kept in the trace store: as the journal, parsed data of other sources
+        or other parsing options is not reused, nor data with the code sizes of another block
+    """
+    variant = sources_hash() if results_variant is None else f"{sources_hash()}.{results_variant}"
+    return variant if block is None else f"{variant}.block{block}"
+
+
+def evaluate_journaled(cases, journal, stats=None):
+    """
+    :param stats: ContractStats to add the test cases to
+    :return: the CSV rows of the test cases, as a generator in the order of the cases. The rows of the
+        transactions already in the journal are taken from it, the others are evaluated and journaled.
+    """
+    done = journal.load()
+    if stats is not None:
+        # the contract metrics are needed: evaluate again the entries journaled without them
+        done = {tx: entry for (tx, entry) in done.items() if 'contracts' in entry}
+    pending = [case for case in cases if case['txHash'] not in done]
+    if len(pending) < len(cases):
+        print(f"{len(cases) - len(pending)} of {len(cases)} test cases already evaluated, in {journal.path}")
+    results = evaluate_test_cases(pending, evaluate_multiple_case)
+    for case in cases:
+        entry = done.get(case['txHash'])
+        if entry is None:
+            (row, metrics) = next(results)
+            journal.append(case['txHash'], pre_verkle_gas_used=row[1], post_verkle_gas_used=row[2],
+                           contracts=metrics)
+        else:
+            row = [case['name'], entry['pre_verkle_gas_used'], entry['post_verkle_gas_used']]
+            metrics = entry['contracts']
+        if stats is not None:
+            stats.add(metrics)
+        yield row
+
+
+QUEUE_POLL_SECONDS = 5
+
+
+def evaluate_queued_case(case):
+    """
+    evaluate a test case of -queue: a failure is reported to the queue, rather than ending the run
+    :return: the CSV row and contract_metrics() of the test case, and None. None and the error if it failed
+    """
+    try:
+        return evaluate_multiple_case(case), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def drain_queue(queue):
+    """
+    evaluate the test cases of a job queue, -j at a time, until there are none left to claim.
+    Then waits for the cases of the other workers, to claim them again if their lease expires.
+    With -j, the worker processes are forked once, for all the claims.
+    """
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    try:
+        with queue.heartbeat(worker), (worker_pool(jobs) if jobs > 1 else contextlib.nullcontext()) as pool:
+            while True:
+                cases = queue.claim(worker, jobs)
+                if not cases:
+                    if queue.counts().get(LEASED, 0) == 0:
+                        return
+                    time.sleep(min(QUEUE_POLL_SECONDS, queue.lease_seconds / 3))
+                    continue
+                for (case, (result, error)) in zip(cases, evaluate_test_cases(cases, evaluate_queued_case, pool)):
+                    if error is not None:
+                        print(f"Evaluation of {case['txHash']} failed: {error}")
+                        queue.fail(case['txHash'], worker, error)
+                    else:
+                        (row, metrics) = result
+                        queue.complete(case['txHash'], worker, dict(
+                            pre_verkle_gas_used=row[1], post_verkle_gas_used=row[2], contracts=metrics))
+    finally:
+        queue.release(worker)
+
+
+def queued_rows(queue, stats=None):
+    """
+    :param stats: ContractStats to add the test cases to
+    :return: the CSV rows of the test cases of a job queue, as a generator in the order of the queue.
+        The gas columns of the cases given up are FAILED
+    """
+    for (case, result, error) in queue.results():
+        if error is not None:
+            yield [case['name'], FAILED, FAILED]
+            continue
+        if stats is not None:
+            stats.add(result['contracts'])
+        yield [case['name'], result['pre_verkle_gas_used'], result['post_verkle_gas_used']]
+
+
+def add_marginal_columns(rows):
+    """
+    add the marginal pre/post verkle gas of "double" and "four" cases, relative to the last baseline case before them.
+    rows must be in the order of the test cases. The marginal gas of a failed case (see queued_rows()), or relative
+    to a failed baseline, is FAILED.
+    :return: the rows, as a generator
+    """
     lastpre = 0
     lastpost = 0
-    for test_case in test_cases:
-        row = evaluate_test_case(test_case)
+    for row in rows:
         if "double" in row[0] or "four" in row[0]:
+            if row[1] == FAILED or lastpre == FAILED:
+                row += [FAILED, FAILED]
+                yield row
+                continue
             row.append(row[1] - lastpre)
             row.append(row[2] - lastpost)
         else:
             lastpre = row[1]
             lastpost = row[2]
-        evaluated.append(row)
-    write_csv(evaluated)
-else:
-    argStr = " ".join(args)
-    # cast_output = run_cast(f"run -t --quick {argStr}")
-    # estimate_verkle_effect(cast_output, names)
-    evaluate_test_case(dict(
-        txHash=argStr,
-        name='cmdline'
-    ))
+        yield row
+
+
+def write_csv(rows, path='verkle-effects-estimate.csv', marginal=True):
+    """
+    write the CSV rows as they come, so that the file has the cases evaluated so far if the run is interrupted
+    :param marginal: whether the rows have the marginal columns (see add_marginal_columns())
+    """
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        header = ["name", "pre_verkle_gas_used", "post_verkle_gas_used"]
+        if marginal:
+            header += ["marginal_pre_verkle", "marginal_post_verkle"]
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+            csvfile.flush()
+
+
+def main(argv=None):
+    """
+    run the estimation of the command line (see usage())
+    :param argv: the command line arguments, default sys.argv[1:]
+    """
+    global cast_executable, rpc, cache_dir, jobs, offline, use_chunk_tables, store_traces, reestimate, \
+        profile_path, parse_profiler, dumpall, debug, extraDebug, names, stats_path, verbose, to_address, \
+        call_trees, call_tree_path
+    test_cases = []
+    block_number = None
+    sweep_path = None
+    journal_path = "verkle-effects-estimate.journal"
+    queue_path = None
+    lease_seconds = DEFAULT_LEASE_SECONDS
+    sample_size = None
+    precision = None
+    strata_by = "name"
+    seed = None
+    args = sys.argv[1:] if argv is None else list(argv)
+    if args == []:
+        args = ["-h"]
+
+    while len(args) > 0 and re.match("^-", args[0]):
+        opt = args.pop(0)
+        if opt == "-h":
+            usage()
+        elif opt == "-c":
+            cast_executable = args.pop(0)
+        elif opt == "-rpc":
+            rpc = RpcClient(args.pop(0))
+        elif opt == "-cache":
+            cache_dir = args.pop(0)
+        elif opt == "-j":
+            jobs = int(args.pop(0))
+        elif opt == "-offline" or opt == "--offline":
+            offline = True
+        elif opt == "-chunk-tables":
+            use_chunk_tables = True
+        elif opt == "-calltree":
+            call_tree_path = args.pop(0)
+            call_trees = True
+        elif opt == "-nostore":
+            store_traces = False
+        elif opt == "-reestimate":
+            reestimate = True
+            offline = True
+        elif opt == "-profile" or opt == "--profile":
+            profile_path = args.pop(0)
+        elif opt == "-profile-parse":
+            parse_profiler = profiling.ParseProfiler(args.pop(0))
+        elif opt == "-a":
+            dumpall = True
+        elif opt == "-d":
+            debug = True
+        elif opt == "-dd":
+            debug = True
+            extraDebug = True
+        elif opt == "-contracts":
+            f = open(args.pop(0))
+            file = json.load(f)
+            names = file["contracts"]
+        elif opt == "-multiple":
+            f = open(args.pop(0))
+            multiple_results = json.load(f)
+            test_cases = multiple_results['results']
+            names = multiple_results['contracts']
+        elif opt == "-journal":
+            journal_path = args.pop(0)
+        elif opt == "-queue":
+            queue_path = args.pop(0)
+        elif opt == "-lease":
+            lease_seconds = float(args.pop(0))
+        elif opt == "-stats":
+            stats_path = args.pop(0)
+        elif opt == "-v":
+            verbose = True
+        elif opt == "-block":
+            block_number = args.pop(0)
+        elif opt == "-to":
+            to_address = args.pop(0)
+        elif opt == "-sample":
+            sample_size = int(args.pop(0))
+        elif opt == "-precision":
+            precision = float(args.pop(0))
+        elif opt == "-strata":
+            strata_by = args.pop(0)
+        elif opt == "-seed":
+            seed = int(args.pop(0))
+        elif opt == "-sweep":
+            sweep_path = args.pop(0)
+        else:
+            raise Exception("Unknown option " + opt)
+    if queue_path is not None and (sweep_path is not None or sample_size is not None or precision is not None):
+        # a worker evaluates the cases it claims: it never has all of them
+        raise Exception("-queue cannot be used with -sweep, -sample or -precision")
+
+    configure()
+
+    queue = None
+    if queue_path is not None:
+        queue = JobQueue(queue_path, results_version(), lease_seconds)
+        # the cases come from the queue, where -multiple adds its own
+        if len(test_cases) > 0:
+            queue.add(test_cases, names)
+        else:
+            names = queue.names()
+        cases = None
+    # Check if file exists, read file instead of running cast run
+    elif len(args) > 0 and os.path.exists(args[0]):
+        cases = [dict(
+            txHash=args[0],
+            name=args[0],
+            traceFile=args[0]
+        )]
+    elif block_number is not None:
+        (block_number, cases) = block_cases(block_number)
+    elif len(test_cases) > 0:
+        cases = test_cases
+    else:
+        argStr = " ".join(args)
+        # cast_output = run_cast(f"run -t --quick {argStr}")
+        # estimate_verkle_effect(cast_output, names)
+        cases = [dict(
+            txHash=argStr,
+            name='cmdline'
+        )]
+
+    contract_stats = ContractStats() if stats_path is not None else None
+    if sweep_path is not None:
+        sweep_schedules(cases, read_schedules(sweep_path))
+    elif (sample_size is not None or precision is not None) and (block_number is not None or cases is test_cases):
+        evaluate_sample(cases, sample_size, precision, strata_by, seed)
+    elif block_number is not None:
+        evaluate_block(block_number, cases, contract_stats)
+    elif queue is not None:
+        drain_queue(queue)
+        write_csv(add_marginal_columns(queued_rows(queue, contract_stats)))
+        for (tx, error) in queue.failures():
+            print(f"{tx} not evaluated, after {queue.max_attempts} attempts: {error}")
+        print(f"job queue {queue_path}: {queue.counts()}")
+    elif cases is test_cases:
+        journal = Journal(journal_path, results_version())
+        try:
+            write_csv(add_marginal_columns(evaluate_journaled(test_cases, journal, contract_stats)))
+        finally:
+            journal.close()
+    else:
+        list(evaluate_test_cases(cases))
+    if contract_stats is not None and contract_stats.transactions > 0:
+        contract_stats.write(stats_path, names)
+        print(f"statistics of {len(contract_stats.contracts)} contracts across {contract_stats.transactions} "
+              f"transactions written to {stats_path}")
+    if call_tree_writer is not None:
+        call_tree_writer.close()
+        print(f"call trees of {call_tree_writer.trees} transactions written to {call_tree_path}")
+    print(code_size_cache.report())
+    report_profile()
+
+
+if __name__ == "__main__":
+    main()